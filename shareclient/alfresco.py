@@ -9,13 +9,22 @@ mimic the action of a web browser in logging in to the Share application and per
 """
 
 import cookielib
+import httplib
+import itertools
 import json
+import mimetools
+import mimetypes
 import os
 import re
+import select
+import socket
+import threading
+import time
 import urllib
 import urllib2
 import sys
 
+from multiprocessing.pool import ThreadPool
 from xml.etree.ElementTree import XML
 
 GUID_REGEXP = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{8}')
@@ -23,6 +32,41 @@ SHARE_CLIENT_USER_AGENT = 'ShareImportExport/1.0'
 SIE_VERSION = 'Share Import-Export 1.3.0'
 CSRF_TOKEN_NAME = 'Alfresco-CSRFToken'
 
+def mapConcurrent(func, items, workers=1):
+    """Call func on each item using a pool of up to workers threads and return the results in the same 
+    order as the items. Any exception raised by a call is re-raised."""
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+def iterConcurrent(func, items, workers=1, chunkSize=None):
+    """Generator calling func on each item using a pool of up to workers threads and returning the results 
+    in the same order as the items. Items are taken from the iterable chunkSize at a time, by default four 
+    per worker, so that a large file of items read by a generator is never held in memory all at once. 
+    Any exception raised by a call is re-raised."""
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    items = iter(items)
+    pool = ThreadPool(workers)
+    try:
+        while True:
+            chunk = list(itertools.islice(items, chunkSize or workers * 4))
+            if len(chunk) == 0:
+                break
+            for result in pool.map(func, chunk):
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+
 class SurfRequest(urllib2.Request):
     """A request sent to a SpringSurf-based server. Adds support for additional method types in addition to GET and POST."""
 
@@ -197,7 +241,8 @@ class CSRFTokenHandler(urllib2.BaseHandler):
     """Adds the Alfresco-CSRFToken header to the requests for non-idempotent requests, if a value can be found in the cookie jar"""
 
     def __init__(self, cj):
-        self.cj = cj or cookielib.CookieJar()
+        # An empty jar is false, so test against None to keep a reference to the client's jar
+        self.cj = cj if cj is not None else cookielib.CookieJar()
 
     def __get_token(self):
         for cookie in self.cj:
@@ -211,12 +256,408 @@ class CSRFTokenHandler(urllib2.BaseHandler):
                 req.add_header(CSRF_TOKEN_NAME, token)
         return req
 
+class MultipartBody:
+    """Body of a multipart/form-data request, which is read from the files it contains as it is sent
+    rather than being built in memory first.
+    
+    Values in params which are file objects are sent as file parts, and all others as form fields,
+    as with MultipartPostHandler. Unicode names and values are encoded as UTF-8. The total length is
+    calculated up front from the sizes of the files, so that a Content-Length header can be sent."""
+
+    def __init__(self, params, blockSize=65536):
+        self.blockSize = blockSize
+        self.boundary = mimetools.choose_boundary()
+        self.contentType = 'multipart/form-data; boundary=%s' % (self.boundary)
+        self.parts = []
+        files = []
+        for (key, value) in params.items():
+            if isinstance(value, file):
+                files.append((key, value))
+            else:
+                self.parts.append('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (self.boundary, self._encode(key), self._encode(value)))
+        for (key, fd) in files:
+            filename = os.path.basename(fd.name)
+            contenttype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            self.parts.append('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\nContent-Type: %s\r\n\r\n' % (self.boundary, self._encode(key), self._encode(filename), contenttype))
+            self.parts.append(fd)
+            self.parts.append('\r\n')
+        self.parts.append('--%s--\r\n\r\n' % (self.boundary))
+        self.length = sum([isinstance(part, str) and len(part) or os.fstat(part.fileno()).st_size for part in self.parts])
+        self.reset()
+
+    def __len__(self):
+        return self.length
+
+    def _encode(self, value):
+        """Return a form field name or value as a byte string"""
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
+
+    def reset(self):
+        """Go back to the start of the body, so that the request can be sent again"""
+        self.index = 0
+        self.offset = 0
+        for part in self.parts:
+            if not isinstance(part, str):
+                part.seek(0)
+
+    def read(self, size=-1):
+        """Return up to size bytes of the body, reading from at most one file. Returns an empty
+        string once the end of the body has been reached."""
+        if size is None or size < 0:
+            size = self.blockSize
+        while self.index < len(self.parts):
+            part = self.parts[self.index]
+            if isinstance(part, str):
+                data = part[self.offset:self.offset + size]
+                self.offset += len(data)
+            else:
+                data = part.read(size)
+            if data:
+                return data
+            self.index += 1
+            self.offset = 0
+        return ''
+
+class ConnectionPool:
+    """Pool of persistent HTTP/1.1 connections, which may be shared between several openers.
+
+    Idle connections are held per scheme and host, with at most maxsize idle connections kept for
+    each. Counts of new, reused and discarded connections are held in the stats dictionary."""
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.idle = {}
+        self.stats = { 'new': 0, 'reused': 0, 'discarded': 0 }
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return an idle connection for the given key, or None if none is available"""
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop()
+        return None
+
+    def put(self, key, conn):
+        """Return a connection to the pool once a response has been fully read from it"""
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.maxsize:
+                conns.append(conn)
+                return
+            self.stats['discarded'] += 1
+        conn.close()
+
+    def count(self, name):
+        """Increment one of the connection counters"""
+        with self.lock:
+            self.stats[name] += 1
+
+    def getStats(self):
+        """Return a copy of the connection counters, plus the number of idle connections held"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['idle'] = sum([len(conns) for conns in self.idle.values()])
+        return stats
+
+    def clear(self):
+        """Close all idle connections"""
+        with self.lock:
+            conns = [c for l in self.idle.values() for c in l]
+            self.idle = {}
+        for conn in conns:
+            conn.close()
+
+# Methods which may safely be sent a second time if a reused connection fails
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+class PooledResponse:
+    """Wraps a httplib.HTTPResponse so that its connection is returned to the pool once the response
+    body has been read completely. If the response is closed before this, or the body is cut short,
+    the connection is dropped."""
+
+    def __init__(self, response, conn, pool, key):
+        self.response = response
+        self.conn = conn
+        self.pool = pool
+        self.key = key
+
+    def read(self, amt=None):
+        try:
+            data = self.response.read(amt)
+        except Exception:
+            self._discard()
+            raise
+        if self.response.isclosed():
+            if self.response.length:
+                # The connection was closed before the rest of the body was received
+                self._discard()
+            else:
+                self._release()
+        return data
+
+    # Used by socket._fileobject
+    recv = read
+
+    def close(self):
+        if not self.response.isclosed():
+            # Unread data is left on the connection so it cannot be reused
+            self._discard()
+        self.response.close()
+        self._release()
+
+    def _discard(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            conn.close()
+            self.pool.count('discarded')
+
+    def _release(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            if self.response.will_close:
+                conn.close()
+            else:
+                self.pool.put(self.key, conn)
+
+class KeepAliveHandlerMixin:
+    """Replaces urllib2's one-connection-per-request do_open() with one which takes connections from
+    a ConnectionPool and sends HTTP/1.1 keep-alive requests"""
+
+    def do_open(self, http_class, req, **http_conn_args):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        key = (http_class, host, tunnel_host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+        tunnel_headers = {}
+        if tunnel_host and 'Proxy-Authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+        r = None
+        conn = self.pool.get(key)
+        while conn is not None and self._isStale(conn):
+            conn.close()
+            self.pool.count('discarded')
+            conn = self.pool.get(key)
+        if conn is not None:
+            try:
+                r = self._send(conn, req, headers)
+                self.pool.count('reused')
+            except (socket.error, httplib.HTTPException), err:
+                conn.close()
+                self.pool.count('discarded')
+                # The server has probably closed the idle connection, but it may have received the 
+                # request first, so only send it again on a new connection if that is safe to do
+                if req.get_method() not in IDEMPOTENT_METHODS:
+                    raise urllib2.URLError(err)
+                self._rewind(req.get_data())
+        if r is None:
+            conn = http_class(host, timeout=req.timeout, **http_conn_args)
+            conn.set_debuglevel(self._debuglevel)
+            if tunnel_host:
+                conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+            try:
+                r = self._send(conn, req, headers)
+            except socket.error, err:
+                conn.close()
+                raise urllib2.URLError(err)
+            self.pool.count('new')
+
+        # As in urllib2, wrap the response in a socket file object to provide readline() support
+        fp = socket._fileobject(PooledResponse(r, conn, self.pool, key), close=True)
+        resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+    def _isStale(self, conn):
+        """Return True if an idle connection has been closed by the server. An idle connection should
+        have nothing to read from it, so anything readable means it has been closed or is unusable."""
+        if conn.sock is None:
+            return True
+        try:
+            return len(select.select([conn.sock], [], [], 0)[0]) > 0
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def _send(self, conn, req, headers):
+        """Send the request on the given connection and return the httplib response"""
+        header_names = [name.lower() for name in headers]
+        skips = {}
+        if 'host' in header_names:
+            skips['skip_host'] = 1
+        if 'accept-encoding' in header_names:
+            skips['skip_accept_encoding'] = 1
+        conn.putrequest(req.get_method(), req.get_selector(), **skips)
+        for (name, value) in headers.items():
+            conn.putheader(name, value)
+        conn.endheaders()
+        data = req.get_data()
+        if data is not None:
+            if hasattr(data, 'read'):
+                blockSize = getattr(data, 'blockSize', 8192)
+                block = data.read(blockSize)
+                while block:
+                    conn.send(block)
+                    block = data.read(blockSize)
+            elif isinstance(data, basestring):
+                conn.send(data)
+            else:
+                # Iterable body, e.g. from poster.encode.multipart_encode()
+                for block in data:
+                    conn.send(block)
+        return conn.getresponse(buffering=True)
+
+    def _rewind(self, data):
+        """Reset a streamed request body so that it can be sent a second time"""
+        if hasattr(data, 'seek'):
+            data.seek(0)
+        elif hasattr(data, 'reset'):
+            data.reset()
+
+class KeepAliveHTTPHandler(KeepAliveHandlerMixin, urllib2.HTTPHandler):
+    """HTTP handler using persistent connections from a ConnectionPool"""
+
+    def __init__(self, pool, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+class KeepAliveHTTPSHandler(KeepAliveHandlerMixin, urllib2.HTTPSHandler):
+    """HTTPS handler using persistent connections from a ConnectionPool"""
+
+    def __init__(self, pool, debuglevel=0):
+        urllib2.HTTPSHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+class StreamingConnectionMixin:
+    """Sends a request body which has a blockSize attribute, such as a MultipartBody, in blocks of that
+    size rather than the 8KB blocks used by httplib"""
+
+    def send(self, data):
+        if hasattr(data, 'read') and hasattr(data, 'blockSize'):
+            block = data.read(data.blockSize)
+            while block:
+                httplib.HTTPConnection.send(self, block)
+                block = data.read(data.blockSize)
+        else:
+            httplib.HTTPConnection.send(self, data)
+
+class StreamingHTTPConnection(StreamingConnectionMixin, httplib.HTTPConnection):
+    pass
+
+class StreamingHTTPSConnection(StreamingConnectionMixin, httplib.HTTPSConnection):
+    pass
+
+class StreamingHTTPHandler(urllib2.HTTPHandler):
+    """HTTP handler opening a new connection for every request, used when pooling is disabled"""
+
+    def http_open(self, req):
+        return self.do_open(StreamingHTTPConnection, req)
+
+class StreamingHTTPSHandler(urllib2.HTTPSHandler):
+    """HTTPS handler opening a new connection for every request, used when pooling is disabled"""
+
+    def https_open(self, req):
+        return self.do_open(StreamingHTTPSConnection, req, context=self._context)
+
+class ServerCapabilities:
+    """Records which variant of each version-dependent endpoint family works against a Share server, 
+    e.g. the 3.x remotestore or the 4.x remoteadm web scripts.
+    
+    If a file name is given then the variants found are persisted to it in JSON format, keyed by 
+    server URL, so that other sessions against the same server can use them. Delete the file (or 
+    the server's entry) to probe the server again, e.g. after an upgrade."""
+
+    def __init__(self, url, path=None):
+        self.url = url
+        self.path = path
+        self.variants = {}
+        self.lock = threading.Lock()
+        if path is not None:
+            self.variants.update(self._readFile().get(url, {}))
+
+    def get(self, family):
+        """Return the variant known to work for the endpoint family, or None if it is not known"""
+        return self.variants.get(family)
+
+    def set(self, family, variant):
+        """Record the variant which works for the endpoint family"""
+        with self.lock:
+            if self.variants.get(family) == variant:
+                return
+            self.variants[family] = variant
+            if self.path is not None:
+                data = self._readFile()
+                data[self.url] = self.variants
+                f = open(self.path, 'w')
+                f.write(json.dumps(data, sort_keys=True, indent=4))
+                f.close()
+
+    def _readFile(self):
+        if os.path.isfile(self.path):
+            f = open(self.path, 'r')
+            try:
+                return json.loads(f.read())
+            finally:
+                f.close()
+        return {}
+
+class FolderListingCache:
+    """Index of the items in site folders by name, so that when the nodes in a folder are looked up by 
+    path the folder only needs to be listed once. Folders are keyed by site, component and path.
+    Counts of lookups served from the index (hits) and folders listed (misses) are held in stats."""
+
+    def __init__(self):
+        self.folders = {}
+        self.stats = { 'hits': 0, 'misses': 0 }
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the dict of items by name in the given folder, or None if it has not been listed"""
+        with self.lock:
+            items = self.folders.get(key)
+            self.stats['hits' if items is not None else 'misses'] += 1
+            return items
+
+    def put(self, key, items):
+        """Add the dict of items by name in a folder to the index"""
+        with self.lock:
+            self.folders[key] = items
+
+    def getStats(self):
+        """Return a copy of the hit and miss counters, plus the number of folders held"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['folders'] = len(self.folders)
+        return stats
+
 class ShareClient:
     """Access Alfresco Share progamatically via its RESTful API"""
 
-    def __init__(self, url="http://localhost:8080/share", tenant=None, debug=0, mplib='MultipartPostHandler', timeout=300):
-        """Initialise the client"""
+    def __init__(self, url="http://localhost:8080/share", tenant=None, debug=0, mplib='streaming', timeout=300, poolSize=4, capabilitiesFile=None, uploadBlockSize=65536, capabilities=None):
+        """Initialise the client
+        
+        mplib is the library used to send multipart uploads. The default 'streaming' sends file data
+        directly from disk in blocks of uploadBlockSize bytes, using the same handlers as all other
+        requests. 'MultipartPostHandler' and 'poster' are also supported.
+        
+        poolSize is the maximum number of idle keep-alive connections held per host, shared by the 
+        regular and multipart openers. Use 0 to open a new connection for every request.
+        
+        capabilitiesFile is the name of a JSON file in which to persist the endpoint variants found 
+        to work against the server, see ServerCapabilities. Alternatively capabilities may be given to 
+        share the ServerCapabilities of another client against the same server, e.g. one logged in as 
+        a different user, so that the server does not need to be probed again."""
         self.cj = cookielib.CookieJar()
+        self.pool = ConnectionPool(poolSize) if poolSize > 0 else None
         headers = [
                    ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'), 
                    ('Accept-Charset', 'ISO-8859-1,utf-8;q=0.7,*;q=0.7'), 
@@ -224,19 +665,25 @@ class ShareClient:
                    ('User-Agent', SHARE_CLIENT_USER_AGENT)
         ]
         # Regular opener
-        opener = urllib2.build_opener(urllib2.HTTPSHandler(debuglevel=debug), urllib2.HTTPHandler(debuglevel=debug), urllib2.HTTPCookieProcessor(self.cj), CSRFTokenHandler(self.cj))
+        opener = urllib2.build_opener(*(self._getHTTPHandlers(debug) + [urllib2.HTTPCookieProcessor(self.cj), CSRFTokenHandler(self.cj)]))
         opener.addheaders = headers
         # Multipart opener
-        if mplib == 'MultipartPostHandler':
+        if mplib == 'streaming':
+            m_opener = opener
+        elif mplib == 'MultipartPostHandler':
             from MultipartPostHandler import MultipartPostHandler
-            m_opener = urllib2.build_opener(MultipartPostHandler, urllib2.HTTPSHandler(debuglevel=debug), urllib2.HTTPHandler(debuglevel=debug), urllib2.HTTPCookieProcessor(self.cj), CSRFTokenHandler(self.cj))
+            m_opener = urllib2.build_opener(*([MultipartPostHandler] + self._getHTTPHandlers(debug) + [urllib2.HTTPCookieProcessor(self.cj), CSRFTokenHandler(self.cj)]))
         elif mplib == 'poster':
             import poster.streaminghttp
-            m_opener = poster.streaminghttp.register_openers()
+            if self.pool is not None:
+                m_opener = urllib2.build_opener(*([poster.streaminghttp.StreamingHTTPRedirectHandler] + self._getHTTPHandlers(debug)))
+            else:
+                m_opener = poster.streaminghttp.register_openers()
             m_opener.add_handler(urllib2.HTTPCookieProcessor(self.cj))
         else:
             raise Exception('Bad multipart library %s' % (mplib))
-        m_opener.addheaders = headers
+        if m_opener is not opener:
+            m_opener.addheaders = headers
         
         self.url = url.rstrip('/')
         self.tenant = tenant
@@ -245,11 +692,24 @@ class ShareClient:
         self.debug = debug
         self._username = None
         self.mplib = mplib
+        self.uploadBlockSize = uploadBlockSize
         self.sitesContainer = None
         self.timeout = timeout
         self.instance = self.tenant and ShareTenant(self.url, self.tenant) or ShareInstance(self.url)
+        self.capabilities = capabilities or ServerCapabilities(self.url, capabilitiesFile)
+
+    def _getHTTPHandlers(self, debug=0):
+        """Return new HTTP and HTTPS handlers for an opener, using the connection pool if enabled"""
+        if self.pool is not None:
+            return [KeepAliveHTTPSHandler(self.pool, debuglevel=debug), KeepAliveHTTPHandler(self.pool, debuglevel=debug)]
+        else:
+            return [StreamingHTTPSHandler(debuglevel=debug), StreamingHTTPHandler(debuglevel=debug)]
+
+    def getConnectionStats(self):
+        """Return counts of new and reused connections made by the client, or None if pooling is disabled"""
+        return self.pool.getStats() if self.pool is not None else None
 
-    def doRequest(self, method, path, data=None, dataType=None):
+    def doRequest(self, method, path, data=None, dataType=None, headers={}):
         """Perform a general HTTP request against Share"""
         reqbase = self.getRequestBase()
         req = SurfRequest(url="%s/%s" % (reqbase, path), data=data, method=method)
@@ -257,6 +717,8 @@ class ShareClient:
             print "%s %s/%s" % (method, reqbase, path)
         if dataType is not None:
             req.add_header('Content-Type', dataType)
+        for (name, value) in headers.items():
+            req.add_header(name, value)
         try:
             return self.opener.open(req, timeout=self.timeout)
         except urllib2.HTTPError, e:
@@ -270,6 +732,63 @@ class ShareClient:
         """Perform a HTTP GET request against Share"""
         return self.doRequest("GET", path)
 
+    def downloadFile(self, path, filename, blockSize=65536, retries=3, progress=None):
+        """Save the response to a HTTP GET request against Share to a file, reading it in blocks
+        of blockSize bytes.
+        
+        If the connection fails part way through then the download is resumed using a HTTP Range
+        request, up to retries times. If given, progress is called after each block is written with
+        the number of bytes written and the expected total, or None if this is not known.
+        
+        Returns a dict containing the number of bytes written and the time taken in seconds."""
+        startTime = time.time()
+        written = 0
+        total = None
+        attempts = 0
+        outfile = open(filename, 'wb')
+        try:
+            while True:
+                try:
+                    headers = {}
+                    if written > 0:
+                        headers['Range'] = 'bytes=%s-' % (written)
+                    resp = self.doRequest('GET', path, headers=headers)
+                    try:
+                        if written > 0 and resp.code != 206:
+                            # Range not supported by the server, so start again from the beginning
+                            outfile.seek(0)
+                            outfile.truncate()
+                            written = 0
+                        length = resp.info().getheader('Content-Length')
+                        if length is not None:
+                            total = written + int(length)
+                        block = resp.read(blockSize)
+                        while block:
+                            outfile.write(block)
+                            written += len(block)
+                            if progress is not None:
+                                progress(written, total)
+                            block = resp.read(blockSize)
+                    finally:
+                        resp.close()
+                    if total is None or written == total:
+                        break
+                    elif written > total:
+                        raise Exception("Downloaded %s bytes from %s but expected %s" % (written, path, total))
+                    # The connection was closed before the full response was received
+                    raise httplib.IncompleteRead('', total - written)
+                except SurfRequestError:
+                    raise
+                except (socket.error, httplib.HTTPException, urllib2.URLError), e:
+                    if attempts >= retries:
+                        raise
+                    attempts += 1
+                    if self.debug == 1:
+                        print "Resuming download of %s from byte %s (%s)" % (path, written, repr(e))
+        finally:
+            outfile.close()
+        return { 'bytes': written, 'time': time.time() - startTime }
+
     def doPost(self, path, data="", dataType='application/x-www-form-urlencoded', method="POST"):
         """Perform a HTTP POST request against Share"""
         return self.doRequest(method, path, data, dataType)
@@ -304,7 +823,11 @@ class ShareClient:
         reqbase = self.url if self.tenant is None else ("%s/%s" % (self.url, self.tenant))
         requrl = "%s/%s?%s=%s" % (reqbase, path, CSRF_TOKEN_NAME, urllib.quote(self._getCSRFToken()))
         try:
-            if self.mplib == 'MultipartPostHandler':
+            if self.mplib == 'streaming':
+                body = MultipartBody(params, self.uploadBlockSize)
+                request = SurfRequest(requrl, body, {'Content-Type': body.contentType, 'Content-Length': str(len(body))})
+                return self.m_opener.open(request, timeout=self.timeout)
+            elif self.mplib == 'MultipartPostHandler':
                 return self.m_opener.open(requrl, params)
             elif self.mplib == 'poster':
                 import poster.encode
@@ -314,6 +837,38 @@ class ShareClient:
         except urllib2.HTTPError, e:
             raise SurfRequestError("POST", e.url, e.code, e.msg, e.hdrs, e.fp)
 
+    def _callVariant(self, family, variants, func, fallbackCodes=(404,), probe=None):
+        """Call func with the variant of a version-dependent endpoint family which works on this server
+        
+        If the working variant is already known then only that is called. Otherwise each variant is tried 
+        in turn, moving on to the next if a SurfRequestError with one of the fallbackCodes (or any code 
+        if fallbackCodes is None) is raised, and the first variant to succeed is recorded.
+        
+        Where func requests a data-dependent URL, which may return one of the fallbackCodes because the 
+        data is missing rather than the endpoint, probe should be given. It is called with the variant 
+        after such an error to request a resource which always exists, and only if that fails too is the 
+        next variant tried. Otherwise the variant is recorded and the original error raised."""
+        known = self.capabilities.get(family)
+        if known in variants:
+            return func(known)
+        for variant in variants:
+            try:
+                result = func(variant)
+            except SurfRequestError, e:
+                if (fallbackCodes is None or e.code in fallbackCodes) and variant != variants[-1]:
+                    if probe is None:
+                        continue
+                    try:
+                        probe(variant)
+                    except SurfRequestError, pe:
+                        if fallbackCodes is None or pe.code in fallbackCodes:
+                            continue
+                        raise e
+                    self.capabilities.set(family, variant)
+                raise
+            self.capabilities.set(family, variant)
+            return result
+
     def _getCSRFToken(self):
         """Return the latest CSRF token for this session, from cookie data. Returns an empty string if no value is found."""
         for cookie in self.cj:
@@ -329,13 +884,15 @@ class ShareClient:
         pp = ('-default-/' if self.tenant is not None else '') + 'page' # page prefix
         successurl = '/share/%s/site-index' % (pp)
         failureurl = '/share/%s/type/login?error=true' % (pp)
-        try:
-            # Try 3.2 method first, which will fail on 3.3 and above
-            resp = self.doPost('login', urllib.urlencode({'username': username, 'password': password, 'success': successurl, 'failure': failureurl}))
-            if resp.geturl().endswith('/login'): # Cloud just returns the login page - need to try again
-                resp = self.doPost('page/dologin', urllib.urlencode({'username': username, 'password': password, 'success': successurl, 'failure': failureurl}))
-        except SurfRequestError, e:
-            resp = self.doPost('page/dologin', urllib.urlencode({'username': username, 'password': password, 'success': successurl, 'failure': failureurl}))
+        params = urllib.urlencode({'username': username, 'password': password, 'success': successurl, 'failure': failureurl})
+        def login(path):
+            resp = self.doPost(path, params)
+            if path == 'login' and resp.geturl().endswith('/login'): # Cloud just returns the login page - need to try again
+                resp.close()
+                raise SurfRequestError('POST', resp.geturl(), 404, 'Not Found', {}, None)
+            return resp
+        # Try 3.2 method first, which will fail on 3.3 and above
+        resp = self._callVariant('login', ['login', 'page/dologin'], login, None)
         if (resp.geturl().endswith('/dashboard')):
             self._username = username
             resp.close()
@@ -412,8 +969,10 @@ class ShareClient:
     
     # Site functions
     
-    def getSiteInfo(self, siteId, getMetaData=False, getMemberships=False, getPages=False, getDashboardConfig=False):
-        """Get information about a site"""
+    def getSiteInfo(self, siteId, getMetaData=False, getMemberships=False, getPages=False, getDashboardConfig=False, workers=1):
+        """Get information about a site
+        
+        workers is the number of dashlets to fetch concurrently when getDashboardConfig is set"""
         siteData = self.doJSONGet('proxy/alfresco/api/sites/%s' % (urllib.quote(unicode(siteId))))
         if getMetaData:
             siteNodeRef = '/'.join(siteData['node'].split('/')[5:]).replace('/', '://', 1)
@@ -424,64 +983,38 @@ class ShareClient:
         # sitestore directly on the repository tier. As the queries are proxied through the web tier, 
         # this should still work even if the repository is running on a different server to Share.
         if getPages:
-            try:
-                dashboardResp = ShareRequest(self.instance, 'proxy/alfresco/remotestore/get/s/sitestore/alfresco/site-data/pages/site/%s/dashboard.xml' % (siteId)) \
-                    .execute(self.opener, DashboardPageResponse)
-            except SurfRequestError, e:
-                # Try 4.0 method
-                if e.code in (404, 500):
-                    dashboardResp = ShareRequest(self.instance, 'proxy/alfresco/remoteadm/get/s/sitestore/alfresco/site-data/pages/site/%s/dashboard.xml' % (siteId)) \
-                        .execute(self.opener, DashboardPageResponse)
-                else:
-                    raise e
+            dashboardResp = self._getSitestoreResource('pages/site/%s/dashboard.xml' % (siteId), DashboardPageResponse)
             siteData['sitePages'] = dashboardResp.get_site_pages()
         if getDashboardConfig:
-            siteData['dashboardConfig'] = self.getDashboardConfig('site', siteId)
+            siteData['dashboardConfig'] = self.getDashboardConfig('site', siteId, workers)
         return siteData
     
-    def getDashboardConfig(self, dashboardType, dashboardId):
+    def _getSitestoreResource(self, path, resp_class=ShareResponse):
+        """Fetch a file from the AVM sitestore on the repository tier, relative to the site-data folder
+        
+        Alfresco 3.x provides the remotestore web script for this and 4.0 the remoteadm script. The has 
+        method answers for any path, so is used to tell a missing script from a missing file."""
+        return self._callVariant('sitestore', ['remotestore', 'remoteadm'], lambda store: \
+            ShareRequest(self.instance, 'proxy/alfresco/%s/get/s/sitestore/alfresco/site-data/%s' % (store, path)).execute(self.opener, resp_class), 
+            (404, 500), # 4.0.a returns 500, 4.0.b returns 404 for the remotestore method
+            lambda store: ShareRequest(self.instance, 'proxy/alfresco/%s/has/s/sitestore/alfresco/site-data/%s' % (store, path)).execute(self.opener))
+    
+    def getDashboardConfig(self, dashboardType, dashboardId, workers=1):
         """
         Get information on a site or user dashboard
         
         dashboardType is either 'site' or 'user'
         dashboardId is the site or user ID
+        workers is the number of dashlets to fetch concurrently
         """
         try:
-            try:
-                dashboardResp = ShareRequest(self.instance, 'proxy/alfresco/remotestore/get/s/sitestore/alfresco/site-data/pages/%s/%s/dashboard.xml' % \
-                    (urllib.quote(unicode(dashboardType)), urllib.quote(unicode(dashboardId)))) \
-                    .execute(self.opener, DashboardPageResponse)
-            except SurfRequestError, e:
-                # Try 4.0 method
-                if e.code in (404, 500): # 4.0.a returns 500, 4.0.b returns 404
-                    dashboardResp = ShareRequest(self.instance, 'proxy/alfresco/remoteadm/get/s/sitestore/alfresco/site-data/pages/%s/%s/dashboard.xml' % \
-                        (urllib.quote(unicode(dashboardType)), urllib.quote(unicode(dashboardId)))) \
-                        .execute(self.opener, DashboardPageResponse)
-                else:
-                    raise e
+            dashboardResp = self._getSitestoreResource('pages/%s/%s/dashboard.xml' % \
+                (urllib.quote(unicode(dashboardType)), urllib.quote(unicode(dashboardId))), DashboardPageResponse)
             templateInstance = dashboardResp.get_template_instance()
-            dashlets = []
-            urltmpl = 'proxy/alfresco/%s/get/s/sitestore/alfresco/site-data/components/page.component-%s-%s.%s~%s~dashboard.xml'
             # Iterate through dashboard components
-            for i in [ 1, 2, 3 ]:
-                for j in [ 1, 2, 3, 4 ]:
-                    try:
-                        try:
-                            dashletResp = ShareRequest(self.instance, urltmpl % ('remotestore', i, j, urllib.quote(unicode(dashboardType)), urllib.quote(unicode(dashboardId)))) \
-                                .execute(self.opener, DashletResponse)
-                        except SurfRequestError, e:
-                            if e.code in (404, 500):
-                                dashletResp = ShareRequest(self.instance, urltmpl % ('remoteadm', i, j, urllib.quote(unicode(dashboardType)), urllib.quote(unicode(dashboardId)))) \
-                                    .execute(self.opener, DashletResponse)
-                            else:
-                                raise e
-                        dashlets.append(dashletResp.dict())
-                    except SurfRequestError, e:
-                        if e.code == 404:
-                            pass
-                        else:
-                            raise e
-            dashboardConfig = { 'dashboardPage': '%s/%s/dashboard' % (dashboardType, dashboardId), 'templateId': templateInstance, 'dashlets': dashlets }
+            positions = [ (i, j) for i in [ 1, 2, 3 ] for j in [ 1, 2, 3, 4 ] ]
+            dashlets = mapConcurrent(lambda pos: self._getDashletConfig(dashboardType, dashboardId, pos[0], pos[1]), positions, workers)
+            dashboardConfig = { 'dashboardPage': '%s/%s/dashboard' % (dashboardType, dashboardId), 'templateId': templateInstance, 'dashlets': [ d for d in dashlets if d is not None ] }
         except SurfRequestError, e:
             if e.code == 404:
                 dashboardConfig = None
@@ -489,22 +1022,42 @@ class ShareClient:
                 raise e
         return dashboardConfig
     
+    def _getDashletConfig(self, dashboardType, dashboardId, column, row):
+        """Get information on the dashlet at the given position in a dashboard, or None if there is no dashlet there"""
+        try:
+            return self._getSitestoreResource('components/page.component-%s-%s.%s~%s~dashboard.xml' % \
+                (column, row, urllib.quote(unicode(dashboardType)), urllib.quote(unicode(dashboardId))), DashletResponse).dict()
+        except SurfRequestError, e:
+            if e.code == 404:
+                return None
+            else:
+                raise e
+    
     def getSiteTags(self, siteId, componentId=""):
         """Get tagscope information on a site or site component"""
         tagData = self.doJSONGet(('proxy/alfresco/api/tagscopes/site/%s/%s/tags' % (urllib.quote(unicode(siteId)), urllib.quote(unicode(componentId)))).replace('//', '/'))
         return tagData
     
     def getSiteTagInfo(self, siteId, componentId=""):
-        """Get information on each tagged document in the site"""
+        """Get information on each tagged document in the site, or in a single site component"""
+        if componentId == "":
+            return [item for items in self.getAllSiteTagInfo(siteId).values() for item in items]
+        return self.getAllSiteTagInfo(siteId, [componentId]).get(componentId, [])
+    
+    def getAllSiteTagInfo(self, siteId, componentIds=None, pageSize=1000):
+        """Get information on each tagged document in the site in a single pass, returning a dict of lists 
+        keyed by site component. Each tag is searched for once only and the results divided between the 
+        components they belong to. Only the given components are included, if specified."""
         nodeInfo = {}
-        tagData = self.getSiteTags(siteId, componentId)
-        tagName = ""
+        tagData = self.getSiteTags(siteId, componentIds[0] if componentIds is not None and len(componentIds) == 1 else "")
         for tag in tagData['tags']:
-            tagName = tag['name']
             # Return all items matching this tag
-            result = self.doJSONGet('proxy/alfresco/slingshot/search?site=%s&term=&tag=%s&maxResults=1000&sort=&query=&repo=false' % (urllib.quote(unicode(siteId)), urllib.quote(unicode(tagName))))
-            for item in result['items']:
-                if (item['container'] == componentId or componentId == "") and item['nodeRef'] not in nodeInfo:
+            for item in self.iterTaggedItems(siteId, tag['name'], pageSize):
+                if componentIds is not None and item['container'] not in componentIds:
+                    continue
+                containerInfo = nodeInfo.setdefault(item['container'], {})
+                # Items with more than one tag are found more than once, but the path is looked up once only
+                if item['nodeRef'] not in containerInfo:
                     itemPath = None
                     if 'path' in item:
                         itemPath = item['path']
@@ -513,14 +1066,40 @@ class ShareClient:
                         itemPath = nodeJson['item']['location']['path'].strip('/')
                     if itemPath is None:
                         raise Exception("Could not determine path for node %s" % (item['nodeRef']))
-                    nodeInfo[item['nodeRef']] = { 
+                    containerInfo[item['nodeRef']] = { 
                                                  'type': item['type'], 
                                                  'name': item['name'], 
                                                  'container': item['container'], 
                                                  'path': itemPath, 
                                                  'tags': item['tags']
                                                  }
-        return nodeInfo.values()
+        return dict([(container, info.values()) for (container, info) in nodeInfo.items()])
+    
+    def iterTaggedItems(self, siteId, tagName, pageSize=1000):
+        """Generator returning all the items in a site with the given tag from the search API. Results are 
+        paged where the server supports this, otherwise the search is repeated with a larger limit until all 
+        the results are returned."""
+        startIndex = 0
+        maxResults = pageSize
+        while True:
+            result = self.doJSONGet('proxy/alfresco/slingshot/search?site=%s&term=&tag=%s&maxResults=%s&pageSize=%s&startIndex=%s&sort=&query=&repo=false' % (urllib.quote(unicode(siteId)), urllib.quote(unicode(tagName)), maxResults, pageSize, startIndex))
+            items = result['items']
+            if 'totalRecords' in result and 'startIndex' in result:
+                for item in items:
+                    yield item
+                startIndex += len(items)
+                if len(items) == 0 or startIndex >= result['totalRecords']:
+                    return
+            elif len(items) < maxResults:
+                for item in items[startIndex:]:
+                    yield item
+                return
+            else:
+                # No paging support, so the results may have been cut off at maxResults
+                for item in items[startIndex:]:
+                    yield item
+                startIndex = len(items)
+                maxResults = maxResults * 2
     
     def createSite(self, siteData):
         """Create a Share site"""
@@ -552,44 +1131,58 @@ class ShareClient:
         """Add a site member"""
         # TODO Support group and person objects as well as authority, as per web script doc
         authorityName = memberData['authority']['fullName']
-        try:
-            # For 3.4 and under
-            return self.doJSONPost('proxy/alfresco/api/sites/%s/memberships/%s' % (urllib.quote(unicode(siteName)), urllib.quote(unicode(authorityName))), json.dumps(memberData), method="PUT")
-        except SurfRequestError, e:
-            if e.code == 404:
+        def addMember(variant):
+            if variant == '3.4':
+                # For 3.4 and under
+                return self.doJSONPost('proxy/alfresco/api/sites/%s/memberships/%s' % (urllib.quote(unicode(siteName)), urllib.quote(unicode(authorityName))), json.dumps(memberData), method="PUT")
+            else:
                 # For 4.0+
                 return self.doJSONPost('proxy/alfresco/api/sites/%s/memberships' % (urllib.quote(unicode(siteName))), json.dumps(memberData), method="PUT")
-            else:
-                raise e
+        return self._callVariant('siteMembership', ['3.4', '4.0'], addMember)
 
-    def addSiteMembers(self, siteName, membersData, skipMissingMembers=False, createMissingMembers=False, authorityData=None):
-        """Add one or more site members"""
+    def addSiteMembers(self, siteName, membersData, skipMissingMembers=False, createMissingMembers=False, authorityData=None, workers=1):
+        """Add one or more site members, with up to workers members added concurrently
+        
+        If createMissingMembers is set then users who do not exist are created from authorityData['people'] 
+        where given, which is read once only to index the users who are site members by user name."""
         results = { 'membersAdded': [], 'membersCreated': [] }
-        for m in membersData:
+        peopleIndex = {}
+        indexLock = threading.Lock()
+        def getPerson(userName):
+            with indexLock:
+                if 'people' not in peopleIndex:
+                    userNames = set([m['authority']['userName'] for m in membersData if m['authority']['authorityType'] == 'USER'])
+                    peopleIndex['people'] = dict([(u['userName'], u) for u in authorityData['people'] if u['userName'] in userNames])
+                return peopleIndex['people'].get(userName)
+        def addMember(m):
             try:
-                results['membersAdded'].append({ 'member': m, 'result': self.addSiteMember(siteName, m)})
+                return ('membersAdded', { 'member': m, 'result': self.addSiteMember(siteName, m)})
             except SurfRequestError, e:
                 if skipMissingMembers == True:
-                    pass
+                    return None
                 elif createMissingMembers == True and m['authority']['authorityType'] == 'USER':
                     if authorityData['people'] is not None:
                         # Auto-create from people data
                         # TODO Throw an error if the user is not found in the data
-                        for u in authorityData['people']:
-                            if u['userName'] == m['authority']['userName']:
-                                self.createUser(u)
-                                results['membersCreated'].append({ 'member': m, 'person': u, 'result': self.addSiteMember(siteName, m)})
+                        u = getPerson(m['authority']['userName'])
+                        if u is not None:
+                            self.createUser(u)
+                            return ('membersCreated', { 'member': m, 'person': u, 'result': self.addSiteMember(siteName, m)})
+                        return None
                     else:
                         # Auto-create user based on info in their membership
                         self.createUser(m['authority'])
-                        results['membersCreated'].append({ 'member': m, 'result': self.addSiteMember(siteName, m)})
+                        return ('membersCreated', { 'member': m, 'result': self.addSiteMember(siteName, m)})
                 elif createMissingMembers == True and m['authority']['authorityType'] == 'GROUP':
                     # Auto-create group based on info in their membership
                     # TODO Support creating non-root groups properly if defined in groups file
                     self.createGroup(m['authority']['shortName'], m['authority']['displayName'], None)
-                    results['membersCreated'].append({ 'member': m, 'result': self.addSiteMember(siteName, m)})
+                    return ('membersCreated', { 'member': m, 'result': self.addSiteMember(siteName, m)})
                 else:
                     raise e
+        for result in mapConcurrent(addMember, membersData, workers):
+            if result is not None:
+                results[result[0]].append(result[1])
         return results
     
     def deleteSite(self, site):
@@ -604,6 +1197,13 @@ class ShareClient:
         #return self.doJSONPost('proxy/alfresco/api/sites', json.dumps(siteData), method="DELETE")
         return self.doJSONPost('service/modules/delete-site', json.dumps(siteData))
     
+    def _createFolder(self, parentNodeRef, name):
+        """Create a folder using the form processor, returning the form processor response"""
+        folderData = { 'alf_destination': parentNodeRef, 'prop_cm_name': name, 'prop_cm_title': name, 'prop_cm_description': '' }
+        # Type name is cm_folder up to 3.4, cm:folder in 4.0
+        return self._callVariant('folderType', ['cm_folder', 'cm:folder'], lambda folderType: \
+            self.doJSONPost('proxy/alfresco/api/type/%s/formprocessor' % (urllib.quote(folderType)), json.dumps(folderData)))
+    
     def _setSpaceRuleset(self, nodeRef, rulesetDef):
         """Set up rules on a space"""
         return self.doJSONPost('proxy/alfresco/api/node/%s/ruleset/rules' % (nodeRef.replace('://', '/')), json.dumps(rulesetDef))
@@ -615,7 +1215,6 @@ class ShareClient:
     def importSiteContent(self, siteId, containerId, f, delete=True):
         """Upload a content package into a collaboration site and extract it"""
         # Get the site metadata
-        folderType = 'cm_folder'
         siteData = self.doJSONGet('proxy/alfresco/api/sites/%s' % (urllib.quote(unicode(siteId))))
         siteNodeRef = '/'.join(siteData['node'].split('/')[5:]).replace('/', '://', 1)
         treeData = self.doJSONGet('proxy/alfresco/slingshot/doclib/treenode/node/%s' % (siteNodeRef.replace('://', '/')))
@@ -630,15 +1229,7 @@ class ShareClient:
                 tempContainerData = child
         if containerData is None:
             # Create container if it doesn't exist
-            folderData = { 'alf_destination': siteNodeRef, 'prop_cm_name': containerId, 'prop_cm_title': containerId, 'prop_cm_description': '' }
-            try:
-                createData = self.doJSONPost('proxy/alfresco/api/type/%s/formprocessor' % (urllib.quote(unicode(folderType))), json.dumps(folderData))
-            except SurfRequestError, e:
-                if e.code == 404:
-                    folderType = 'cm:folder'
-                    createData = self.doJSONPost('proxy/alfresco/api/type/%s/formprocessor' % (urllib.quote(unicode(folderType))), json.dumps(folderData))
-                else:
-                    raise e
+            createData = self._createFolder(siteNodeRef, containerId)
             containerData = { 'nodeRef': createData['persistedObject'], 'name' : containerId }
             # Add the tagscope aspect to the container - otherwise an error occurs when viewed by a site consumer
             resp = self.doPost('proxy/alfresco/slingshot/doclib/action/aspects/node/%s' % (str(containerData['nodeRef']).replace('://', '/')), '{"added":["cm:tagscope"],"removed":[]}', 'application/json;charset=UTF-8')
@@ -647,8 +1238,7 @@ class ShareClient:
             #raise Exception("Container '%s' does not exist" % (containerId))
         if tempContainerData is None:
             # Create upload container if it doesn't exist
-            folderData = { 'alf_destination': siteNodeRef, 'prop_cm_name': tempContainerName, 'prop_cm_title': tempContainerName, 'prop_cm_description': '' }
-            createData = self.doJSONPost('proxy/alfresco/api/type/%s/formprocessor' % (urllib.quote(unicode(folderType))), json.dumps(folderData))
+            createData = self._createFolder(siteNodeRef, tempContainerName)
             tempContainerData = { 'nodeRef': createData['persistedObject'], 'name' : tempContainerName }
             
         # First apply a ruleset to the temp folder
@@ -710,13 +1300,75 @@ class ShareClient:
             else:
                 raise Exception("Could not upload file (got response %s)" % (json.dumps(udata)))
     
-    def importSiteTags(self, siteId, nodeInfo):
-        """Import tags into a site component"""
-        tagInfo = {}
+    def importSiteTags(self, siteId, nodeInfo, listingCache=None, workers=1, failures=None, batchSize=1000):
+        """Import tags into a site component
+        
+        nodeInfo is iterated over twice. First the tags used which do not already exist are created, then 
+        the tags are applied to each node, with up to workers nodes updated concurrently. Nodes are found 
+        using the FolderListingCache listingCache, or a new one if not given, so that each folder is listed 
+        only once. If a list is passed as failures then a dict is appended to it for each tag which could 
+        not be created, with the 'tag' name and the 'error' raised, and for each node which could not be 
+        found or updated, with its 'container', 'path' and 'name' and the 'error' raised."""
+        if listingCache is None:
+            listingCache = FolderListingCache()
+        if failures is None:
+            failures = []
         persistedNodes = []
         
-        """Retrieve a list of all the existing tags in the system
-        Items will be something like
+        # Create any tags which do not already exist
+        tagInfo = self.getTagNodeRefs()
+        newTags = set()
+        for node in nodeInfo:
+            newTags.update([tagName for tagName in node['tags'] if tagName not in tagInfo])
+        def createTag(tagName):
+            try:
+                return (tagName, self.doJSONPost('proxy/alfresco/api/tag/workspace/SpacesStore', {'name': tagName})['nodeRef'], None)
+            except SurfRequestError, e:
+                return (tagName, None, e)
+        for (tagName, nodeRef, error) in mapConcurrent(createTag, sorted(newTags), workers):
+            if error is None:
+                tagInfo[tagName] = nodeRef
+            else:
+                failures.append({ 'tag': tagName, 'error': error })
+        
+        # Add tags to nodes
+        def tagNode(node):
+            try:
+                docResult = self._getNodeInfoByPath(siteId, node['container'], "%s/%s".replace('//', '/') % (node['path'] or '', node['name']), listingCache)
+                docNodeRef = docResult['node']['nodeRef'] if 'node' in docResult else docResult['metadata']['parent']['nodeRef']
+                tagNodeRefs = [tagInfo[tagName] for tagName in node['tags'] if tagName in tagInfo]
+                return (self.updateProperties(docNodeRef, {'prop_cm_taggable': ','.join(tagNodeRefs)})['persistedObject'], None)
+            except SurfRequestError, e:
+                if e.code == 500:
+                    return (None, e)
+                raise
+            except Exception, e:
+                if len(e.args) == 2 and e.args[0] == 'file_not_found':
+                    return (None, e)
+                raise
+        batch = []
+        for node in nodeInfo:
+            batch.append(node)
+            if len(batch) >= batchSize:
+                self._tagNodes(batch, tagNode, workers, persistedNodes, failures)
+                batch = []
+        self._tagNodes(batch, tagNode, workers, persistedNodes, failures)
+        return persistedNodes
+    
+    def _tagNodes(self, nodes, tagNode, workers, persistedNodes, failures):
+        for (node, (persisted, error)) in zip(nodes, mapConcurrent(tagNode, nodes, workers)):
+            if error is None:
+                persistedNodes.append(persisted)
+            else:
+                failures.append({ 'container': node['container'], 'path': node['path'], 'name': node['name'], 'error': error })
+    
+    def getTagNodeRefs(self, pageSize=1000):
+        """Return a dict of the nodeRefs of all the tags in the repository, keyed by tag name
+        
+        The category picker has no way to skip items, so the request is repeated with a larger size
+        until fewer items than were asked for are returned.
+        
+        Items returned by the picker will be something like
         {
             "type": "cm:category",
             "isContainer": false,
@@ -729,46 +1381,14 @@ class ShareClient:
             "nodeRef": "workspace://SpacesStore/954968a8-6d9e-41cc-a3ab-b1edfe91ea44",
             "selectable": true
         
-        },"""
-        tagData = self.doJSONGet('proxy/alfresco/api/forms/picker/category/alfresco/category/root/children?selectableType=cm:category&size=1000&aspect=cm:taggable')
-        tagItems = tagData['data']['items']
-        for item in tagItems:
-            # Cache the noderefs of tags
-            tagInfo[item['name']] = { 'nodeRef': item['nodeRef'] }
-        for node in nodeInfo:
-            docResult = None
-            try:
-                docResult = self._getNodeInfoByPath(siteId, node['container'], "%s/%s".replace('//', '/') % (node['path'] or '', node['name']))
-            except SurfRequestError, e:
-                raise
-            except Exception, e:
-                ename, edesc = e
-                if ename == 'file_not_found':
-                    print edesc
-                else:
-                    raise
-            if docResult is not None:
-                docNodeRef = docResult['node']['nodeRef'] if 'node' in docResult else docResult['metadata']['parent']['nodeRef']
-                tagNodeRefs = []
-                for tagName in node['tags']:
-                    if tagName not in tagInfo:
-                        # Add to repo via post, cache nodeRef
-                        tagResp = self.doJSONPost('proxy/alfresco/api/tag/workspace/SpacesStore', {'name': tagName})
-                        tagInfo[tagName] = { 'nodeRef': tagResp['nodeRef'] }
-                    tagNodeRefs.append(tagInfo[tagName]['nodeRef'])
-                # Add tags to document
-                try:
-                    formResult = self.updateProperties(docNodeRef, {'prop_cm_taggable': ','.join(tagNodeRefs)})
-                    persistedNodes.append(formResult['persistedObject'])
-                except SurfRequestError, e:
-                    if e.code == 500:
-                        print 'Failed to save tags %s for node %s' % (','.join(tagNodeRefs), docNodeRef)
-                        print e
-                        e.printCallStack()
-                    else:
-                        raise
-            
-        return persistedNodes
+        }"""
+        size = pageSize
+        while True:
+            tagData = self.doJSONGet('proxy/alfresco/api/forms/picker/category/alfresco/category/root/children?selectableType=cm:category&size=%s&aspect=cm:taggable' % (size))
+            tagItems = tagData['data']['items']
+            if len(tagItems) < size:
+                return dict([(item['name'], item['nodeRef']) for item in tagItems])
+            size = size * 2
     
     def deleteFile(self, f):
         return self.doJSONPost('proxy/alfresco/slingshot/doclib/action/file/node/%s' % (f.replace('://', '/')), method="DELETE")
@@ -794,24 +1414,68 @@ class ShareClient:
         for group in userData['groups']:
             userGroups.append(group['itemName'])
         for group in groups:
-            if isinstance(group, (dict)):
-                if 'fullName' in group:
-                    groupName = group['fullName']
-                elif 'itemName' in group:
-                    groupName = group['itemName']
-                else:
-                    raise Exception('Could not locate group name')
-            elif isinstance(user, (str)):
-                groupName = group
-            else:
-                raise Exception('Bad group type %s' % (type(group)))
-            
+            groupName = self._getGroupName(group)
             if groupName not in userGroups:
                 addGroups.append(groupName)
         
         putData = { 'addGroups': addGroups, 'disableAccount': False, 'email': userData['email'], 'firstName': userData['firstName'], 'lastName': userData['lastName'], 'quota': userData['quota'], 'removeGroups': [] }
         return self.doJSONPost('proxy/alfresco/api/people/%s' % (urllib.quote(unicode(userData['userName']))), json.dumps(putData), method="PUT")
     
+    def _getGroupName(self, group):
+        """Return the full name of a group given as a string or a group object"""
+        if isinstance(group, (dict)):
+            if 'fullName' in group:
+                return group['fullName']
+            elif 'itemName' in group:
+                return group['itemName']
+            else:
+                raise Exception('Could not locate group name')
+        elif isinstance(group, (str, unicode)):
+            return group
+        else:
+            raise Exception('Bad group type %s' % (type(group)))
+    
+    def assignUserGroups(self, users, workers=1):
+        """Add users to the groups listed in their 'groups' property, working group by group
+        
+        The users are inverted into a list of members for each group. The existing user members of each 
+        group are fetched once, and only the missing members are added, via the group children API. 
+        Up to workers requests are made concurrently. Returns a dict with the (group, userName) pairs 
+        'added', plus a list of 'failures', each a dict with the 'group', the 'userName' (None if the 
+        group could not be read) and the 'error' raised."""
+        groupMembers = {}
+        for u in users:
+            for group in u.get('groups', []):
+                groupMembers.setdefault(self._getGroupName(group), set()).add(u['userName'])
+        results = { 'added': [], 'failures': [] }
+        
+        def getMissingMembers(groupName):
+            try:
+                children = self.doJSONGet('proxy/alfresco/api/groups/%s/children?authorityType=USER' % (urllib.quote(unicode(groupName.replace('GROUP_', '', 1)))))['data']
+            except SurfRequestError, e:
+                return (groupName, [], e)
+            existing = set([c['shortName'] for c in children])
+            return (groupName, sorted(groupMembers[groupName] - existing), None)
+        additions = []
+        for (groupName, userNames, error) in mapConcurrent(getMissingMembers, sorted(groupMembers.keys()), workers):
+            if error is not None:
+                results['failures'].append({ 'group': groupName, 'userName': None, 'error': error })
+            additions.extend([(groupName, userName) for userName in userNames])
+        
+        def addMember(addition):
+            (groupName, userName) = addition
+            try:
+                self.doJSONPost('proxy/alfresco/api/groups/%s/children/%s' % (urllib.quote(unicode(groupName.replace('GROUP_', '', 1))), urllib.quote(unicode(userName))))
+                return None
+            except SurfRequestError, e:
+                return e
+        for (addition, error) in zip(additions, mapConcurrent(addMember, additions, workers)):
+            if error is None:
+                results['added'].append(addition)
+            else:
+                results['failures'].append({ 'group': addition[0], 'userName': addition[1], 'error': error })
+        return results
+    
     def importRmSiteContent(self, siteId, containerId, f):
         """Upload a content package into an RM site and extract it"""
         # Forces creation of the doclib container
@@ -863,15 +1527,7 @@ class ShareClient:
             
         if tempContainerData is None:
             # Create export container if it doesn't exist
-            folderData = { 'alf_destination': siteNodeRef, 'prop_cm_name': tempContainerName, 'prop_cm_title': tempContainerName, 'prop_cm_description': '' }
-            try:
-                createData = self.doJSONPost('proxy/alfresco/api/type/cm_folder/formprocessor', json.dumps(folderData))
-            except SurfRequestError, e:
-                if e.code == 404:
-                    # 4.0 syntax
-                    createData = self.doJSONPost('proxy/alfresco/api/type/%s/formprocessor' % (urllib.quote('cm:folder')), json.dumps(folderData))
-                else:
-                    raise e
+            createData = self._createFolder(siteNodeRef, tempContainerName)
             tempContainerData = { 'nodeRef': createData['persistedObject'], 'name' : tempContainerName }
         else:
             # Does the ACP file exist in the export container already?
@@ -939,20 +1595,66 @@ class ShareClient:
                     results['exportFiles'].append(child['name'])
         return results
     
-    def _getNodeInfoByPath(self, siteId, componentId, path):
-        """Return information on the specified node"""
+    def downloadAllSiteContent(self, siteId, components, getFileName, tempContainerName='export', workers=1, pollInterval=5, timeout=3600):
+        """Download the ACP files generated asynchronously by exportAllSiteContent() for each of the 
+        given components, starting each download as soon as its file appears in the export container 
+        while the others are still being generated
+        
+        getFileName is called with each component name to return the name of the local file to save 
+        to. Up to workers files are downloaded at the same time. Returns a dict of the downloadFile() 
+        results keyed by component name."""
+        exportPath = '%s/%s/%s' % (self.getSitesContainerName(), siteId, tempContainerName)
+        pending = list(components)
+        downloads = {}
+        startTime = time.time()
+        pool = ThreadPool(max(workers, 1))
         try:
-            parentPath = path[0:path.rindex('/')]
-            dl2resp = self.doJSONGet('proxy/alfresco/slingshot/doclib2/doclist/space/site/%s/%s/%s' % (urllib2.quote(siteId), urllib2.quote(componentId), urllib2.quote(parentPath.encode('utf-8'))))
-            for item in dl2resp['items']:
-                if str(item['node']['properties']['cm:name']) == str(path[path.rindex('/') + 1:]):
-                    return item
-            raise Exception('file_not_found', 'Could not find file %s in component %s, parent folder %s' % (path[path.rindex('/') + 1:], componentId, parentPath))
-        except SurfRequestError, e:
-            if e.code == 404: # Pre-4.0 method
+            while len(pending) > 0:
+                # The ACP node is only visible once the export action has committed, so it is complete
+                docList = self._getDocumentList(exportPath)
+                for component in list(pending):
+                    acpFile = '%s-%s.acp' % (siteId, component)
+                    if self._documentListHasItem(docList, acpFile):
+                        pending.remove(component)
+                        path = urllib.quote('proxy/alfresco/api/path/content/workspace/SpacesStore/Company Home/%s/%s' % (exportPath, acpFile))
+                        downloads[component] = pool.apply_async(self.downloadFile, (path, getFileName(component)))
+                if len(pending) > 0:
+                    if time.time() - startTime > timeout:
+                        raise Exception("Timed out waiting for ACP files for %s" % (', '.join(pending)))
+                    time.sleep(pollInterval)
+            return dict([(component, download.get()) for (component, download) in downloads.items()])
+        finally:
+            pool.close()
+            pool.join()
+    
+    def _getNodeInfoByPath(self, siteId, componentId, path, listingCache=None):
+        """Return information on the specified node. If a FolderListingCache is given then the parent 
+        folder listing is taken from it when possible, and added to it otherwise."""
+        parentPath = path[0:path.rindex('/')]
+        fileName = str(path[path.rindex('/') + 1:])
+        notFound = Exception('file_not_found', 'Could not find file %s in component %s, parent folder %s' % (fileName, componentId, parentPath))
+        if listingCache is not None:
+            items = listingCache.get((siteId, componentId, parentPath))
+            if items is not None:
+                if fileName not in items:
+                    raise notFound
+                return items[fileName]
+        def getNodeList(variant):
+            if variant == 'doclib2':
+                return self.doJSONGet('proxy/alfresco/slingshot/doclib2/doclist/space/site/%s/%s/%s' % (urllib2.quote(siteId), urllib2.quote(componentId), urllib2.quote(parentPath.encode('utf-8'))))
+            else: # Pre-4.0 method
                 return self.doJSONGet('proxy/alfresco/slingshot/doclib/doclist/all/node/alfresco/company/home/%s/%s/%s/%s' % (urllib2.quote(self.getSitesContainerName()), urllib2.quote(siteId), urllib2.quote(componentId), urllib2.quote(path.encode('utf-8'))))
-            else:
-                raise
+        # A missing parent folder also gives a 404, so check Company Home can be listed before falling back
+        probe = lambda variant: self.doJSONGet('proxy/alfresco/slingshot/%s/doclist/all/node/alfresco/company/home' % (variant))
+        nodeList = self._callVariant('doclist', ['doclib2', 'doclib'], getNodeList, probe=probe)
+        if self.capabilities.get('doclist') == 'doclib':
+            return nodeList
+        items = dict([(str(item['node']['properties']['cm:name']), item) for item in nodeList['items']])
+        if listingCache is not None:
+            listingCache.put((siteId, componentId, parentPath), items)
+        if fileName not in items:
+            raise notFound
+        return items[fileName]
     
     def _getDocumentList(self, space):
         """Return a list of documents in the space identified by parameter space
@@ -1084,64 +1786,121 @@ class ShareClient:
     
     # Admin functions
     
-    def getAllUsers(self, getFullDetails=False, getDashboardConfig=False, getPreferences=False, getGroups=False):
+    def getAllUsers(self, getFullDetails=False, getDashboardConfig=False, getPreferences=False, getGroups=False, workers=1):
         """Fetch information on all the person objects in the repository
         
         getFullDetails adds 'capabilities' object to the user object with booleans
         isMutable, isGuest and isAdmin
         
         getGroups adds 'groups' and 'mutability' objects. Implies getFullDetails=True.
+        
+        workers is the number of users to fetch additional information for concurrently. Users whose 
+        information could not be fetched are listed in 'failures', see _extendUserInfo.
         """
-        pdata = self.doJSONGet('proxy/alfresco/api/people')
-        self._extendUserInfo(pdata['people'], getFullDetails, getDashboardConfig, getPreferences, getGroups)
+        pdata = { 'failures': [] }
+        pdata['people'] = list(self.iterAllUsers(getFullDetails, getDashboardConfig, getPreferences, getGroups, workers, failures=pdata['failures']))
         return pdata
+    
+    def iterAllUsers(self, getFullDetails=False, getDashboardConfig=False, getPreferences=False, getGroups=False, workers=1, pageSize=100, failures=None):
+        """Generator yielding the person objects in the repository one at a time, as returned by getAllUsers()
+        
+        People are listed a page at a time (Alfresco 4.2 and above) so that the whole list does not need 
+        to be held in memory. Older versions of Alfresco do not support paging, in which case all people 
+        are listed in a single request.
         
-    def getCloudUsers(self, getFullDetails=False, getDashboardConfig=False, getPreferences=False, getGroups=False):
+        If a list is passed as failures then users whose information could not be fetched are appended to it.
+        """
+        skipCount = 0
+        while True:
+            if self.capabilities.get('peopleList') != 'unpaged':
+                pdata = self.doJSONGet('proxy/alfresco/api/people?sortBy=userName&skipCount=%s&maxResults=%s' % (skipCount, pageSize))
+                if 'paging' in pdata:
+                    self.capabilities.set('peopleList', 'paged')
+                elif len(pdata['people']) >= pageSize:
+                    # No paging support, but the list may have been truncated to maxResults
+                    self.capabilities.set('peopleList', 'unpaged')
+                    continue
+            else:
+                pdata = self.doJSONGet('proxy/alfresco/api/people')
+            people = pdata['people']
+            userFailures = self._extendUserInfo(people, getFullDetails, getDashboardConfig, getPreferences, getGroups, workers)
+            if failures is not None:
+                failures.extend(userFailures)
+            for p in people:
+                yield p
+            skipCount += len(people)
+            if 'paging' not in pdata or len(people) == 0 or skipCount >= pdata['paging']['totalItems']:
+                break
+        
+    def getCloudUsers(self, getFullDetails=False, getDashboardConfig=False, getPreferences=False, getGroups=False, workers=1):
         """Fetch information on all the person objects in the current tenant
         
         getFullDetails adds 'capabilities' object to the user object with booleans
         isMutable, isGuest and isAdmin
         
         getGroups adds 'groups' and 'mutability' objects. Implies getFullDetails=True.
+        
+        workers is the number of users to fetch additional information for concurrently. Users whose 
+        information could not be fetched are listed in 'failures', see _extendUserInfo.
+        """
+        pdata = { 'failures': [] }
+        pdata['people'] = list(self.iterCloudUsers(getFullDetails, getDashboardConfig, getPreferences, getGroups, workers, failures=pdata['failures']))
+        return pdata
+    
+    def iterCloudUsers(self, getFullDetails=False, getDashboardConfig=False, getPreferences=False, getGroups=False, workers=1, pageSize=100, failures=None):
+        """Generator yielding the person objects in the current tenant one at a time, as returned by getCloudUsers()
+        
+        If a list is passed as failures then users whose information could not be fetched are appended to it.
         """
-        pdata = { 'people': [] }
         skipCount = 0
-        pageSize = 100
         while True:
             newData = self.doJSONGet('proxy/alfresco/internal/cloud/people?sortBy=userName&skipCount=%s&maxItems=%s' % (skipCount, pageSize))
-            self._extendUserInfo(newData['data'], getFullDetails, getDashboardConfig, getPreferences, getGroups)
-            pdata['people'].extend(newData['data'])
+            userFailures = self._extendUserInfo(newData['data'], getFullDetails, getDashboardConfig, getPreferences, getGroups, workers)
+            if failures is not None:
+                failures.extend(userFailures)
+            for p in newData['data']:
+                yield p
             skipCount += pageSize
             if skipCount >= newData['paging']['totalItems']:
                 break
-        return pdata
         
-    def _extendUserInfo(self, users, getFullDetails=False, getDashboardConfig=False, getPreferences=False, getGroups=False):
+    def _extendUserInfo(self, users, getFullDetails=False, getDashboardConfig=False, getPreferences=False, getGroups=False, workers=1):
         """Fetch information on all the person objects in the repository
         
         getFullDetails adds 'capabilities' object to the user object with booleans
         isMutable, isGuest and isAdmin
         
         getGroups adds 'groups' and 'mutability' objects. Implies getFullDetails=True.
+        
+        workers is the number of users to process concurrently. The user objects are updated in place, 
+        so their order is not affected. An error fetching information for one user does not stop the 
+        others being processed; instead a list of failures is returned, each a dict with the 'userName', 
+        the 'error' message and the HTTP status 'code' (None if the error was not a HTTP error), so that 
+        the failures can be serialized along with the users.
         """
         if getFullDetails or getDashboardConfig or getPreferences:
-            for p in users:
-                if getGroups:
-                    p.update(self.doJSONGet('proxy/alfresco/api/people/%s?groups=true' % (urllib.quote(unicode(p['userName'])))))
-                    # Remove site groups and those with a GUID in them (e.g. RM security groups)
-                    groups = []
-                    for g in p['groups']:
-                        if not g['itemName'].startswith('GROUP_site_') and GUID_REGEXP.search(g['itemName']) is None:
-                            groups.append(g)
-                    p['groups'] = groups
-                elif getFullDetails:
-                    p.update(self.doJSONGet('proxy/alfresco/api/people/%s' % (urllib.quote(unicode(p['userName'])))))
-                if getDashboardConfig:
-                    dc = self.getDashboardConfig('user', p['userName'])
-                    if dc != None:
-                        p['dashboardConfig'] = dc
-                if getPreferences:
-                    p['preferences'] = self.doJSONGet('proxy/alfresco/api/people/%s/preferences' % (urllib.quote(unicode(p['userName']))))
+            def extendUser(p):
+                try:
+                    self._extendSingleUserInfo(p, getFullDetails, getDashboardConfig, getPreferences, getGroups)
+                except Exception, e:
+                    return { 'userName': p['userName'], 'error': str(e), 'code': getattr(e, 'code', None) }
+            return [ f for f in mapConcurrent(extendUser, users, workers) if f is not None ]
+        return []
+    
+    def _extendSingleUserInfo(self, p, getFullDetails=False, getDashboardConfig=False, getPreferences=False, getGroups=False):
+        """Fetch additional information on a single person object, see _extendUserInfo"""
+        if getGroups:
+            p.update(self.doJSONGet('proxy/alfresco/api/people/%s?groups=true' % (urllib.quote(unicode(p['userName'])))))
+            # Remove site groups and those with a GUID in them (e.g. RM security groups)
+            p['groups'] = [g for g in p['groups'] if self._isUserGroupExported(g['itemName'])]
+        elif getFullDetails:
+            p.update(self.doJSONGet('proxy/alfresco/api/people/%s' % (urllib.quote(unicode(p['userName'])))))
+        if getDashboardConfig:
+            dc = self.getDashboardConfig('user', p['userName'])
+            if dc != None:
+                p['dashboardConfig'] = dc
+        if getPreferences:
+            p['preferences'] = self.doJSONGet('proxy/alfresco/api/people/%s/preferences' % (urllib.quote(unicode(p['userName']))))
         
     def createUser(self, user, defaultPassword=None, defaultEmail=None):
         """Create a person object in the repository"""
@@ -1177,6 +1936,52 @@ class ShareClient:
                 if 'groups' in u and len(u['groups']) > 0:
                     self.addUserGroups(u['userName'], u['groups'])
     
+    def createUsersBulk(self, users, skip_users=[], default_password=None, default_email=None, workers=1):
+        """Create several person objects in the repository, with up to workers users created concurrently
+        
+        The user names of all the existing people are fetched first, so that users who already exist are 
+        skipped without making any further requests for them. Users are read from the users iterable a 
+        few at a time as they are created. Group memberships are then added for both new and existing 
+        users, group by group using assignUserGroups(). Returns a dict with the 'created' and 'skipped' 
+        user names, plus a list of 'failures', each a dict with the 'userName' and the 'error' raised, and
+        also the 'group' for failed group memberships."""
+        existing = set([p['userName'] for p in self.iterAllUsers()])
+        results = { 'created': [], 'skipped': [], 'failures': [] }
+        # Only the groups of each user are kept, to be added once all the users exist
+        memberships = []
+        def addMemberships(u):
+            if 'groups' in u and len(u['groups']) > 0:
+                memberships.append({ 'userName': u['userName'], 'groups': u['groups'] })
+        def newUsers():
+            for u in users:
+                if u['userName'] in skip_users:
+                    continue
+                if u['userName'] in existing:
+                    results['skipped'].append(u['userName'])
+                    addMemberships(u)
+                else:
+                    # Guard against the same user appearing twice in the list
+                    existing.add(u['userName'])
+                    yield u
+        def createUser(u):
+            print "Creating user '%s'" % (u['userName'])
+            try:
+                self.createUser(u, default_password, default_email)
+            except Exception, e:
+                if isinstance(e, urllib2.HTTPError) and e.code == 409:
+                    return ('skipped', u)
+                return ('failures', u, e)
+            return ('created', u)
+        for result in iterConcurrent(createUser, newUsers(), workers):
+            if result[0] == 'failures':
+                results['failures'].append({ 'userName': result[1]['userName'], 'error': result[2] })
+            else:
+                results[result[0]].append(result[1]['userName'])
+                addMemberships(result[1])
+        groupResults = self.assignUserGroups(memberships, workers)
+        results['failures'].extend(groupResults['failures'])
+        return results
+    
     def setUserPreferences(self, username, prefs):
         return self.doJSONPost('proxy/alfresco/api/people/%s/preferences' % (urllib.quote(unicode(username))), json.dumps(prefs))
     
@@ -1196,24 +2001,123 @@ class ShareClient:
                 else:
                     raise e
     
-    def getAllGroups(self, skipGroups=[], getSiteGroups=False, getSystemGeneratedGroups=False, zone='APP.DEFAULT'):
-        """Fetch information on all the group objects in the repository"""
+    def getAllGroups(self, skipGroups=[], getSiteGroups=False, getSystemGeneratedGroups=False, zone='APP.DEFAULT', recursive=False, workers=1):
+        """Fetch information on all the group objects in the repository
+        
+        If recursive is True then the nested groups below the root groups are also fetched, see getGroupTree()"""
+        if recursive:
+            return self.getGroupTree(skipGroups, getSiteGroups, getSystemGeneratedGroups, zone, workers)
+        return { 'groups': list(self.iterAllGroups(skipGroups, getSiteGroups, getSystemGeneratedGroups, zone)) }
+    
+    def iterAllGroups(self, skipGroups=[], getSiteGroups=False, getSystemGeneratedGroups=False, zone='APP.DEFAULT'):
+        """Generator returning each root group in the repository in turn, with its children, so
+        that groups may be written out as they are fetched"""
         gdata = self.doJSONGet('proxy/alfresco/api/rootgroups?zone=%s' % (urllib.quote(zone)))
-        groups = []
-        for g in gdata['data']:
-            if g['shortName'] not in skipGroups:
-                # Site groups
-                if g['shortName'].startswith('site_'):
-                    if getSiteGroups:
-                        groups.append(g)
-                elif GUID_REGEXP.search(g['shortName']) is not None:
-                    if getSystemGeneratedGroups:
-                        groups.append(g)
-                else:
-                    groups.append(g)
+        groups = [g for g in gdata['data'] if self._isGroupIncluded(g['shortName'], skipGroups, getSiteGroups, getSystemGeneratedGroups)]
         for g in groups:
             g['children'] = self.doJSONGet('proxy/alfresco/api/groups/%s/children' % (urllib.quote(unicode(g['shortName']))))['data']
-        return { 'groups': groups }
+            yield g
+    
+    def getGroupTree(self, skipGroups=[], getSiteGroups=False, getSystemGeneratedGroups=False, zone='APP.DEFAULT', workers=1, pageSize=1000):
+        """Fetch the root groups in the repository with their children, plus all of the groups nested below 
+        them at any depth
+        
+        The hierarchy is walked one level at a time, with the children of up to workers groups fetched 
+        concurrently. The children of each group are fetched only once, even where it belongs to several 
+        parents. Returns a dict with the root groups in 'groups', as returned by getAllGroups(), and each 
+        nested group with its own children in 'subgroups', so that every group is listed only once."""
+        gdata = self.doJSONGet('proxy/alfresco/api/rootgroups?zone=%s' % (urllib.quote(zone)))
+        roots = [g for g in gdata['data'] if self._isGroupIncluded(g['shortName'], skipGroups, getSiteGroups, getSystemGeneratedGroups)]
+        seen = set([g['shortName'] for g in roots])
+        subgroups = []
+        level = roots
+        while len(level) > 0:
+            children = mapConcurrent(lambda g: self._getGroupChildren(g['shortName'], pageSize), level, workers)
+            nextLevel = []
+            for (g, gchildren) in zip(level, children):
+                g['children'] = gchildren
+                for c in gchildren:
+                    if c['authorityType'] == 'GROUP' and c['shortName'] not in seen and \
+                            self._isGroupIncluded(c['shortName'], skipGroups, getSiteGroups, getSystemGeneratedGroups):
+                        seen.add(c['shortName'])
+                        # Copy the child so that its children are not repeated below each parent
+                        nextLevel.append(dict(c))
+            subgroups.extend(nextLevel)
+            level = nextLevel
+        return { 'groups': roots, 'subgroups': subgroups }
+    
+    def _getGroupChildren(self, shortName, pageSize=1000):
+        """Fetch all the child authorities of a group, a page at a time"""
+        children = []
+        while True:
+            cdata = self.doJSONGet('proxy/alfresco/api/groups/%s/children?skipCount=%s&maxItems=%s' % (urllib.quote(unicode(shortName)), len(children), pageSize))
+            children.extend(cdata['data'])
+            if 'paging' not in cdata or len(cdata['data']) == 0 or len(children) >= cdata['paging']['totalItems']:
+                break
+        return children
+    
+    def _isGroupIncluded(self, shortName, skipGroups=[], getSiteGroups=False, getSystemGeneratedGroups=False):
+        """Return True if a group should be exported, based on the given filters"""
+        if shortName in skipGroups:
+            return False
+        # Site groups
+        if shortName.startswith('site_'):
+            return getSiteGroups
+        elif GUID_REGEXP.search(shortName) is not None:
+            return getSystemGeneratedGroups
+        return True
+    
+    def getUserGroupIndex(self, workers=1, pageSize=100):
+        """Return the groups which each user is a member of, keyed by user name, as a list of objects with 
+        the 'itemName' and 'displayName' of each group
+        
+        The index is built from the children of every group in the repository, listed pageSize at a time,
+        so the number of requests made depends on the number of groups rather than the number of users, 
+        with up to workers made concurrently. As with getAllUsers(getGroups=True), users are listed in 
+        each group containing them directly or indirectly, including through site groups and those with a
+        GUID in them, but those groups are not themselves included.
+        
+        This is not a drop-in replacement for getAllUsers(getGroups=True). The group objects hold only 
+        the two properties above, sorted by 'itemName' rather than in the order the repository returns 
+        them for a user, and the 'capabilities' and 'immutability' objects are not available."""
+        displayNames = {}
+        skipCount = 0
+        while True:
+            gdata = self.doJSONGet('proxy/alfresco/api/groups?shortNameFilter=*&skipCount=%s&maxItems=%s' % (skipCount, pageSize))
+            for g in gdata['data']:
+                displayNames[g['fullName']] = g['displayName']
+            skipCount += len(gdata['data'])
+            if 'paging' not in gdata or len(gdata['data']) == 0 or skipCount >= gdata['paging']['totalItems']:
+                break
+        
+        def getChildren(groupName):
+            # Users in groups which are not exported are still members of the exported groups containing them
+            return self._getGroupChildren(groupName.replace('GROUP_', '', 1), pageSize)
+        groupNames = sorted(displayNames.keys())
+        parents = {}
+        userNames = set()
+        for (groupName, children) in zip(groupNames, mapConcurrent(getChildren, groupNames, workers)):
+            for c in children:
+                parents.setdefault(c['fullName'], set()).add(groupName)
+                if c['authorityType'] == 'USER':
+                    userNames.add(c['fullName'])
+        
+        def getAncestors(name, ancestors):
+            for parent in parents.get(name, []):
+                if parent not in ancestors:
+                    ancestors.add(parent)
+                    getAncestors(parent, ancestors)
+            return ancestors
+        index = {}
+        for userName in userNames:
+            index[userName] = [ { 'itemName': g, 'displayName': displayNames.get(g, g.replace('GROUP_', '', 1)) } 
+                for g in sorted(getAncestors(userName, set())) if self._isUserGroupExported(g) ]
+        return index
+    
+    def _isUserGroupExported(self, groupName):
+        """Return False for site groups and those with a GUID in them (e.g. RM security groups), which are 
+        not exported as part of user information"""
+        return not groupName.startswith('GROUP_site_') and GUID_REGEXP.search(groupName) is None
     
     def getGroup(self, name):
         """Return a single group object from the repository, or None if it does not exist"""
@@ -1234,19 +2138,48 @@ class ShareClient:
             self.doJSONPost('proxy/alfresco/api/groups/%s/children/GROUP_%s' % (urllib.quote(unicode(parent)), urllib.quote(unicode(name))))
             self.doJSONPost('proxy/alfresco/api/groups/%s' % (urllib.quote(unicode(name))), {'displayName':displayName}, method='PUT')
     
-    def createGroups(self, group, parent=None):
-        """Create a group authority with nested sub-groups"""
+    def createGroups(self, group, parent=None, subgroups=None, visited=None, members=None):
+        """Create a group authority with nested sub-groups
+        
+        subgroups is a dict of nested groups with their own children, keyed by short name, as listed in 
+        the 'subgroups' of getGroupTree(). Child groups found in it are created with their children in 
+        turn. visited is the set of short names of groups whose children have already been created, so
+        that a group belonging to several parents is only processed once. members caches the short names
+        of the child groups of each parent, so that existing memberships are not added again."""
+        if visited is None:
+            visited = set()
+        if members is None:
+            members = {}
         # Only create the group if it doesn't already exist
         if self.getGroup(group['shortName']) is None:
             self.createGroup(group['shortName'], group['displayName'], parent)
+            members[group['shortName']] = set()
+            if parent in members:
+                members[parent].add(group['shortName'])
+        elif parent is not None:
+            # The group may have been created already as a member of another parent
+            if parent not in members:
+                members[parent] = set([c['shortName'] for c in self._getGroupChildren(parent) if c['authorityType'] != 'USER'])
+            if group['shortName'] not in members[parent]:
+                self.doJSONPost('proxy/alfresco/api/groups/%s/children/GROUP_%s' % (urllib.quote(unicode(parent)), urllib.quote(unicode(group['shortName']))))
+                members[parent].add(group['shortName'])
+        if group['shortName'] in visited:
+            return
+        visited.add(group['shortName'])
         if 'children' in group:
-            if parent is None:
-                childBase = group['displayName']
-            else:
-                childBase = '%s/%s' % (parent, group['displayName'])
             for child in group['children']:
                 if child['authorityType'] != 'USER':
-                    self.createGroups(child, childBase)
+                    if subgroups is not None and child['shortName'] in subgroups:
+                        child = subgroups[child['shortName']]
+                    self.createGroups(child, group['shortName'], subgroups, visited, members)
+    
+    def createGroupTree(self, groups, subgroups=[]):
+        """Create the root groups in groups with all their nested groups, as returned by getGroupTree()"""
+        subgroupsByName = dict([(g['shortName'], g) for g in subgroups])
+        visited = set()
+        members = {}
+        for group in groups:
+            self.createGroups(group, subgroups=subgroupsByName, visited=visited, members=members)
     
     def getCategories(self, path):
         """Fetch a list of child categories at the given location, in a recursive structure"""
@@ -10,13 +10,18 @@ appropriate beans to bootstrap the site definition when Alfresco is next started
 Once generated, the JAR file can be placed in tomcat/shared/lib or tomcat/lib
 in your Alfresco installation.
 
-Usage: python create-bootstrap-package.py site-file.json package-file.jar [options]
+Usage: python create-bootstrap-package.py site-file.json [site-file.json ...] package-file.jar|directory [options]
 
 Options and arguments:
 
-site-file.json              Name of the JSON file to read site data from
+site-file.json              Name of the JSON file to read site data from. More
+                            than one file may be given, in which case a JAR 
+                            file is built for each site.
 
-package-file.jar            Name of the JAR file to package information inside
+package-file.jar            Name of the JAR file to package information inside.
+                            If more than one site file is given this is the 
+                            name of the directory to place the JAR files in, 
+                            named after each site file.
 
 --create-missing-members    Auto-create any members who do not exist in the 
                             repository
@@ -57,6 +62,30 @@ package-file.jar            Name of the JAR file to package information inside
 --config-depends            Advanced parameter for setting Spring bean 
                             dependencies
 
+--processes=n               Number of processes to use (default 1). When more
+                            than one site file is given, this many site 
+                            packages are built at the same time. For a single
+                            site, the content of this many site containers is
+                            merged into the site content ACP at the same time.
+
+--compress-level=n          Deflate compression level from 0 (no compression)
+                            to 9 for files added to the ACP and JAR files 
+                            (default 6)
+
+--store-types=list          Comma-separated list of mimetypes of files which
+                            are already compressed, to be stored in the ACP 
+                            files without deflating them. ACP files are always
+                            stored in the JAR file. Default is common image, 
+                            audio, video, PDF, Office and ZIP formats.
+
+--compress-threads=n        Number of threads used to compress files in each
+                            ACP and JAR file (default 1)
+
+--cache-dir=dir             Directory in which to cache the ACP files and 
+                            component XML generated for each site, so that 
+                            they can be reused by later builds when their 
+                            inputs have not changed
+
 -d                          Turn on debug mode
 
 -h                          Display this message
@@ -75,12 +104,17 @@ import tempfile
 import shutil
 import mimetypes
 import hashlib
+import multiprocessing
+import time
 from xml.sax.saxutils import escape
 from datetime import datetime
 import uuid
 from xml.sax.saxutils import escape
+from multiprocessing.pool import ThreadPool
 
 import alfresco
+import jsonstream
+import zipcopy
 
 global NSMAP
 NSMAP = {
@@ -147,7 +181,7 @@ def usage():
 
 def main(argv):
 
-    site_file = None
+    site_files = []
     jar_file = None
     users_file = ''
     groups_file = ''
@@ -158,24 +192,27 @@ def main(argv):
     configPath = 'alfresco/extension/sample-site-%(siteId)s-context.xml'
     configDepends = ''
     contentPath = 'alfresco/bootstrap/sample-sites'
+    processes = 1
+    compression = zipcopy.CompressionPolicy()
+    cacheDir = None
     _debug = 0
     
-    if len(argv) > 1:
-        if argv[0] == "--help" or argv[0] == "-h":
-            usage()
-            sys.exit()
-        elif argv[0].startswith('-'):
-            usage()
-            sys.exit(1)
-        else:
-            site_file = argv[0]
-            jar_file = argv[1]
+    # Site files and the JAR file or directory are given before any options
+    positional = []
+    while len(positional) < len(argv) and not argv[len(positional)].startswith('-'):
+        positional.append(argv[len(positional)])
+    if len(positional) > 1:
+        site_files = positional[0:-1]
+        jar_file = positional[-1]
+    elif len(argv) > 0 and (argv[0] == "--help" or argv[0] == "-h"):
+        usage()
+        sys.exit()
     else:
         usage()
         sys.exit(1)
         
     try:
-        opts, args = getopt.getopt(argv[2:], "hdu:p:U:", ["help", "users-file=", "users=", "groups-file=", "site-file=", "containers=", "no-content", "no-config", "config-path=", "config-depends=", "content-path="])
+        opts, args = getopt.getopt(argv[len(positional):], "hdu:p:U:", ["help", "users-file=", "users=", "groups-file=", "site-file=", "containers=", "no-content", "no-config", "config-path=", "config-depends=", "content-path=", "processes=", "compress-level=", "store-types=", "compress-threads=", "cache-dir="])
     except getopt.GetoptError, e:
         usage()
         sys.exit(1)
@@ -204,39 +241,191 @@ def main(argv):
             configPath = arg
         elif opt == '--content-path':
             contentPath = arg
-    
-    if site_file is None:
-        print "No site file specified"
-        sys.exit(1)
+        elif opt == '--processes':
+            processes = int(arg)
+        elif opt == '--compress-level':
+            compression.level = int(arg)
+        elif opt == '--store-types':
+            compression.storeTypes = [t for t in arg.split(',') if t != '']
+        elif opt == '--compress-threads':
+            compression.threads = int(arg)
+        elif opt == '--cache-dir':
+            cacheDir = arg
     
     if users_file == '':
         print "No users file specified. Use --users-file=myfile.json to include user information."
         sys.exit(1)
     
-    filenamenoext = os.path.splitext(os.path.split(site_file)[1])[0]
-    thisdir = os.path.dirname(site_file)
-    if thisdir == "":
-        thisdir = os.path.dirname(sys.argv[0])
+    # With several site files, one JAR file is built for each inside the given directory
+    builds = []
+    if len(site_files) > 1:
+        if not os.path.isdir(jar_file):
+            os.makedirs(jar_file)
+        for site_file in site_files:
+            builds.append((site_file, jar_file + os.sep + '%s.jar' % (os.path.splitext(os.path.basename(site_file))[0])))
+    else:
+        builds.append((site_files[0], jar_file))
+    # Processes in a pool cannot start pools of their own, so processes are used either for building sites 
+    # or for merging the containers of a single site, but not both
+    containerProcesses = processes if len(builds) == 1 else 1
+    buildArgs = [(site_file, site_jar_file, users_file, users, siteContainers, includeContent, includeConfig, configPath, configDepends, contentPath, compression, cacheDir, containerProcesses) for (site_file, site_jar_file) in builds]
+    
+    if processes > 1 and len(buildArgs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(buildArgs)))
+        try:
+            results = pool.map(buildPackageArgs, buildArgs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [buildPackage(*args) for args in buildArgs]
+    
+    print('')
+    for ((site_file, site_jar_file), (timings, stats)) in zip(builds, results):
+        print('Built site package \'%s\' successfully (%s)' % (site_jar_file, ', '.join(['%s %.1fs' % (stage, timings[stage]) for stage in ('content', 'people', 'users', 'groups', 'jar', 'total')])))
+        print('  %s' % (compressionSummary(stats)))
+    print('Drop the package into tomcat/shared/lib in your Alfresco 4.0 instance and restart to import the site.')
+
+def buildPackageArgs(args):
+    """Call buildPackage() with a tuple of arguments, for use with Pool.map()"""
+    return buildPackage(*args)
+
+def compressionSummary(stats):
+    """Describe the space saved by deflating files and the time saved by not compressing files
+    again, estimated from the rate at which other files were deflated"""
+    summary = 'deflated %s to %s in %.1fs, saving %s' % (formatSize(stats['deflated']), formatSize(stats['deflatedSize']), 
+        stats['deflateTime'], formatSize(stats['deflated'] - stats['deflatedSize']))
+    skipped = stats['stored'] + stats['copied']
+    if skipped > 0:
+        summary += '; stored or copied %s without compressing it' % (formatSize(skipped))
+        if stats['deflated'] > 0:
+            summary += ', saving about %.1fs' % (skipped * stats['deflateTime'] / stats['deflated'])
+    return summary
+
+def formatSize(size):
+    """Format a number of bytes for display"""
+    for unit in ('bytes', 'KB', 'MB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit) if unit != 'bytes' else '%d %s' % (size, unit)
+        size = size / 1024.0
+    return '%.1f GB' % (size)
+
+def addCompressionStats(stats1, stats2):
+    return dict([(k, stats1.get(k, 0) + stats2.get(k, 0)) for k in set(stats1.keys() + stats2.keys())])
+
+def openArchive(path, compression):
+    """Open a new ACP or JAR file for writing, returning a zipcopy.ArchiveWriter to add files to it"""
+    return zipcopy.ArchiveWriter(zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True), compression)
+
+class BuildCache:
+    """Cache of files generated by previous builds, held in a directory and keyed by a hash of the 
+    inputs used to generate each file. Input files are identified by a hash of their contents."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.fileHashes = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, *inputs):
+        """Return the cache key for a list of JSON-serializable inputs"""
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+    def fileHash(self, path):
+        """Return a hash of the contents of a file, or None if it does not exist"""
+        if not os.path.isfile(path):
+            return None
+        if path not in self.fileHashes:
+            h = hashlib.sha1()
+            f = open(path, 'rb')
+            try:
+                for block in iter(lambda: f.read(65536), ''):
+                    h.update(block)
+            finally:
+                f.close()
+            self.fileHashes[path] = h.hexdigest()
+        return self.fileHashes[path]
+
+    def get(self, key):
+        """Return the path of the cached file for the given key, or None if there is none"""
+        path = self.directory + os.sep + key
+        return path if os.path.isfile(path) else None
+
+    def put(self, key, path):
+        """Copy a file into the cache under the given key, returning the path of the cached copy. The
+        file is renamed into place once copied, so that other builds never see part of a file."""
+        cachePath = self.directory + os.sep + key
+        (fd, tempPath) = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        os.close(fd)
+        shutil.copyfile(path, tempPath)
+        if os.name == 'nt' and os.path.exists(cachePath):
+            os.remove(cachePath)
+        os.rename(tempPath, cachePath)
+        return cachePath
+
+def buildPackage(site_file, jar_file, users_file, users, siteContainers, includeContent, includeConfig, configPath, configDepends, contentPath, compression=None, cacheDir=None, containerProcesses=1):
+    """Build the JAR file for a single site. The site content ACP, people ACP, users ACP and groups data 
+    are generated at the same time in separate threads. If cacheDir is given then any of these which were
+    generated from the same inputs by an earlier build are reused. The view XML of the site containers is
+    merged in a pool of containerProcesses processes if this is greater than one, since this is where most 
+    of the CPU time goes. Returns the time taken by each stage in seconds, and the compression statistics 
+    for the ACP and JAR files."""
+    timings = {}
+    stats = {}
+    startTime = time.time()
     sd = json.loads(open(site_file).read())
+    cache = BuildCache(cacheDir) if cacheDir is not None else None
     
     # Temp working locations
     temppath = tempfile.mkdtemp(prefix='site-bootstrap-tmp-')
     
     baseName = os.path.splitext(os.path.basename(jar_file))[0]
     
-    # Generate the site ACP file - should generate ACP file in temppath
-    print 'Generating site structure and content'
-    generateContentACP('%s-content.acp' % (baseName), sd, site_file, temppath, includeContent, siteContainers)
+    # Namespaces must be registered before any of the stages output XML
+    registerNamespaces()
+    
+    # The worker processes are started here, before the stage threads, so that no threads are running
+    # when they are forked
+    containerPool = multiprocessing.Pool(containerProcesses) if containerProcesses > 1 and includeContent else None
     
-    # Person, user and group data
-    print 'Generating person, user and group data'
-    generatePeopleACP('%s-people.acp' % (baseName), sd, users_file, temppath, users)
-    generateUsersACP('%s-users.acp' % (baseName), sd, users_file, temppath, users)
-    generateGroupsData('%s-groups.txt' % (baseName), sd, users_file, temppath, None)
+    def timeStage(stage, func, fileName, *args):
+        stageStart = time.time()
+        stageStats = None
+        cacheKey = cache.key(stage, fileName, stageInputs(stage, sd, site_file, users_file, users, siteContainers, includeContent, compression, cache)) if cache is not None else None
+        cachePath = cache.get(cacheKey) if cacheKey is not None else None
+        if cachePath is not None:
+            print 'Reusing cached %s data for %s' % (stage, site_file)
+            shutil.copyfile(cachePath, temppath + os.sep + fileName)
+        else:
+            stageStats = func(fileName, *args)
+            if cacheKey is not None:
+                cache.put(cacheKey, temppath + os.sep + fileName)
+        timings[stage] = time.time() - stageStart
+        return stageStats or {}
     
-    print 'Building final JAR file'
+    # Generate the site ACP file in temppath, plus person, user and group data
+    print 'Generating site structure, content, person, user and group data for %s' % (site_file)
+    stages = [
+        ('content', generateContentACP, '%s-content.acp' % (baseName), sd, site_file, temppath, includeContent, siteContainers, compression, cache, containerPool), 
+        ('people', generatePeopleACP, '%s-people.acp' % (baseName), sd, users_file, temppath, users, compression), 
+        ('users', generateUsersACP, '%s-users.acp' % (baseName), sd, users_file, temppath, users, compression), 
+        ('groups', generateGroupsData, '%s-groups.txt' % (baseName), sd, users_file, temppath, None)
+    ]
+    stagePool = ThreadPool(len(stages))
+    try:
+        for stageStats in stagePool.map(lambda stage: timeStage(*stage), stages):
+            stats = addCompressionStats(stats, stageStats)
+    finally:
+        stagePool.close()
+        stagePool.join()
+        if containerPool is not None:
+            containerPool.close()
+            containerPool.join()
+    
+    print 'Building final JAR file %s' % (jar_file)
+    jarStart = time.time()
     # Build JAR file in current directory
-    jarFile = zipfile.ZipFile(jar_file, 'w', zipfile.ZIP_DEFLATED)
+    jarFile = openArchive(jar_file, compression)
     # Create directories (must be done explicitly)
     for i in range(1, len(configPath.split('/'))):
         jarFile.write(temppath, '/'.join(configPath.split('/')[0:i]))
@@ -267,73 +456,104 @@ def main(argv):
         jarFile.write(beanXMLPath, configPath % {'siteId': str(sd['shortName'])})
     
     # Close the JAR file
-    jarFile.close()
+    stats = addCompressionStats(stats, jarFile.close())
+    timings['jar'] = time.time() - jarStart
     
     # Tidy up temp files
     shutil.rmtree(temppath)
     
-    print('')
-    print('Built site package \'%s\' successfully. Drop this into tomcat/shared/lib in your Alfresco 4.0 instance and restart to import the site.' % (jar_file))
+    timings['total'] = time.time() - startTime
+    return (timings, stats)
+
+def stageInputs(stage, siteData, siteFile, usersFile, userNames, siteContainers, includeContent, compression, cache):
+    """Return the inputs which the output of a build stage depends on, for use as its cache key. Input 
+    files are given by the hash of their contents."""
+    compressionInputs = compression and [compression.level, compression.storeTypes]
+    if stage == 'content':
+        componentFiles = []
+        if includeContent:
+            for container in siteContainers:
+                componentFiles.extend([cache.fileHash(f) for f in getComponentFiles(siteFile, container)])
+        # Only the parts of the site data used in the site node and its configuration, so that changes to
+        # the site members do not invalidate the content
+        siteInputs = [siteData['shortName'], siteData['visibility'], siteData['metadata'], siteData['sitePages'], siteData['dashboardConfig']]
+        return [siteInputs, includeContent, siteContainers, componentFiles, compressionInputs]
+    inputs = [siteData['shortName'], siteData['memberships'], cache.fileHash(usersFile)]
+    if stage != 'groups':
+        # Groups data is always generated for all site members
+        inputs.append(userNames)
+    if stage == 'people':
+        # Profile images are added to the people ACP
+        usersFileDir = os.path.dirname(usersFile)
+        inputs.append([cache.fileHash(usersFileDir + os.sep + str(u['avatar'])) for u in getSiteUsers(siteData, usersFile, userNames) if u.get('avatar')])
+        inputs.append(compressionInputs)
+    elif stage == 'users':
+        inputs.append(compressionInputs)
+    return inputs
+
+def getComponentFiles(jsonFileName, container):
+    """Return the names of the component ACP file and tags file exported for a site container"""
+    filenamenoext = os.path.splitext(os.path.split(jsonFileName)[1])[0]
+    thisdir = os.path.dirname(jsonFileName)
+    if thisdir == "":
+        thisdir = "."
+    return (thisdir + os.sep + '%s-%s.acp' % (filenamenoext, container.replace(' ', '_')), 
+        thisdir + os.sep + '%s-%s-tags.json' % (filenamenoext, container.replace(' ', '_')))
 
 def getSiteUsers(siteData, usersFile, userNames=None):
-    users = []
-    if usersFile is not None:
-        udata = json.loads(open(usersFile, 'r').read())['people']
+    """Generator returning the users from the users file who are members of the site, in the order they 
+    appear in the file. The file is read one user at a time."""
+    memberNames = set()
     for m in siteData['memberships']:
         # Check user is on the export list or no users specified, plus they are a user (not a group!)
         if (userNames is None or str(m['authority']['userName']) in userNames) and m['authority']['authorityType'] == 'USER':
-            # Try to look up the user
-            for u in udata:
-                if u['userName'] == m['authority']['userName']:
-                    users.append(u)
-    return users
+            memberNames.add(m['authority']['userName'])
+    if usersFile is not None:
+        for u in jsonstream.ItemsFile(usersFile, 'people'):
+            if u['userName'] in memberNames:
+                yield u
 
-def generatePeopleACP(fileName, siteData, usersFile, temppath, userNames=None):
-    
-    # Make the people ACP working directory
-    extractpath = '%s/people' % (temppath)
-    os.mkdir(extractpath)
+def generatePeopleACP(fileName, siteData, usersFile, temppath, userNames=None, compression=None):
+    """Generate an ACP file containing the person nodes of the site members, with their descriptions and 
+    profile images. Each person is added to the file as it is generated. Returns the compression 
+    statistics for the file."""
     
     siteId = str(siteData['shortName'])
     # Base name for acp xml file and content folder
     fileBase = os.path.splitext(fileName)[0]
     
-    os.mkdir(extractpath + os.sep + fileBase)
-    
-    allfiles = []
-    users = getSiteUsers(siteData, usersFile, userNames)
+    acpFile = openArchive(temppath + os.sep + '%s.acp' % (fileBase), compression)
+    usersFileDir = os.path.dirname(usersFile)
     
     # People ACP
-    viewEl = generateViewXML({'{%s}exportOf' % (URI_REPOSITORY_1_0): '/sys:system/sys:people'})
-    for u in users:
+    xmlPath = temppath + os.sep + '%s.xml' % (fileBase)
+    xmlFile = open(xmlPath, 'w')
+    viewWriter = ViewXMLWriter(xmlFile, {'{%s}exportOf' % (URI_REPOSITORY_1_0): '/sys:system/sys:people'})
+    for u in getSiteUsers(siteData, usersFile, userNames):
+        # Nodes for this user are generated in a new view element, then written out
+        viewEl = etree.Element('{%s}view' % (URI_REPOSITORY_1_0))
         personEl = generatePersonXML(viewEl, u)
         # User rich text description
         userDesc = u.get('persondescription')
         if userDesc is not None and userDesc != '':
             userDescAcpPath = fileBase + '/' + '%s-userDescription' % (str(u['userName']))
-            userDescFile = open(extractpath + os.sep + userDescAcpPath.replace('/', os.sep), 'w')
-            userDescFile.write(json.dumps(userDesc))
-            userDescFile.close()
-            generatePropertyXML(personEl.find('{%s}properties' % (URI_REPOSITORY_1_0)), '{%s}persondescription' % (URI_CONTENT_1_0), generateContentURL(userDescAcpPath, extractpath, mimetype='application/octet-stream'))
-            allfiles.append(userDescAcpPath)
+            userDescContent = json.dumps(userDesc)
+            acpFile.writestr(userDescAcpPath, userDescContent, mimetype='application/octet-stream')
+            generatePropertyXML(personEl.find('{%s}properties' % (URI_REPOSITORY_1_0)), '{%s}persondescription' % (URI_CONTENT_1_0), generateContentURL(userDescAcpPath, None, mimetype='application/octet-stream', size=len(userDescContent)))
         # Add JSON prefs
         #userPrefs = u.get('preferences')
         #if userPrefs is not None and len(userPrefs) > 0:
         #    prefsAcpPath = fileBase + '/' + '%s-preferenceValues.json' % (str(u['userName']))
-        #    prefsFile = open(extractpath + os.sep + prefsAcpPath.replace('/', os.sep), 'w')
-        #    prefsFile.write(json.dumps(userPrefs))
-        #    prefsFile.close()
-        #    generatePropertyXML(personEl.find('{%s}properties' % (URI_REPOSITORY_1_0)), '{%s}preferenceValues' % (URI_CONTENT_1_0), generateContentURL(prefsAcpPath, extractpath, mimetype='text/plain'))
-        #    allfiles.append(prefsAcpPath)
+        #    prefsContent = json.dumps(userPrefs)
+        #    acpFile.writestr(prefsAcpPath, prefsContent, mimetype='text/plain')
+        #    generatePropertyXML(personEl.find('{%s}properties' % (URI_REPOSITORY_1_0)), '{%s}preferenceValues' % (URI_CONTENT_1_0), generateContentURL(prefsAcpPath, None, mimetype='text/plain', size=len(prefsContent)))
         # Avatar
-        usersFileDir = os.path.dirname(usersFile)
         avatarPath = str(u.get('avatar', ''))
         if avatarPath != '':
             print "Adding profile image for user '%s'" % (u['userName'])
             avatarName = os.path.basename(avatarPath)
-            shutil.copy(usersFileDir + os.sep + avatarPath, extractpath + os.sep + fileBase)
             avatarAcpPath = fileBase + '/' +  avatarName
-            allfiles.append(avatarAcpPath)
+            acpFile.write(usersFileDir + os.sep + avatarPath, avatarAcpPath)
             # Add cm:preferenceImage assoc
             preferenceImg = generateXMLElement(personEl.find('{%s}associations' % (URI_REPOSITORY_1_0)), '{%s}preferenceImage' % (URI_CONTENT_1_0))
             content = generateXMLElement(preferenceImg, '{%s}content' % (URI_CONTENT_1_0), {'{%s}childName' % (URI_REPOSITORY_1_0): 'cm:%s' % avatarName})
@@ -345,25 +565,21 @@ def generatePeopleACP(fileName, siteData, usersFile, temppath, userNames=None):
             generatePropertiesXML(content, {
                 '{%s}name' % (URI_CONTENT_1_0): avatarName,
                 '{%s}contentPropertyName' % (URI_CONTENT_1_0): '{%s}content' % (URI_CONTENT_1_0),
-                '{%s}content' % (URI_CONTENT_1_0): generateContentURL(avatarAcpPath, extractpath)
+                '{%s}content' % (URI_CONTENT_1_0): generateContentURL(avatarAcpPath, None, size=os.path.getsize(usersFileDir + os.sep + avatarPath))
             })
             generateReferenceXML(viewEl, 'cm:%s' % (u['userName']), ['cm:%s/cm:%s' % (u['userName'], avatarName)], '{%s}avatar' % (URI_CONTENT_1_0))
-    
-    # Output the XML
-    xmlPath = extractpath + os.sep + '%s.xml' % (fileBase)
-    xmlFile = open(xmlPath, 'w')
-    xmlFile.write(etree.tostring(viewEl, encoding='UTF-8'))
+        for el in viewEl:
+            viewWriter.write(el)
+    viewWriter.close()
     xmlFile.close()
     
-    # Build ACP file
-    acpFile = zipfile.ZipFile(temppath + os.sep + '%s.acp' % (fileBase), 'w', zipfile.ZIP_DEFLATED)
-    # Add files to the new ZIP
+    # Add the XML to the ACP file, after the content
     acpFile.write(xmlPath, '%s.xml' % (fileBase))
-    for f in allfiles:
-        acpFile.write(extractpath + os.sep + f.replace('/', os.sep), f)
-    acpFile.close()
+    return acpFile.close()
 
 def generateContentURL(path, basePath, mimetype=None, size=None, encoding='UTF-8', clocale=None):
+    """Return a content property value for a file in an ACP. If size is not given then the size of the
+    file is found from its location under basePath."""
     if mimetype is None:
         mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
     if mimetype == 'image/pjpeg':
@@ -421,39 +637,27 @@ def generatePersonXML(parent, userData):
     
     return person
 
-def generateUsersACP(fileName, siteData, usersFile, temppath, userNames=None):
-    
-    # Make the people ACP working directory
-    extractpath = '%s/users' % (temppath)
-    os.mkdir(extractpath)
+def generateUsersACP(fileName, siteData, usersFile, temppath, userNames=None, compression=None):
+    """Generate an ACP file containing the user nodes of the site members, writing each user to the view
+    XML as it is generated. Returns the compression statistics for the file."""
     
     siteId = str(siteData['shortName'])
     # Base name for acp xml file and content folder
     fileBase = os.path.splitext(fileName)[0]
     
-    os.mkdir(extractpath + os.sep + fileBase)
-    
-    allfiles = []
-    users = getSiteUsers(siteData, usersFile, userNames)
-    
     # Users ACP
-    viewEl = generateViewXML({'{%s}exportOf' % (URI_REPOSITORY_1_0): '/sys:system/sys:people'})
-    for u in users:
-        userEl = generateUserXML(viewEl, u)
-    
-    # Output the XML
-    xmlPath = extractpath + os.sep + '%s.xml' % (fileBase)
+    xmlPath = temppath + os.sep + '%s.xml' % (fileBase)
     xmlFile = open(xmlPath, 'w')
-    xmlFile.write(etree.tostring(viewEl, encoding='UTF-8'))
+    viewWriter = ViewXMLWriter(xmlFile, {'{%s}exportOf' % (URI_REPOSITORY_1_0): '/sys:system/sys:people'})
+    for u in getSiteUsers(siteData, usersFile, userNames):
+        viewWriter.write(generateUserXML(None, u))
+    viewWriter.close()
     xmlFile.close()
     
     # Build ACP file
-    acpFile = zipfile.ZipFile(temppath + os.sep + '%s.acp' % (fileBase), 'w', zipfile.ZIP_DEFLATED)
-    # Add files to the new ZIP
+    acpFile = openArchive(temppath + os.sep + '%s.acp' % (fileBase), compression)
     acpFile.write(xmlPath, '%s.xml' % (fileBase))
-    for f in allfiles:
-        acpFile.write(extractpath + os.sep + f.replace('/', os.sep), f)
-    acpFile.close()
+    return acpFile.close()
 
 def generateGroupsData(fileName, siteData, usersFile, temppath, userNames=None):
     
@@ -463,24 +667,26 @@ def generateGroupsData(fileName, siteData, usersFile, temppath, userNames=None):
     
     users = getSiteUsers(siteData, usersFile, userNames)
     
+    # Site groups of each member, from the site member data
+    siteGroups = {}
+    for m in siteData['memberships']:
+        if m['authority']['authorityType'] == 'USER':
+            siteGroups.setdefault(m['authority']['userName'], []).append('GROUP_site_%s_%s' % (siteId, str(m['role'])))
+    
     # Groups file. A user is listed per-line along with the groups they are a member of, e.g. alice=group1
-    groupsText = ''
-    for u in users:
-        groupNames = []
-        if 'groups' in u:
-            for g in u['groups']:
-                groupNames.append(g['itemName'])
-        # Look through site member data and add the right group
-        for m in siteData['memberships']:
-            if m['authority']['userName'] == u['userName'] and m['authority']['authorityType'] == 'USER':
-                groupNames.append('GROUP_site_%s_%s' % (siteId, str(m['role'])))
-        groupsText = groupsText + '%s=%s' % (u['userName'], ','.join(groupNames)) + "\n"
-    
-    # Output the text
+    # Each line is written out as the users are read.
     txtPath = temppath + os.sep + '%s.txt' % (fileBase)
     txtFile = open(txtPath, 'w')
-    txtFile.write(groupsText)
-    txtFile.close()
+    try:
+        for u in users:
+            groupNames = []
+            if 'groups' in u:
+                for g in u['groups']:
+                    groupNames.append(g['itemName'])
+            groupNames.extend(siteGroups.get(u['userName'], []))
+            txtFile.write('%s=%s' % (u['userName'], ','.join(groupNames)) + "\n")
+    finally:
+        txtFile.close()
 
 def generateUserXML(parent, userData):
     userName = str(userData['userName'])
@@ -509,8 +715,12 @@ def generateUserXML(parent, userData):
     generatePropertiesXML(user, properties)
     return user
 
-def generateContentACP(fileName, siteData, jsonFileName, temppath, includeContent, siteContainers):
-    """Generate an ACP file containing all the site contents and metadata"""
+def generateContentACP(fileName, siteData, jsonFileName, temppath, includeContent, siteContainers, compression=None, cache=None, pool=None):
+    """Generate an ACP file containing all the site contents and metadata. The nodes merged in from each 
+    component ACP are reused from the BuildCache cache if given. If a multiprocessing pool is given, the 
+    view XML of each container is merged in the pool while the content of the following containers is 
+    copied, and the results are added to the site XML in order. Returns the compression statistics for 
+    the file."""
     # TODO Override the st:site/view:properties/cm:tagScopeCache value
     
     # Make the ACP working directory
@@ -518,9 +728,6 @@ def generateContentACP(fileName, siteData, jsonFileName, temppath, includeConten
     os.mkdir(extractpath)
     
     filenamenoext = os.path.splitext(os.path.split(jsonFileName)[1])[0]
-    thisdir = os.path.dirname(jsonFileName)
-    if thisdir == "":
-        thisdir = "."
     
     siteId = str(siteData['shortName'])
     # Base name for acp xml file and content folder
@@ -530,58 +737,45 @@ def generateContentACP(fileName, siteData, jsonFileName, temppath, includeConten
     siteXML = generateSiteXML(siteData)
     allfiles = []
     siteTagCounts = []
+    # Nodes and references merged from each component view XML file, which are added to the site XML 
+    # when it is written out
+    componentFragments = []
+    # Content items are copied directly into the new ACP as they are found
+    siteAcpFile = openArchive(temppath + os.sep + '%s.acp' % (fileBase), compression)
     # Extract component ACP files
     containsEl = siteXML.find('{%s}site/{%s}associations/{%s}contains' % (URI_SITE_1_0, URI_REPOSITORY_1_0, URI_CONTENT_1_0))
     if includeContent:
         for container in siteContainers:
-            acpFile = thisdir + os.sep + '%s-%s.acp' % (filenamenoext, container.replace(' ', '_'))
+            (acpFile, jsonFile) = getComponentFiles(jsonFileName, container)
             acpXMLFile = '%s-%s.xml' % (filenamenoext, container.replace(' ', '_'))
             acpContentDir = '%s-%s' % (filenamenoext, container.replace(' ', '_'))
             if os.path.isfile(acpFile):
                 print "Adding %s content" % (container)
-                acpZip = zipfile.ZipFile(acpFile, 'r')
+                acpZip = zipfile.ZipFile(acpFile, 'r', allowZip64=True)
                 try:
-                    acpZip.extract(acpXMLFile, extractpath)
+                    acpZip.getinfo(acpXMLFile)
                 except KeyError, e:
                     acpXMLFile = '%s.xml' % (container.replace(' ', '_'))
                     acpContentDir = '%s' % (container.replace(' ', '_'))
-                    acpZip.extract(acpXMLFile, extractpath)
                 containerEl = generateSiteContainerXML(containsEl, container)
                 containerContainsEl = containerEl.find('{%s}associations/{%s}contains' % (URI_REPOSITORY_1_0, URI_CONTENT_1_0))
-                cviewEl = etree.parse('%s/%s' % (extractpath, acpXMLFile))
-                for el in list(cviewEl.getroot()):
-                    if not el.tag.startswith('{%s}' % (URI_REPOSITORY_1_0)):
-                        # Add component folders to cm:contains el in the new XML
-                        containerContainsEl.append(el)
-                    elif el.tag == '{%s}reference' % (URI_REPOSITORY_1_0):
-                        # Add to main file
-                        # TODO Use generateReferenceXML, below
-                        refBase = 'cm:%s/cm:%s' % (siteId, container)
-                        refEl = etree.Element('{%s}reference' % (URI_REPOSITORY_1_0))
-                        fromref = el.get('{%s}pathref' % (URI_REPOSITORY_1_0))
-                        if fromref is not None:
-                            refEl.set('{%s}pathref' % (URI_REPOSITORY_1_0), '%s/%s' % (refBase, fromref))
-                            associations = etree.SubElement(refEl, '{%s}associations' % (URI_REPOSITORY_1_0))
-                            references = etree.SubElement(associations, '{%s}references' % (URI_CONTENT_1_0))
-                            refs = el.findall('{%s}associations/{%s}references/{%s}reference' % (URI_REPOSITORY_1_0, URI_CONTENT_1_0, URI_REPOSITORY_1_0))
-                            for r in refs:
-                                etree.SubElement(references, '{%s}reference' % (URI_REPOSITORY_1_0), {'{%s}pathref' % (URI_REPOSITORY_1_0): '%s/%s' % (refBase, r.get('{%s}pathref' % (URI_REPOSITORY_1_0)))})
-                            siteXML.append(refEl)
+                # Component folders are added to the cm:contains el in the new XML when it is written
+                containerContainsEl.text = '@@COMPONENT-%s@@' % (len(componentFragments))
+                componentArgs = (acpFile, acpXMLFile, 'cm:%s/cm:%s' % (siteId, container), temppath, cache)
+                if pool is not None:
+                    componentFragments.append(pool.apply_async(prepareComponentXML, (componentArgs,)))
+                else:
+                    componentFragments.append(componentArgs)
                 
-                # Extract all files from the ACP file
-                filelist = acpZip.namelist()
-                extractlist = []
-                for f in filelist:
+                # Copy all content files from the ACP file, without recompressing them
+                for f in acpZip.namelist():
                     # Filter out metadata XML file and any paths starting with a slash or other non-word character
                     if re.match('[\w\-]+/.+', f):
-                        extractlist.append(f)
-                acpZip.extractall(extractpath, extractlist)
-                allfiles.extend(extractlist)
+                        siteAcpFile.copy(acpZip, f)
                 
                 acpZip.close()
                 
                 # Read component tags
-                jsonFile = thisdir + os.sep + '%s-%s-tags.json' % (filenamenoext, container.replace(' ', '_'))
                 tagCounts = []
                 if os.path.isfile(jsonFile):
                     print "Adding %s tags" % (container)
@@ -590,16 +784,16 @@ def generateContentACP(fileName, siteData, jsonFileName, temppath, includeConten
                 siteTagCounts = addTagCounts(siteTagCounts, tagCounts)
                 # Persist
                 tagScopePath = fileBase + '/' + '%s-tagScopeCache.bin' % (container.replace(' ', '_'))
-                persistContent(generateTagScopeContent(tagCounts), extractpath, tagScopePath)
-                generatePropertyXML(containerEl.find('{%s}properties' % (URI_REPOSITORY_1_0)), '{%s}tagScopeCache' % (URI_CONTENT_1_0), generateContentURL(tagScopePath, extractpath, mimetype='text/plain'))
-                allfiles.append(tagScopePath)
+                tagScopeContent = generateTagScopeContent(tagCounts)
+                siteAcpFile.writestr(tagScopePath, tagScopeContent, mimetype='text/plain')
+                generatePropertyXML(containerEl.find('{%s}properties' % (URI_REPOSITORY_1_0)), '{%s}tagScopeCache' % (URI_CONTENT_1_0), generateContentURL(tagScopePath, extractpath, mimetype='text/plain', size=len(tagScopeContent)))
         
         # Add site tagscope
         tagScopePath = fileBase + '/' + 'site-tagScopeCache.bin'
-        persistContent(generateTagScopeContent(siteTagCounts), extractpath, tagScopePath)
+        tagScopeContent = generateTagScopeContent(siteTagCounts)
+        siteAcpFile.writestr(tagScopePath, tagScopeContent, mimetype='text/plain')
         
-        generatePropertyXML(siteXML.find('{%s}site/{%s}properties' % (URI_SITE_1_0, URI_REPOSITORY_1_0)), '{%s}tagScopeCache' % (URI_CONTENT_1_0), generateContentURL(tagScopePath, extractpath, mimetype='text/plain'))
-        allfiles.append(tagScopePath)
+        generatePropertyXML(siteXML.find('{%s}site/{%s}properties' % (URI_SITE_1_0, URI_REPOSITORY_1_0)), '{%s}tagScopeCache' % (URI_CONTENT_1_0), generateContentURL(tagScopePath, extractpath, mimetype='text/plain', size=len(tagScopeContent)))
         
     # Add page names if not specified in JSON, required for building site config
     pageNames = {'documentlibrary': 'Document Library', 'wiki-page': 'Wiki', 'discussions-topiclist': 'Discussions',
@@ -611,19 +805,201 @@ def generateContentACP(fileName, siteData, jsonFileName, temppath, includeConten
     # Add site configuration
     allfiles.extend(generateSiteConfigXML(siteData, containsEl, extractpath, fileBase))
     
-    # Output the XML
+    # Output the XML, merging in the component XML
     siteXmlPath = extractpath + os.sep + '%s.xml' % (fileBase)
     siteXmlFile = open(siteXmlPath, 'w')
-    siteXmlFile.write(etree.tostring(siteXML, encoding='UTF-8'))
+    if pool is not None:
+        componentFragments = [result.get() for result in componentFragments]
+    else:
+        componentFragments = [prepareComponentXML(args) for args in componentFragments]
+    writeSiteXML(siteXML, componentFragments, siteXmlFile)
     siteXmlFile.close()
     
-    # Build ACP file
-    siteAcpFile = zipfile.ZipFile(temppath + os.sep + '%s.acp' % (fileBase), 'w', zipfile.ZIP_DEFLATED)
-    # Add files to the new ZIP
+    # Add the XML and generated configuration files to the new ZIP
     siteAcpFile.write(siteXmlPath, '%s.xml' % (fileBase))
     for f in allfiles:
         siteAcpFile.write('%s/%s' % (extractpath, f), f)
-    siteAcpFile.close()
+    return siteAcpFile.close()
+
+def prepareComponentXML(args):
+    """Merge the nodes and references of a component view XML file into separate files, for use with 
+    Pool.apply_async(). args is a tuple of the component ACP file, the name of the view XML file in it, 
+    the path which references are relative to, a directory for temporary files and a BuildCache, or 
+    None. Returns the paths of the nodes and references files, which are reused from the cache if 
+    possible."""
+    (acpFile, acpXMLFile, refBase, tempDir, cache) = args
+    if cache is not None:
+        cacheKey = cache.key('component', cache.fileHash(acpFile), acpXMLFile, refBase)
+        (nodesPath, refsPath) = (cache.get(cacheKey + '-nodes'), cache.get(cacheKey + '-refs'))
+        if nodesPath is None or refsPath is None:
+            (nodesPath, refsPath) = cacheComponentXML(acpFile, acpXMLFile, refBase, cache, cacheKey)
+        return (nodesPath, refsPath)
+    tempFiles = [tempfile.NamedTemporaryFile(dir=tempDir, prefix='component-', delete=False) for i in range(2)]
+    try:
+        acpZip = zipfile.ZipFile(acpFile, 'r', allowZip64=True)
+        mergeComponentXML(acpZip.open(acpXMLFile), tempFiles[0], tempFiles[1], refBase)
+        acpZip.close()
+    finally:
+        for f in tempFiles:
+            f.close()
+    return (tempFiles[0].name, tempFiles[1].name)
+
+def writeSiteXML(siteXML, componentFragments, outFile):
+    """Write the site view XML to outFile, copying in the nodes of each component from the files in
+    componentFragments in place of its marker, and their references at the end of the view."""
+    siteXML[-1].tail = '@@REFERENCES@@'
+    refsFile = tempfile.TemporaryFile()
+    for part in re.split('(@@[A-Z]+(?:-\d+)?@@)', etree.tostring(siteXML, encoding='UTF-8')):
+        m = re.match('@@COMPONENT-(\d+)@@$', part)
+        if m:
+            (nodesPath, refsPath) = componentFragments[int(m.group(1))]
+            for (path, f) in ((nodesPath, outFile), (refsPath, refsFile)):
+                fragmentFile = open(path, 'rb')
+                shutil.copyfileobj(fragmentFile, f)
+                fragmentFile.close()
+        elif part == '@@REFERENCES@@':
+            refsFile.seek(0)
+            shutil.copyfileobj(refsFile, outFile)
+        else:
+            outFile.write(part)
+    refsFile.close()
+
+def cacheComponentXML(acpFile, acpXMLFile, refBase, cache, cacheKey):
+    """Merge the nodes and references of a component view XML file into separate files and add them to
+    the cache, returning their cached paths"""
+    tempFiles = [tempfile.NamedTemporaryFile(delete=False) for i in range(2)]
+    try:
+        acpZip = zipfile.ZipFile(acpFile, 'r', allowZip64=True)
+        mergeComponentXML(acpZip.open(acpXMLFile), tempFiles[0], tempFiles[1], refBase)
+        acpZip.close()
+        for f in tempFiles:
+            f.close()
+        return (cache.put(cacheKey + '-nodes', tempFiles[0].name), cache.put(cacheKey + '-refs', tempFiles[1].name))
+    finally:
+        for f in tempFiles:
+            f.close()
+            os.remove(f.name)
+
+def mergeComponentXML(source, outFile, refsFile, refBase):
+    """Copy the nodes from a component view XML file to outFile as they are parsed, and write its 
+    references to refsFile with their paths rewritten relative to refBase. Only the element being 
+    parsed and its ancestors are held in memory, so memory use does not depend on the number of nodes."""
+    # Namespace declarations in scope for each open element, as dicts of URI to prefix
+    scopes = [{'http://www.w3.org/XML/1998/namespace': 'xml'}]
+    newNamespaces = []
+    stack = []
+    last = None
+    copying = False
+    for (event, item) in etree.iterparse(source, events=('start', 'end', 'start-ns')):
+        if event == 'start-ns':
+            newNamespaces.append(item)
+            continue
+        # The text or tail of the previous element is known once the next event is reached
+        if last is not None:
+            (lastEvent, lastEl) = last
+            if lastEvent == 'start':
+                if copying:
+                    outFile.write(escapeXMLText(lastEl.text))
+            elif copying or len(stack) == 1:
+                if copying:
+                    outFile.write(escapeXMLText(lastEl.tail))
+                # Discard the element now it has been written
+                stack[-1].remove(lastEl)
+        if event == 'start':
+            scope = scopes[-1]
+            if len(newNamespaces) > 0:
+                scope = dict(scope)
+                for (prefix, uri) in newNamespaces:
+                    scope[uri] = prefix
+            if len(stack) == 1:
+                copying = not item.tag.startswith('{%s}' % (URI_REPOSITORY_1_0))
+                if copying:
+                    # Declare all the namespaces in scope on each top-level node
+                    newNamespaces = [(prefix, uri) for (uri, prefix) in scope.items() if prefix != 'xml']
+            if copying:
+                outFile.write(startTagXML(item, scope, newNamespaces))
+            newNamespaces = []
+            scopes.append(scope)
+            stack.append(item)
+        else:
+            stack.pop()
+            scope = scopes.pop()
+            if copying:
+                outFile.write('</%s>' % (qualifiedName(item.tag, scope)))
+            elif len(stack) == 1 and item.tag == '{%s}reference' % (URI_REPOSITORY_1_0):
+                refEl = rewriteReferenceXML(item, refBase)
+                if refEl is not None:
+                    refsFile.write(etree.tostring(refEl, encoding='utf-8'))
+            if len(stack) == 1:
+                copying = False
+        last = (event, item)
+
+def rewriteReferenceXML(el, refBase):
+    """Return a copy of a view:reference element from a component view, with the paths rewritten
+    relative to refBase, or None if it has no pathref"""
+    # TODO Use generateReferenceXML, below
+    fromref = el.get('{%s}pathref' % (URI_REPOSITORY_1_0))
+    if fromref is None:
+        return None
+    refEl = etree.Element('{%s}reference' % (URI_REPOSITORY_1_0))
+    refEl.set('{%s}pathref' % (URI_REPOSITORY_1_0), '%s/%s' % (refBase, fromref))
+    associations = etree.SubElement(refEl, '{%s}associations' % (URI_REPOSITORY_1_0))
+    references = etree.SubElement(associations, '{%s}references' % (URI_CONTENT_1_0))
+    refs = el.findall('{%s}associations/{%s}references/{%s}reference' % (URI_REPOSITORY_1_0, URI_CONTENT_1_0, URI_REPOSITORY_1_0))
+    for r in refs:
+        etree.SubElement(references, '{%s}reference' % (URI_REPOSITORY_1_0), {'{%s}pathref' % (URI_REPOSITORY_1_0): '%s/%s' % (refBase, r.get('{%s}pathref' % (URI_REPOSITORY_1_0)))})
+    return refEl
+
+def qualifiedName(name, scope):
+    """Return the prefixed form of a {uri}name element or attribute name, using the namespace 
+    declarations in scope"""
+    if name.startswith('{'):
+        (uri, localName) = name[1:].split('}', 1)
+        prefix = scope.get(uri)
+        if prefix is None:
+            raise Exception("No prefix declared for namespace %s" % (uri))
+        return prefix and '%s:%s' % (prefix, localName) or localName
+    return name
+
+def startTagXML(el, scope, namespaces):
+    """Return the start tag for an element, including the given (prefix, uri) namespace declarations"""
+    attrs = [(prefix and 'xmlns:%s' % (prefix) or 'xmlns', uri) for (prefix, uri) in namespaces]
+    attrs.extend([(qualifiedName(k, scope), v) for (k, v) in el.items()])
+    return '<%s%s>' % (qualifiedName(el.tag, scope), ''.join([' %s="%s"' % (k, escapeXMLAttr(v)) for (k, v) in attrs]))
+
+class ViewXMLWriter:
+    """Writes a view:view document to a file one node at a time, as each is generated, so that the
+    whole document never needs to be held in memory. All the namespaces in NSMAP are declared on
+    the view element."""
+
+    def __init__(self, outFile, metadata):
+        self.outFile = outFile
+        self.scope = dict([(uri, prefix) for (prefix, uri) in NSMAP.items()])
+        self.scope['http://www.w3.org/XML/1998/namespace'] = 'xml'
+        outFile.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        outFile.write(startTagXML(etree.Element('{%s}view' % (URI_REPOSITORY_1_0)), self.scope, sorted(NSMAP.items())))
+        self.write(generateViewXML(metadata)[0])
+
+    def write(self, el):
+        """Write an element and its children to the document"""
+        self.outFile.write(startTagXML(el, self.scope, []))
+        self.outFile.write(escapeXMLText(el.text))
+        for child in el:
+            self.write(child)
+            self.outFile.write(escapeXMLText(child.tail))
+        self.outFile.write('</%s>' % (qualifiedName(el.tag, self.scope)))
+
+    def close(self):
+        """Write the end of the document"""
+        self.outFile.write('</%s>' % (qualifiedName('{%s}view' % (URI_REPOSITORY_1_0), self.scope)))
+
+def escapeXMLText(text):
+    if not text:
+        return ''
+    return escape(text).encode('utf-8')
+
+def escapeXMLAttr(value):
+    return escape(value, {'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'}).encode('utf-8')
 
 def generateSiteConfigXML(siteData, containsEl, tempDir, fileBase):
     # Return the list of files added
@@ -739,14 +1115,17 @@ def generateReferenceXML(parent, fromRef, toRefs, refType='{%s}references' % (UR
         for ref in toRefs:
             etree.SubElement(references, '{%s}reference' % (URI_REPOSITORY_1_0), {'{%s}pathref' % (URI_REPOSITORY_1_0): ref})
 
-def generateSiteXML(siteData):
-    siteId = siteData['shortName']
-    # Register namespaces
+def registerNamespaces():
     if hasattr(etree, 'register_namespace'):
         for (prefix, uri) in NSMAP.items():
             etree.register_namespace(prefix, uri)
     else:
         print 'Warning: Default XML namespaces will but be used, Python 2.7 is required for this'
+
+def generateSiteXML(siteData):
+    siteId = siteData['shortName']
+    # Register namespaces
+    registerNamespaces()
     
     view = generateViewXML({'{%s}exportOf' % (URI_REPOSITORY_1_0): '/app:company_home/st:sites/cm:%s' % (siteId)})
     aspects = []
@@ -843,6 +1222,8 @@ def generateNodeXML(parent, childName, type, addaspects=[], addprops={}, perms=[
     return folderEl
 
 def generateXMLElement(parent, tagName, attrs={}):
+    if parent is None:
+        return etree.Element(tagName, attrs)
     return etree.SubElement(parent, tagName, attrs)
 
 def generateAssociationsXML(parent):
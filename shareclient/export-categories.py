@@ -30,11 +30,11 @@ file.json         Name of the file to export categories to. Will be created if
 """
 
 import getopt
-import json
 import os
 import sys
 
 import alfresco
+import jsonstream
 
 # HTTP debugging flag
 global _debug
@@ -98,16 +98,15 @@ def main(argv):
         cdata = { 'categories': sc.getAllCategories(), 'tags': sc.getAllTags() }
         
         if filename == '-':
-            categoryJson = json.dumps(cdata, sort_keys=True, indent=4)
-            print categoryJson
+            jsonstream.dump(cdata, sys.stdout)
+            print
         else:
             if not os.path.exists(os.path.dirname(filename)):
                 os.makedirs(os.path.dirname(filename))
             
-            # Write user data to a file
-            categoryJson = json.dumps(cdata, sort_keys=True, indent=4)
+            # Write category data to a file
             userfile = open(filename, 'w')
-            userfile.write(categoryJson)
+            jsonstream.dump(cdata, userfile)
             userfile.close()
             
     finally:
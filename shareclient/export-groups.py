@@ -26,6 +26,13 @@ file.json         Name of the file to export groups to. Will be created if
 --skip-groups=arg Comma-separated list of group names to exclude from the 
                   export (do not prefix with 'GROUP_')
 
+--recursive       Also export the groups nested below the root groups at any
+                  depth. Each nested group is listed once in 'subgroups', 
+                  however many parents it has.
+
+--workers=n       Number of groups to fetch the children of concurrently 
+                  when --recursive is used (default 1)
+
 -d                Turn on debug mode
 
 -h                Display this message
@@ -33,11 +40,11 @@ file.json         Name of the file to export groups to. Will be created if
 """
 
 import getopt
-import json
 import os
 import sys
 
 import alfresco
+import jsonstream
 
 # HTTP debugging flag
 global _debug
@@ -53,6 +60,8 @@ def main(argv):
     tenant = None
     _debug = 0
     skip_groups = [ 'ALFRESCO_ADMINISTRATORS', 'EMAIL_CONTRIBUTORS' ]
+    recursive = False
+    workers = 1
     
     if len(argv) > 0:
         if argv[0] == "--help" or argv[0] == "-h":
@@ -69,7 +78,7 @@ def main(argv):
         sys.exit(1)
     
     try:
-        opts, args = getopt.getopt(argv[1:], "hdu:p:U:", ["help", "username=", "password=", "url=", "tenant=", "skip-groups="])
+        opts, args = getopt.getopt(argv[1:], "hdu:p:U:", ["help", "username=", "password=", "url=", "tenant=", "skip-groups=", "recursive", "workers="])
     except getopt.GetoptError, e:
         usage()
         sys.exit(1)
@@ -90,6 +99,10 @@ def main(argv):
             tenant = arg
         elif opt == "--skip-groups":
             skip_groups = arg.split(',')
+        elif opt == "--recursive":
+            recursive = True
+        elif opt == "--workers":
+            workers = int(arg)
     
     sc = alfresco.ShareClient(url, tenant=tenant, debug=_debug)
     if not filename == "-":
@@ -101,20 +114,20 @@ def main(argv):
     try:
         if not filename == "-":
             print "Get group information"
-        gdata = sc.getAllGroups(skip_groups)
+        if recursive:
+            gdata = sc.getAllGroups(skip_groups, recursive=True, workers=workers)
+        else:
+            gdata = { 'groups': sc.iterAllGroups(skip_groups) }
         
         if filename == '-':
-            groupJson = json.dumps(gdata, sort_keys=True, indent=4)
-            print groupJson
+            jsonstream.dump(gdata, sys.stdout)
+            print
         else:
             if not os.path.exists(os.path.dirname(filename)):
                 os.makedirs(os.path.dirname(filename))
             
-            # Write user data to a file
-            groupJson = json.dumps(gdata, sort_keys=True, indent=4)
-            userfile = open(filename, 'w')
-            userfile.write(groupJson)
-            userfile.close()
+            # Write group data to a file
+            jsonstream.dumpFile(gdata, filename)
             
     finally:
         if not filename == "-":
@@ -47,6 +47,14 @@ file.json         Name of the file to export information to. Will be created if
 
 --async           Generate ACP files asyncronously, for use with --export-content
 
+--pipeline        Generate the ACP files for all containers at the same time and
+                  download each one as soon as it is ready, for use with 
+                  --export-content
+
+--workers=n       Number of requests to make concurrently when fetching the
+                  site dashboard configuration, or ACP files to download at 
+                  the same time with --pipeline (default 1)
+
 --include-paths=list Comma-separated list of folders or content items to include 
                   in the ACP file(s). This can be a list of absolute paths from 
                   the store root (although anything not inside the site will be 
@@ -70,7 +78,6 @@ file.json         Name of the file to export information to. Will be created if
 """
 
 import getopt
-import json
 import os
 import re
 import sys
@@ -78,10 +85,27 @@ import time
 import urllib
 
 import alfresco
+import jsonstream
 
 # HTTP debugging flag
 global _debug
 
+def format_size(size):
+    """Return a human-readable representation of a number of bytes"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return "%.1f%s" % (size, unit)
+        size = size / 1024.0
+    return "%.1fGB" % (size)
+
+def print_progress(written, total):
+    """Show download progress on the current line"""
+    if total:
+        sys.stdout.write("\r%s of %s (%d%%)" % (format_size(written), format_size(total), written * 100 / total))
+    else:
+        sys.stdout.write("\r%s" % (format_size(written)))
+    sys.stdout.flush()
+
 def usage():
     print __doc__
 
@@ -104,6 +128,8 @@ def main(argv):
     getPages = True
     getDashboardConfig = True
     async = False
+    pipeline = False
+    workers = 1
     
     if len(argv) > 0:
         if argv[0] == "--help" or argv[0] == "-h":
@@ -118,7 +144,7 @@ def main(argv):
         if not argv[1].startswith('-'):
             try:
                 opts, args = getopt.getopt(argv[2:], "hdu:p:U:", 
-                    ["help", "username=", "password=", "url=", "tenant=", "export-content", "async", "export-tags", "containers=", "include-paths=", "no-metadata", "no-memberships", "no-pages", "no-dashboard"])
+                    ["help", "username=", "password=", "url=", "tenant=", "export-content", "async", "pipeline", "export-tags", "containers=", "include-paths=", "no-metadata", "no-memberships", "no-pages", "no-dashboard", "workers="])
             except getopt.GetoptError, e:
                 usage()
                 sys.exit(1)
@@ -141,6 +167,8 @@ def main(argv):
                     exportContent = True
                 elif opt == '--async':
                     async = True
+                elif opt == '--pipeline':
+                    pipeline = True
                 elif opt == '--export-tags':
                     exportTags = True
                 elif opt == '--containers':
@@ -155,6 +183,8 @@ def main(argv):
                     getPages = False
                 elif opt == '--no-dashboard':
                     getDashboardConfig = False
+                elif opt == '--workers':
+                    workers = int(arg)
             
             idm = re.match('^([\-\w]+)$', argv[0])
             urlm = re.match('^(https?\://[\w\-\.\:]+/share)/([\w\-\./_]+/)?page/site/([\-\w]+)/[\w\-\./_]*$', argv[0])
@@ -190,11 +220,11 @@ def main(argv):
     try:
         if not filename == "-":
             print "Get site information"
-        sdata = sc.getSiteInfo(sitename, getMetaData, getMemberships, getPages, getDashboardConfig)
+        sdata = sc.getSiteInfo(sitename, getMetaData, getMemberships, getPages, getDashboardConfig, workers)
         
         if filename == '-':
-            siteJson = json.dumps(sdata, sort_keys=True, indent=4)
-            print siteJson
+            jsonstream.dump(sdata, sys.stdout)
+            print
         else:
             if not os.path.exists(os.path.dirname(filename)) and os.path.dirname(filename) != '':
                 os.makedirs(os.path.dirname(filename))
@@ -202,26 +232,31 @@ def main(argv):
             # Download ACP files
             
             # Write site data to a file
-            siteJson = json.dumps(sdata, sort_keys=True, indent=4)
             siteFile = open(filename, 'w')
-            siteFile.write(siteJson)
+            jsonstream.dump(sdata, siteFile)
             siteFile.close()
             
         if exportContent:
             if not filename == "-":
                 print "Export all site content"
                 tempContainerName = 'export-%s' % (int(time.time()))
-                results = sc.exportAllSiteContent(sitename, siteContainers, includePaths, tempContainerName, async)
+                results = sc.exportAllSiteContent(sitename, siteContainers, includePaths, tempContainerName, async or pipeline)
                 
-                if not async:
+                if pipeline:
+                    print "Waiting for ACP files"
+                    acpFileNames = dict([(component, "%s-%s.acp" % (os.path.splitext(filename)[0], component.replace(' ', '_'))) for component in results['exportFiles']])
+                    downloads = sc.downloadAllSiteContent(sitename, results['exportFiles'], acpFileNames.get, tempContainerName, workers)
+                    for component in results['exportFiles']:
+                        result = downloads[component]
+                        print "Saved %s (%s bytes in %.1fs)" % (acpFileNames[component], result['bytes'], result['time'])
+                elif not async:
                     for component in results['exportFiles']:
                         acpFileName = "%s-%s.acp" % (os.path.splitext(filename)[0], component.replace(' ', '_'))
                         print "Saving %s" % (acpFileName)
-                        resp = sc.doGet(urllib.quote('proxy/alfresco/api/path/content/workspace/SpacesStore/Company Home/%s/%s/%s/%s-%s.acp' % (sc.getSitesContainerName(), sitename, tempContainerName, sitename, component)))
-                        acpfile = open(acpFileName, 'wb')
-                        acpfile.write(resp.read())
-                        acpfile.close()
-                    
+                        result = sc.downloadFile(urllib.quote('proxy/alfresco/api/path/content/workspace/SpacesStore/Company Home/%s/%s/%s/%s-%s.acp' % (sc.getSitesContainerName(), sitename, tempContainerName, sitename, component)), acpFileName, progress=print_progress)
+                        print "\r" + ("Saved %s bytes in %.1fs (%s/s)" % (result['bytes'], result['time'], format_size(result['bytes'] / max(result['time'], 0.001)))).ljust(40)
+                
+                if pipeline or not async:
                     # Delete the 'export' folder afterwards
                     exportFolder = sc._getDocumentList('%s/%s/%s' % (sc.getSitesContainerName(), sitename, tempContainerName))
                     if exportFolder is not None:
@@ -235,14 +270,14 @@ def main(argv):
             if not filename == "-":
                 print "Export site tag information"
                 
+                allTagsData = sc.getAllSiteTagInfo(sitename, siteContainers)
                 for container in siteContainers:
-                    tagsData = sc.getSiteTagInfo(sitename, container)
+                    tagsData = allTagsData.get(container, [])
                     if len(tagsData) > 0:
                         tagFileName = "%s-%s-tags.json" % (filename.replace('.json', ''), container.replace(' ', '_'))
                         print "Saving %s" % (tagFileName)
-                        tagsJson = json.dumps({"items": tagsData}, indent=4)
                         tagsFile = open(tagFileName, 'w')
-                        tagsFile.write(tagsJson)
+                        jsonstream.dump({"items": tagsData}, tagsFile, sort_keys=False)
                         tagsFile.close()
             
     finally:
@@ -37,6 +37,18 @@ file.json         Name of the file to export information to. Will be created if
 --avatar-thumbnail Name of the thumbnail to download (default is original 
                   profile image that was uploaded)
 
+--workers=n       Number of users to fetch full information for concurrently 
+                  (default 1). Users whose information cannot be fetched are 
+                  reported and exported with their basic information only.
+
+--groups-from-tree Find the groups of all users by listing the members of 
+                  each group, rather than fetching the full details of each 
+                  user. Much faster when there are many more users than 
+                  groups, but the output differs: the 'capabilities' and 
+                  'immutability' information of each user is not exported, 
+                  and each user's groups hold only their name and display 
+                  name, sorted by name. Not supported with --cloud.
+
 -d                Turn on debug mode
 
 -h                Display this message
@@ -44,12 +56,12 @@ file.json         Name of the file to export information to. Will be created if
 """
 
 import getopt
-import json
 import mimetypes
 import os
 import sys
 
 import alfresco
+import jsonstream
 
 # HTTP debugging flag
 global _debug
@@ -68,6 +80,8 @@ def main(argv):
     downloadAvatars = True
     avatarThumbnail = None
     isCloud = False
+    workers = 1
+    groupsFromTree = False
     _debug = 0
     
     if len(argv) > 0:
@@ -85,7 +99,7 @@ def main(argv):
         sys.exit(1)
     
     try:
-        opts, args = getopt.getopt(argv[1:], "hdu:p:U:", ["help", "username=", "password=", "url=", "tenant=", "users=", "skip-users=", "no-avatars", "avatar-thumbnail=", "cloud"])
+        opts, args = getopt.getopt(argv[1:], "hdu:p:U:", ["help", "username=", "password=", "url=", "tenant=", "users=", "skip-users=", "no-avatars", "avatar-thumbnail=", "cloud", "workers=", "groups-from-tree"])
     except getopt.GetoptError, e:
         usage()
         sys.exit(1)
@@ -114,6 +128,14 @@ def main(argv):
             skip_users = arg.split(',')
         elif opt == "--cloud":
             isCloud = True
+        elif opt == "--workers":
+            workers = int(arg)
+        elif opt == "--groups-from-tree":
+            groupsFromTree = True
+    
+    if groupsFromTree and isCloud:
+        print "The --groups-from-tree option cannot be used with --cloud"
+        sys.exit(1)
     
     sc = alfresco.ShareClient(url, tenant=tenant, debug=_debug)
     if not filename == "-":
@@ -125,35 +147,28 @@ def main(argv):
     try:
         if not filename == "-":
             print "Get user information"
+        # Users are fetched, filtered and written out one at a time
+        failures = []
+        groupIndex = None
+        if groupsFromTree:
+            groupIndex = sc.getUserGroupIndex(workers)
         if not isCloud:
-            pdata = sc.getAllUsers(getFullDetails=True, getDashboardConfig=True, getPreferences=False, getGroups=True)
+            people = sc.iterAllUsers(getFullDetails=groupIndex is None, getDashboardConfig=True, getPreferences=False, getGroups=groupIndex is None, workers=workers, failures=failures)
         else:
-            pdata = sc.getCloudUsers(getFullDetails=True, getDashboardConfig=False, getPreferences=False, getGroups=True)
-        export_users = []
+            people = sc.iterCloudUsers(getFullDetails=True, getDashboardConfig=False, getPreferences=False, getGroups=True, workers=workers, failures=failures)
         
-        # Filter the users
-        for u in pdata['people']:
-            if (include_users is None or str(u['userName']) in include_users) and u['userName'] not in skip_users:
-                export_users.append(u)
+        thisdir = os.path.dirname(filename)
+        if thisdir == "":
+            thisdir = os.getcwd()
         
-        # Export a dict object
-        export = { 'people': export_users }
-        
-        if filename == '-':
-            userJson = json.dumps(export, sort_keys=True, indent=4)
-            print userJson
-        else:
-            thisdir = os.path.dirname(filename)
-            if thisdir == "":
-                thisdir = os.getcwd()
-            if not os.path.exists(os.path.dirname(filename)):
-                os.makedirs(os.path.dirname(filename))
-            
-            # Download avatars
-            if downloadAvatars and filename != "-":
-                print "Download profile images"
-                for p in export['people']:
-                    if 'avatar' in p:
+        def export_users():
+            for p in people:
+                # Filter the users
+                if (include_users is None or str(p['userName']) in include_users) and p['userName'] not in skip_users:
+                    if groupIndex is not None:
+                        p['groups'] = groupIndex.get(p['userName'], [])
+                    # Download avatar
+                    if downloadAvatars and filename != "-" and 'avatar' in p:
                         if not os.path.exists('%s/profile-images' % (thisdir)):
                             os.makedirs('%s/profile-images' % (thisdir))
                         # Thumbnail will be something like
@@ -172,12 +187,25 @@ def main(argv):
                         resp.close()
                         imgfile.close()
                         p['avatar'] = 'profile-images/%s%s' % (p['userName'], imgext)
-                        
+                    yield p
+        
+        # Export a dict object
+        export = { 'people': export_users() }
+        
+        if filename == '-':
+            jsonstream.dump(export, sys.stdout)
+            print
+        else:
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            
             # Write user data to a file
-            userJson = json.dumps(export, sort_keys=True, indent=4)
-            userfile = open(filename, 'w')
-            userfile.write(userJson)
-            userfile.close()
+            if downloadAvatars:
+                print "Download profile images"
+            jsonstream.dumpFile(export, filename)
+        
+        for f in failures:
+            print >> sys.stderr, "Warning: could not get information for user '%s' (%s)" % (f['userName'], f['error'])
             
     finally:
         if not filename == "-":
@@ -28,11 +28,11 @@ file.json              Name of the JSON file to import information from.
 """
 
 import getopt
-import json
 import os
 import sys
 
 import alfresco
+import jsonstream
 
 # HTTP debugging flag
 global _debug
@@ -91,9 +91,8 @@ def main(argv):
     try:
         filenamenoext = os.path.splitext(os.path.split(filename)[1])[0]
         thisdir = os.path.dirname(filename)
-        gd = json.loads(open(filename).read())
-        for group in gd['groups']:
-            sc.createGroups(group)
+        # Groups nested more than one level deep are listed separately by export-groups.py --recursive
+        sc.createGroupTree(jsonstream.ItemsFile(filename, 'groups'), jsonstream.ItemsFile(filename, 'subgroups'))
         
     finally:
         print "Log out (%s)" % (username)
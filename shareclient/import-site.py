@@ -50,9 +50,13 @@ file.json                   Name of the JSON file to import information from.
 --import-tags               Import tags for each site container (only if provided by 
                             site data)
 
+--workers=n                 Number of site members to add, or tags to create or
+                            nodes to tag when importing tags, concurrently 
+                            (default 1)
+
 --multipart-handler         Name of the multipart library to use to upload content.
-                            Advanced use only, choose between 'MultipartPostHandler'
-                            and 'poster'.
+                            Advanced use only, choose between 'streaming' (the 
+                            default), 'MultipartPostHandler' and 'poster'.
 
 -d                          Turn on debug mode
 
@@ -66,6 +70,7 @@ import os
 import sys
 
 import alfresco
+import jsonstream
 
 # HTTP debugging flag
 global _debug
@@ -95,7 +100,8 @@ def main(argv):
     uploadContent = True
     importTags = False
     deleteTempFiles = True
-    mplib = 'MultipartPostHandler'
+    mplib = 'streaming'
+    workers = 1
     _debug = 0
     
     if len(argv) > 0:
@@ -112,7 +118,7 @@ def main(argv):
         sys.exit(1)
         
     try:
-        opts, args = getopt.getopt(argv[1:], "hdu:p:U:", ["help", "username=", "password=", "url=", "tenant=", "create-missing-members", "users-file=", "groups-file=", "skip-missing-members", "no-members", "no-create", "no-configuration", "no-dashboard", "containers=", "no-content", "no-content-upload", "import-tags", "no-delete", "multipart-handler="])
+        opts, args = getopt.getopt(argv[1:], "hdu:p:U:", ["help", "username=", "password=", "url=", "tenant=", "create-missing-members", "users-file=", "groups-file=", "skip-missing-members", "no-members", "no-create", "no-configuration", "no-dashboard", "containers=", "no-content", "no-content-upload", "import-tags", "no-delete", "multipart-handler=", "workers="])
     except getopt.GetoptError, e:
         usage()
         sys.exit(1)
@@ -159,6 +165,8 @@ def main(argv):
             deleteTempFiles = False
         elif opt == '--multipart-handler':
             mplib = arg
+        elif opt == '--workers':
+            workers = int(arg)
     
     sc = alfresco.ShareClient(url=url, tenant=tenant, debug=_debug, mplib=mplib)
     print "Log in (%s)" % (username)
@@ -198,11 +206,11 @@ def main(argv):
             udata = None
             gdata = None
             if users_file is not None:
-                udata = json.loads(open(users_file).read())['people']
+                udata = jsonstream.ItemsFile(users_file, 'people')
             if groups_file is not None:
-                gdata = json.loads(open(groups_file).read())['groups']
+                gdata = jsonstream.ItemsFile(groups_file, 'groups')
             authority_data = { 'people': udata, 'groups': gdata }
-            membersResult = sc.addSiteMembers(siteId, sd['memberships'], skip_missing_members, create_missing_members, authority_data)
+            membersResult = sc.addSiteMembers(siteId, sd['memberships'], skip_missing_members, create_missing_members, authority_data, workers)
             
             # Add thumbnails and dashboards for auto-created users, if they are specified in the user data
             if users_file is not None and (set_user_avatars or set_user_dashboards):
@@ -243,12 +251,22 @@ def main(argv):
                         
         # Import site tags
         if importTags:
+            listingCache = alfresco.FolderListingCache()
             for container in siteContainers:
                 jsonFile = thisdir + os.sep + '%s-%s-tags.json' % (filenamenoext, container.replace(' ', '_'))
                 if os.path.isfile(jsonFile):
                     print "Import %s tags" % (container)
-                    items = json.loads(open(jsonFile).read())['items']
-                    sc.importSiteTags(siteId, items)
+                    items = jsonstream.ItemsFile(jsonFile, 'items')
+                    failures = []
+                    sc.importSiteTags(siteId, items, listingCache, workers, failures)
+                    for f in failures:
+                        if 'tag' in f:
+                            print "Failed to create tag %s: %s" % (f['tag'], f['error'])
+                        else:
+                            print "Failed to tag %s/%s: %s" % (f['path'] or '', f['name'], f['error'])
+            stats = listingCache.getStats()
+            if stats['hits'] + stats['misses'] > 0:
+                print "Found tagged items using %s folder listings (%s lookups from cache)" % (stats['misses'], stats['hits'])
                 
     except alfresco.SurfRequestError, e:
         if e.description == "error.duplicateShortName":
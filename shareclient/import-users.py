@@ -55,6 +55,16 @@ file.json           Name of the JSON file to import user information from.
                     
 --default-email     Email value to use for new users if no email is specified
 
+--workers=n         Number of users to create, or to set profile images, 
+                    profile details, dashboards and preferences for, 
+                    concurrently (default 1). Profile images, details and 
+                    dashboards are set using a session for each user, and 
+                    preferences using the admin session.
+
+--bulk              Fetch the list of existing users first and skip them, 
+                    instead of trying to create each one. Recommended when 
+                    importing many users.
+
 --cloud             Use this to import users into the Alfresco Cloud service
                     instead of an on-premise install. This will use the 
                     private 'invite' web script to create users instead of
@@ -67,11 +77,13 @@ file.json           Name of the JSON file to import user information from.
 """
 
 import getopt
-import json
 import os
 import sys
+import threading
+import time
 
 import alfresco
+import jsonstream
 
 # HTTP debugging flag
 global _debug
@@ -95,6 +107,8 @@ def main(argv):
     default_password = None
     default_email = None
     isCloud = False
+    workers = 1
+    bulk = False
     _debug = 0
     
     if len(argv) > 0:
@@ -113,7 +127,7 @@ def main(argv):
         sys.exit(1)
     
     try:
-        opts, args = getopt.getopt(argv[1:], "hdu:p:U:", ["help", "username=", "password=", "url=", "tenant=", "users=", "skip-users=", "no-create", "no-dashboards", "no-preferences", "update-profile", "no-avatars", "create-only", "default-password=", "default-email=", "cloud"])
+        opts, args = getopt.getopt(argv[1:], "hdu:p:U:", ["help", "username=", "password=", "url=", "tenant=", "users=", "skip-users=", "no-create", "no-dashboards", "no-preferences", "update-profile", "no-avatars", "create-only", "default-password=", "default-email=", "cloud", "workers=", "bulk"])
     except getopt.GetoptError, e:
         usage()
         sys.exit(1)
@@ -157,6 +171,10 @@ def main(argv):
             default_email = arg
         elif opt == "--cloud":
             isCloud = True
+        elif opt == '--workers':
+            workers = int(arg)
+        elif opt == '--bulk':
+            bulk = True
     
     sc = alfresco.ShareClient(url, tenant=tenant, debug=_debug)
     print "Log in (%s)" % (username)
@@ -164,27 +182,63 @@ def main(argv):
     if not loginres['success']:
         print "Could not log in using specified credentials"
         sys.exit(1)
-    users = json.loads(open(filename).read())['people']
-    create_users = []
+    users = jsonstream.ItemsFile(filename, 'people')
     
-    # Filter the users
-    for u in users:
-        if (include_users is None or str(u['userName']) in include_users) and u['userName'] not in skip_users:
-            create_users.append(u)
-    
-    for u in create_users:
-        # Set password to be the same as the username if not specified
-        if 'password' not in u:
-            u['password'] = u['userName']
-        if isCloud:
-            u['password'] = u['userName']
-            u['userName'] = u['email']
+    def create_users():
+        """Filter the users, reading them from the file one at a time. Each pass reads the users from the 
+        file again, so they are cleaned up in the same way here for every stage of the import."""
+        for u in users:
+            if (include_users is None or str(u['userName']) in include_users) and u['userName'] not in skip_users:
+                # Create and update calls do not accept null values, see ShareClient.createUser()
+                for k in u.keys():
+                    if u[k] is None:
+                        u[k] = ""
+                if not isCloud and u.get('email', '') == '' and default_email is not None and default_email != '':
+                    u['email'] = default_email
+                # Set password to be the same as the username if not specified
+                if 'password' not in u:
+                    u['password'] = u['userName']
+                if isCloud:
+                    u['password'] = u['userName']
+                    u['userName'] = u['email']
+                yield u
             
+    # Number of requests made and time taken for each stage, plus the wall clock time of each stage
+    stats = {}
+    elapsed = {}
+    failures = []
+    lock = threading.Lock()
+    
+    def run_stage(stage, u, func, *args):
+        """Run one stage of the import for a user, recording the time taken and any failure. Returns the
+        result of the stage, or None if it failed."""
+        start = time.time()
+        try:
+            return func(*args)
+        except Exception, e:
+            with lock:
+                failures.append({ 'userName': u['userName'], 'stage': stage, 'error': e })
+            return None
+        finally:
+            with lock:
+                (count, seconds) = stats.get(stage, (0, 0.0))
+                stats[stage] = (count + 1, seconds + time.time() - start)
+    
+    def set_preferences(u):
+        if 'preferences' in u and len(u['preferences']) > 0:
+            print "Setting preferences for user '%s'" % (u['userName'])
+            run_stage('preferences', u, sc.setUserPreferences, u['userName'], u['preferences'])
+    
     if create:
         try:
-            print "Create %s user(s)" % (len(create_users))
-            if not isCloud:
-                sc.createUsers(create_users, skip_users=skip_users, default_password=default_password, default_email=default_email)
+            print "Create %s user(s)" % (sum([1 for u in create_users()]))
+            if not isCloud and bulk:
+                results = sc.createUsersBulk(create_users(), skip_users=skip_users, default_password=default_password, default_email=default_email, workers=workers)
+                print "Created %s users, skipped %s existing users, %s failed" % (len(results['created']), len(results['skipped']), len(results['failures']))
+                for f in results['failures']:
+                    print "Failed to create user '%s': %s" % (f['userName'], f['error'])
+            elif not isCloud:
+                sc.createUsers(create_users(), skip_users=skip_users, default_password=default_password, default_email=default_email)
             else:
                 ssc = alfresco.ShareClient(url=url, tenant="-system-", debug=_debug)
                 sscloginres = ssc.doLogin(username, password)
@@ -192,7 +246,7 @@ def main(argv):
                     print "Could not log in using specified credentials"
                     sys.exit(1)
 
-                for u in create_users:
+                for u in create_users():
                     try:
                         qd = ssc.doJSONPost("proxy/alfresco/internal/cloud/accounts/signupqueue", {'email': u['email'], 'source': 'test-share-signup-page'})
                     finally:
@@ -206,11 +260,12 @@ def main(argv):
                         pass
                 ssc.doLogout()
             
-            # Set user preferences
-            for u in create_users:
-                if 'preferences' in u and len(u['preferences']) > 0 and set_prefs:
-                    print "Setting preferences for user '%s'" % (u['userName'])
-                    sc.setUserPreferences(u['userName'], u['preferences'])
+            # Set user preferences, as the admin user
+            if set_prefs:
+                startTime = time.time()
+                for result in alfresco.iterConcurrent(set_preferences, create_users(), workers):
+                    pass
+                elapsed['preferences'] = time.time() - startTime
         finally:
             print "Log out (%s)" % (username)
             sc.doLogout()
@@ -219,38 +274,65 @@ def main(argv):
     thisdir = os.path.dirname(filename)
     if thisdir == "":
         thisdir = os.getcwd()
-    for u in create_users:
-        if set_avatars or update_profile or set_dashboards:
-            print "Log in (%s)" % (u['userName'])
-            login = sc.doLogin(u['userName'], u['password'])
-            if login['success']:
-                try:
-                    # Add profile image
-                    if set_avatars:
-                        if 'avatar' in u:
-                            print "Setting profile image for user '%s'" % (u['userName'])
-                            try:
-                                sc.setProfileImage(u['userName'], thisdir + os.sep + str(u['avatar']))
-                            except IOError, e:
-                                if e.errno == 2:
-                                    # File not found errors
-                                    print "Warning: no avatar found for user %s" % (u['userName'])
-                                else:
-                                    print e
-                                    raise e
-                    # Update user profile
-                    if update_profile:
-                        print "Updating profile information for user '%s'" % (u['userName'])
-                        sc.updateUserDetails(u)
-                    # Update dashboard
-                    if 'dashboardConfig' in u and set_dashboards:
-                        print "Updating dashboard configuration for user '%s'" % (u['userName'])
-                        sc.updateUserDashboardConfig(u)
-                finally:
-                    print "Log out (%s)" % (u['userName'])
-                    sc.doLogout()
+    
+    # Each worker thread logs in as each of its users in turn using its own client
+    clients = threading.local()
+    
+    def set_avatar(usc, u):
+        try:
+            usc.setProfileImage(u['userName'], thisdir + os.sep + str(u['avatar']))
+        except IOError, e:
+            if e.errno == 2:
+                # File not found errors
+                print "Warning: no avatar found for user %s" % (u['userName'])
             else:
-                print 'Warning: Unable to log in as \'%s\'. Either set a correct password, or set the password to the same value as the username.' % (u['userName'])
+                raise
+    
+    def import_user(u):
+        """Log in as a user and set their profile image, profile details and dashboard"""
+        if not hasattr(clients, 'sc'):
+            # Share the endpoint variants already found by the admin client
+            clients.sc = alfresco.ShareClient(url, tenant=tenant, debug=_debug, capabilities=sc.capabilities)
+        usc = clients.sc
+        print "Log in (%s)" % (u['userName'])
+        login = run_stage('login', u, usc.doLogin, u['userName'], u['password'])
+        if login is None:
+            return
+        if not login['success']:
+            print 'Warning: Unable to log in as \'%s\'. Either set a correct password, or set the password to the same value as the username.' % (u['userName'])
+            with lock:
+                failures.append({ 'userName': u['userName'], 'stage': 'login', 'error': 'Login failed' })
+            return
+        try:
+            # Add profile image
+            if set_avatars and 'avatar' in u:
+                print "Setting profile image for user '%s'" % (u['userName'])
+                run_stage('avatar', u, set_avatar, usc, u)
+            # Update user profile
+            if update_profile:
+                print "Updating profile information for user '%s'" % (u['userName'])
+                run_stage('profile', u, usc.updateUserDetails, u)
+            # Update dashboard
+            if 'dashboardConfig' in u and set_dashboards:
+                print "Updating dashboard configuration for user '%s'" % (u['userName'])
+                run_stage('dashboard', u, usc.updateUserDashboardConfig, u)
+        finally:
+            print "Log out (%s)" % (u['userName'])
+            run_stage('logout', u, usc.doLogout)
+    
+    if set_avatars or update_profile or set_dashboards:
+        startTime = time.time()
+        for result in alfresco.iterConcurrent(import_user, create_users(), workers):
+            pass
+        for stage in ('login', 'avatar', 'profile', 'dashboard', 'logout'):
+            elapsed[stage] = time.time() - startTime
+    
+    for stage in ('preferences', 'login', 'avatar', 'profile', 'dashboard', 'logout'):
+        if stage in stats:
+            (count, seconds) = stats[stage]
+            print "%s: %s requests in %.1fs, %.1f per second" % (stage.capitalize(), count, seconds, count / max(elapsed[stage], 0.001))
+    for f in failures:
+        print "Failed at %s stage for user '%s': %s" % (f['stage'], f['userName'], f['error'])
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,200 @@
+#! /usr/bin/env python
+# jsonstream.py
+
+"""This module writes and reads JSON documents incrementally, so that large exports do not need to
+be held in memory in full when they are written or imported.
+
+The output of dump() is identical to that of json.dumps(obj, sort_keys=True, indent=4), as used by
+the export scripts, but any iterator or generator found within the document is written out as a
+JSON array one item at a time, as the items are generated.
+
+iterItems() does the reverse, returning the items of an array held in a top-level property of a
+document, such as 'people' or 'groups', one at a time as they are parsed from the file.
+"""
+
+import json
+import os
+import re
+import tempfile
+
+def dump(obj, fp, indent=4, sort_keys=True):
+    """Serialize obj as a JSON formatted document to the file-like object fp, writing it as it goes
+
+    Dicts and lists are written in the same way as json.dump(). Iterators and generators are consumed
+    and written as JSON arrays."""
+    encoder = json.JSONEncoder(sort_keys=sort_keys, indent=indent)
+    _write(obj, fp, encoder, 0)
+
+def dumpFile(obj, filename, indent=4, sort_keys=True):
+    """Serialize obj to the file filename in the same way as dump()
+
+    The document is written to a temporary file in the same directory, which replaces filename only
+    once it is complete. If an error occurs part way through, e.g. while a generator is fetching
+    items, the temporary file is removed and any existing file is left as it was."""
+    (fd, tmpname) = tempfile.mkstemp(prefix='.%s.' % (os.path.basename(filename)), dir=os.path.dirname(filename) or '.')
+    try:
+        # Give the file the same permissions as one created by open()
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpname, 0666 & ~umask)
+        fp = os.fdopen(fd, 'w')
+        try:
+            dump(obj, fp, indent, sort_keys)
+        finally:
+            fp.close()
+        if os.name == 'nt' and os.path.exists(filename):
+            # Renaming over an existing file is not supported on Windows
+            os.remove(filename)
+        os.rename(tmpname, filename)
+    except:
+        os.remove(tmpname)
+        raise
+
+def _isIterator(obj):
+    return hasattr(obj, 'next') and not isinstance(obj, (basestring, dict, list, tuple))
+
+def _isStreamed(obj):
+    """Return True if the object is or contains an iterator which must be streamed"""
+    if _isIterator(obj):
+        return True
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            if _isStreamed(v):
+                return True
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            if _isStreamed(v):
+                return True
+    return False
+
+def _write(obj, fp, encoder, level):
+    if not _isStreamed(obj):
+        # Indent the encoded value to the current level. Newlines only occur between items, since
+        # the encoder escapes any newline characters within strings.
+        fp.write(encoder.encode(obj).replace('\n', '\n' + ' ' * (encoder.indent * level)))
+    elif isinstance(obj, dict):
+        items = obj.items()
+        if encoder.sort_keys:
+            items.sort(key=lambda kv: kv[0])
+        _writeItems(items, fp, encoder, level, '{', '}')
+    else:
+        _writeItems(((None, item) for item in obj), fp, encoder, level, '[', ']')
+
+def _writeItems(items, fp, encoder, level, start, end):
+    """Write the (key, value) pairs of an object, or (None, value) pairs of an array, in the same way
+    as the json module, i.e. an empty object or array is written as {} or []"""
+    newline_indent = '\n' + ' ' * (encoder.indent * (level + 1))
+    first = True
+    for (k, v) in items:
+        if first:
+            fp.write(start)
+            first = False
+        else:
+            fp.write(encoder.item_separator)
+        fp.write(newline_indent)
+        if k is not None:
+            fp.write(encoder.encode(k))
+            fp.write(encoder.key_separator)
+        _write(v, fp, encoder, level + 1)
+    if first:
+        fp.write(start + end)
+    else:
+        fp.write('\n' + ' ' * (encoder.indent * level) + end)
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DELIMITERS = (',', ':', ']', '}')
+
+class ItemsFile:
+    """Re-iterable sequence of the items held in a top-level array property of a JSON file. The file
+    is parsed incrementally each time the object is iterated over."""
+
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.key = key
+
+    def __iter__(self):
+        fp = open(self.filename)
+        try:
+            for item in iterItems(fp, self.key):
+                yield item
+        finally:
+            fp.close()
+
+def iterItems(fp, key, bufsize=65536):
+    """Generator returning each item of the array in top-level property key of the JSON document
+    read from file-like object fp. Only one item is held in memory at a time. Nothing is returned
+    if the document does not contain the property."""
+    reader = _Reader(fp, bufsize)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() != ']':
+                while True:
+                    yield reader.value()
+                    if reader.peek() == ']':
+                        break
+                    reader.expect(',')
+            reader.expect(']')
+        else:
+            # Skip over other properties
+            reader.value()
+        if reader.peek() == '}':
+            return
+        reader.expect(',')
+
+class _Reader:
+    """Buffered reader which decodes successive JSON values from a file"""
+
+    def __init__(self, fp, bufsize):
+        self.fp = fp
+        self.bufsize = bufsize
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Read more data from the file, dropping the part of the buffer already consumed. The
+        amount read grows with the size of the value being decoded, to avoid decoding large values
+        many times over."""
+        data = self.fp.read(max(self.bufsize, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def peek(self):
+        """Skip whitespace and return the next character, without consuming it"""
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                raise ValueError('Unexpected end of JSON data')
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expecting %s at position %s: %r' % (char, self.pos, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def value(self):
+        """Decode the next value. A value is only accepted once the delimiter following it is in the
+        buffer, so that numbers split across blocks are not decoded early."""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                next = WHITESPACE.match(self.buf, end).end()
+                if self.eof or self.buf[next:next + 1] in DELIMITERS:
+                    self.pos = end
+                    return obj
+            except ValueError:
+                if self.eof:
+                    raise
+            self._fill()
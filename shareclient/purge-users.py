@@ -35,10 +35,10 @@ file.json         Name of the JSON file to load user details from
 """
 
 import getopt
-import json
 import sys
 
 import alfresco
+import jsonstream
 
 # HTTP debugging flag
 global _debug
@@ -103,17 +103,17 @@ def main(argv):
         print "Could not log in using specified credentials"
         sys.exit(1)
     try:
-        users = json.loads(open(filename).read())['people']
-        purge_users = []
+        users = jsonstream.ItemsFile(filename, 'people')
         
-        # Filter the users
-        for u in users:
-            if (include_users is None or str(u['userName']) in include_users) and u['userName'] not in skip_users:
-                purge_users.append(u)
+        def purge_users():
+            """Filter the users, reading them from the file one at a time"""
+            for u in users:
+                if (include_users is None or str(u['userName']) in include_users) and u['userName'] not in skip_users:
+                    yield u
         
         # Remove the users
-        print "Delete %s user(s)" % (len(purge_users))
-        sc.deleteUsers(purge_users)
+        print "Delete %s user(s)" % (sum([1 for u in purge_users()]))
+        sc.deleteUsers(purge_users())
     finally:
         print "Log out (%s)" % (username)
         sc.doLogout()
@@ -1,5 +1,98 @@
+import BaseHTTPServer
+import cookielib
+import httplib
+import json
+import os
+import socket
+import SocketServer
+import tempfile
+import threading
 import unittest
-from shareclient import alfresco
+import urllib2
+from shareclient import alfresco, jsonstream
+
+class KeepAliveRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the canned response for the request method and path, or else the path alone, held in the 
+    server's responses dict, over a persistent HTTP/1.1 connection. Paths that are not listed return a small JSON document, unless 
+    they contain /remotestore/ or /remoteadm/ in which case a 404 response is returned.
+    
+    Range requests are supported, and a response may be cut short by listing the number of bytes to
+    send in the server's truncate dict."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.connection)
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if (self.command, self.path) in self.server.responses:
+            (code, contentType, body) = self.server.responses[(self.command, self.path)]
+        elif self.path in self.server.responses:
+            (code, contentType, body) = self.server.responses[self.path]
+        elif '/remotestore/' in self.path or '/remoteadm/' in self.path:
+            (code, contentType, body) = (404, 'text/plain', 'Not found')
+        else:
+            (code, contentType, body) = (200, 'application/json', '{"path": "%s"}' % (self.path))
+        byteRange = self.headers.getheader('Range')
+        if byteRange is not None and code == 200:
+            body = body[int(byteRange[len('bytes='):].rstrip('-')):]
+            code = 206
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.path in self.server.truncate:
+            # Drop the connection part way through the response body
+            self.wfile.write(body[:self.server.truncate.pop(self.path)])
+            self.close_connection = 1
+        else:
+            self.wfile.write(body)
+
+    def do_POST(self):
+        self.server.posts.append((self.headers, self.rfile.read(int(self.headers.getheader('Content-Length')))))
+        self.do_GET()
+
+    do_PUT = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def startServer():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+    server.responses = {}
+    server.requests = []
+    server.truncate = {}
+    server.posts = []
+    server.connections = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def stopServer(server):
+    server.shutdown()
+    # Close any connections the client has kept alive, so that the handler threads exit
+    for conn in server.connections:
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+    server.server_close()
+
+class ServerTestCase(unittest.TestCase):
+    """Base class for tests which send requests to a test server, started for each test at self.url"""
+
+    def setUp(self):
+        self.server = startServer()
+        self.url = 'http://127.0.0.1:%s/share' % (self.server.server_address[1])
+
+    def tearDown(self):
+        stopServer(self.server)
 
 # Here's our "unit tests".
 class InitClientTests(unittest.TestCase):
@@ -12,6 +105,664 @@ class InitClientTests(unittest.TestCase):
         sc = alfresco.ShareClient('http://test:8080/share/')
         self.failUnless(sc.url == 'http://test:8080/share')
 
+class IterConcurrentTests(unittest.TestCase):
+
+    def testChunks(self):
+        consumed = []
+        def items():
+            for i in range(20):
+                consumed.append(i)
+                yield i
+        results = alfresco.iterConcurrent(lambda i: i * 2, items(), workers=2, chunkSize=5)
+        self.failUnless(results.next() == 0)
+        # Only the first chunk of items has been read
+        self.failUnless(consumed == range(5))
+        self.failUnless(list(results) == [i * 2 for i in range(1, 20)])
+
+class ConnectionPoolTests(ServerTestCase):
+
+    def testConnectionReused(self):
+        sc = alfresco.ShareClient(self.url)
+        for i in range(3):
+            self.failUnless(sc.doJSONGet('test%s' % (i)) == {'path': '/share/test%s' % (i)})
+        sc.doJSONPost('test', {'a': 1})
+        stats = sc.getConnectionStats()
+        self.failUnless(stats['new'] == 1)
+        self.failUnless(stats['reused'] == 3)
+        self.failUnless(stats['idle'] == 1)
+
+    def testPoolingDisabled(self):
+        sc = alfresco.ShareClient(self.url, poolSize=0)
+        self.failUnless(sc.doJSONGet('test') == {'path': '/share/test'})
+        self.failUnless(sc.getConnectionStats() is None)
+
+    def testPoolSize(self):
+        pool = alfresco.ConnectionPool(1)
+        conns = [FakeConnection(), FakeConnection()]
+        pool.put('key', conns[0])
+        pool.put('key', conns[1])
+        self.failUnless(conns[1].closed)
+        self.failUnless(pool.get('key') is conns[0])
+        self.failUnless(pool.get('key') is None)
+        self.failUnless(pool.getStats()['discarded'] == 1)
+
+    def testStaleConnectionDiscarded(self):
+        sc = alfresco.ShareClient(self.url)
+        sc.doJSONGet('test')
+        # Close the idle connection from the server end, so it cannot be used for the POST
+        for conn in self.server.connections:
+            conn.shutdown(socket.SHUT_RDWR)
+        self.failUnless(sc.doJSONPost('test', {'a': 1}) == {'path': '/share/test'})
+        self.failUnless(len(self.server.posts) == 1)
+        stats = sc.getConnectionStats()
+        self.failUnless(stats['new'] == 2)
+        self.failUnless(stats['discarded'] == 1)
+
+    def testPostNotResent(self):
+        pool = alfresco.ConnectionPool()
+        conn = FailingConnection()
+        key = (FailingConnection, '127.0.0.1', None)
+        pool.put(key, conn)
+        handler = alfresco.KeepAliveHTTPHandler(pool)
+        post = urllib2.Request('http://127.0.0.1/test', 'a=1')
+        get = urllib2.Request('http://127.0.0.1/test')
+        # Set by the opener for requests which are sent normally
+        post.timeout = get.timeout = None
+        self.assertRaises(urllib2.URLError, handler.do_open, FailingConnection, post)
+        self.failUnless(conn.requests == ['POST'])
+        # A GET is sent again on a new connection, which also fails here
+        conn = FailingConnection()
+        pool.put(key, conn)
+        self.assertRaises(urllib2.URLError, handler.do_open, FailingConnection, get)
+        self.failUnless(conn.requests == ['GET'])
+        self.failUnless(FailingConnection.created == 1)
+
+    def testTruncatedResponseNotReused(self):
+        self.server.truncate['/share/test'] = 5
+        sc = alfresco.ShareClient(self.url)
+        f = sc.doGet('test')
+        while f.read(4):
+            pass
+        f.close()
+        self.failUnless(sc.getConnectionStats()['idle'] == 0)
+
+class DashboardConfigTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        base = '/share/proxy/alfresco/remoteadm/get/s/sitestore/alfresco/site-data'
+        self.server.responses = {
+            base + '/pages/user/bob/dashboard.xml': (200, 'text/xml', '<page><template-instance>dashboard-2-columns-wide-right</template-instance></page>'),
+            base + '/components/page.component-1-1.user~bob~dashboard.xml': (200, 'text/xml', '<component><url>/components/dashlets/my-sites</url><region-id>component-1-1</region-id></component>'),
+            base + '/components/page.component-2-3.user~bob~dashboard.xml': (200, 'text/xml', '<component><url>/components/dashlets/rssfeed</url><region-id>component-2-3</region-id><properties><feedurl>http://test</feedurl></properties></component>')
+        }
+
+    def testGetDashboardConfig(self):
+        for workers in (1, 4):
+            sc = alfresco.ShareClient(self.url)
+            self.server.requests = []
+            config = sc.getDashboardConfig('user', 'bob', workers)
+            self.failUnless(config['templateId'] == 'dashboard-2-columns-wide-right')
+            self.failUnless([d['regionId'] for d in config['dashlets']] == ['component-1-1', 'component-2-3'])
+            self.failUnless(config['dashlets'][1]['config'] == {'feedurl': 'http://test'})
+            # Only the first request and the probe should have been made with the 3.x remotestore script
+            self.failUnless(sc.capabilities.get('sitestore') == 'remoteadm')
+            self.failUnless(len(self.server.requests) == 15)
+            self.failUnless(len([r for r in self.server.requests if '/remotestore/' in r]) == 2)
+
+    def testMissingDashboard(self):
+        sc = alfresco.ShareClient(self.url)
+        self.failUnless(sc.getDashboardConfig('user', 'alice') is None)
+        self.failUnless(sc.capabilities.get('sitestore') is None)
+
+    def testMissingDashboardKeepsStore(self):
+        # The remotestore script is present, so the 404 means the dashboard is missing
+        self.server.responses['/share/proxy/alfresco/remotestore/has/s/sitestore/alfresco/site-data/pages/user/alice/dashboard.xml'] = (200, 'text/plain', 'false')
+        sc = alfresco.ShareClient(self.url)
+        self.failUnless(sc.getDashboardConfig('user', 'alice') is None)
+        self.failUnless(sc.capabilities.get('sitestore') == 'remotestore')
+        self.failUnless(len([r for r in self.server.requests if '/remoteadm/' in r]) == 0)
+
+class ServerCapabilitiesTests(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def testPersistence(self):
+        caps = alfresco.ServerCapabilities('http://test:8080/share', self.path)
+        self.failUnless(caps.get('sitestore') is None)
+        caps.set('sitestore', 'remoteadm')
+        alfresco.ServerCapabilities('http://other:8080/share', self.path).set('sitestore', 'remotestore')
+        self.failUnless(alfresco.ServerCapabilities('http://test:8080/share', self.path).get('sitestore') == 'remoteadm')
+        self.failUnless(alfresco.ServerCapabilities('http://other:8080/share', self.path).get('sitestore') == 'remotestore')
+
+    def testSharedWithDashboardConfig(self):
+        server = startServer()
+        try:
+            url = 'http://127.0.0.1:%s/share' % (server.server_address[1])
+            alfresco.ServerCapabilities(url, self.path).set('sitestore', 'remoteadm')
+            sc = alfresco.ShareClient(url, capabilitiesFile=self.path)
+            self.failUnless(sc.getDashboardConfig('user', 'bob') is None)
+            self.failUnless(len([r for r in server.requests if '/remotestore/' in r]) == 0)
+        finally:
+            stopServer(server)
+
+class ExtendUserInfoTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        for i in range(10):
+            self.server.responses['/share/proxy/alfresco/api/people/user%s?groups=true' % (i)] = (200, 'application/json', 
+                '{"userName": "user%s", "groups": [{"itemName": "GROUP_a"}, {"itemName": "GROUP_site_test_SiteManager"}]}' % (i))
+        self.server.responses['/share/proxy/alfresco/api/people/user3?groups=true'] = (500, 'text/plain', 'Error')
+
+    def testExtendUserInfo(self):
+        sc = alfresco.ShareClient(self.url)
+        users = [ {'userName': 'user%s' % (i)} for i in range(10) ]
+        failures = sc._extendUserInfo(users, getFullDetails=True, getGroups=True, workers=4)
+        self.failUnless([u['userName'] for u in users] == ['user%s' % (i) for i in range(10)])
+        self.failUnless([f['userName'] for f in failures] == ['user3'])
+        self.failUnless(failures[0]['code'] == 500)
+        self.failUnless(json.loads(json.dumps(failures)) == failures and failures[0]['error'].startswith('Spring Surf Error 500'))
+        self.failUnless('groups' not in users[3])
+        self.failUnless(users[9]['groups'] == [{'itemName': 'GROUP_a'}])
+
+class GetAllUsersTests(ServerTestCase):
+
+    def setPeople(self, userNames, paging):
+        for skipCount in range(0, max(len(userNames), 1), 2):
+            page = { 'people': [ {'userName': u} for u in userNames[skipCount:skipCount + 2] ] }
+            if paging:
+                page['paging'] = { 'skipCount': skipCount, 'maxItems': 2, 'totalItems': len(userNames) }
+            self.server.responses['/share/proxy/alfresco/api/people?sortBy=userName&skipCount=%s&maxResults=2' % (skipCount)] = (200, 'application/json', json.dumps(page))
+        self.server.responses['/share/proxy/alfresco/api/people'] = (200, 'application/json', json.dumps({ 'people': [ {'userName': u} for u in userNames ] }))
+
+    def testPaged(self):
+        self.setPeople(['a', 'b', 'c', 'd', 'e'], True)
+        sc = alfresco.ShareClient(self.url)
+        self.failUnless([p['userName'] for p in sc.iterAllUsers(pageSize=2)] == ['a', 'b', 'c', 'd', 'e'])
+        self.failUnless(len(self.server.requests) == 3)
+
+    def testUnpaged(self):
+        self.setPeople(['a', 'b', 'c', 'd', 'e'], False)
+        sc = alfresco.ShareClient(self.url)
+        self.failUnless([p['userName'] for p in sc.iterAllUsers(pageSize=2)] == ['a', 'b', 'c', 'd', 'e'])
+        self.failUnless(sc.capabilities.get('peopleList') == 'unpaged')
+
+class GetAllGroupsTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.responses['/share/proxy/alfresco/api/rootgroups?zone=APP.DEFAULT'] = (200, 'application/json', json.dumps({ 'data': [ {'shortName': 'a'}, {'shortName': 'site_b'}, {'shortName': 'c'} ] }))
+        for name in ('a', 'c'):
+            self.server.responses['/share/proxy/alfresco/api/groups/%s/children' % (name)] = (200, 'application/json', json.dumps({ 'data': [ {'shortName': name + '1'} ] }))
+
+    def testIterAllGroups(self):
+        sc = alfresco.ShareClient(self.url)
+        groups = sc.iterAllGroups()
+        self.failUnless(len(self.server.requests) == 0)
+        self.failUnless(groups.next()['children'] == [ {'shortName': 'a1'} ])
+        self.failUnless(len(self.server.requests) == 2)
+        self.failUnless(sc.getAllGroups(['c'])['groups'] == [ {'shortName': 'a', 'children': [ {'shortName': 'a1'} ]} ])
+
+class DownloadFileTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.body = ''.join([chr(i % 256) for i in range(100000)])
+        self.server.responses['/share/test.acp'] = (200, 'application/octet-stream', self.body)
+        (fd, self.filename) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        os.remove(self.filename)
+
+    def testDownload(self):
+        sc = alfresco.ShareClient(self.url)
+        progress = []
+        result = sc.downloadFile('test.acp', self.filename, blockSize=8192, progress=lambda written, total: progress.append((written, total)))
+        self.failUnless(result['bytes'] == len(self.body))
+        self.failUnless(open(self.filename, 'rb').read() == self.body)
+        self.failUnless(len(progress) == 13)
+        self.failUnless(progress[-1] == (len(self.body), len(self.body)))
+
+    def testResume(self):
+        self.server.truncate['/share/test.acp'] = 30000
+        sc = alfresco.ShareClient(self.url)
+        result = sc.downloadFile('test.acp', self.filename, blockSize=8192)
+        self.failUnless(result['bytes'] == len(self.body))
+        self.failUnless(open(self.filename, 'rb').read() == self.body)
+        self.failUnless(self.server.requests == ['/share/test.acp', '/share/test.acp'])
+
+    def testRetriesExhausted(self):
+        self.server.truncate['/share/test.acp'] = 30000
+        sc = alfresco.ShareClient(self.url)
+        self.assertRaises(httplib.IncompleteRead, sc.downloadFile, 'test.acp', self.filename, retries=0)
+
+class DownloadAllSiteContentTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.responses['/share/proxy/alfresco/slingshot/doclib/doclist/all/node/alfresco/company/home/Sites/test/export-1'] = (200, 'application/json', json.dumps({ 'items': [ {'fileName': 'test-documentLibrary.acp'}, {'fileName': 'test-wiki.acp'} ] }))
+        self.server.responses['/share/proxy/alfresco/api/path/content/workspace/SpacesStore/Company%20Home/Sites/test/export-1/test-documentLibrary.acp'] = (200, 'application/octet-stream', 'a' * 10000)
+        self.server.responses['/share/proxy/alfresco/api/path/content/workspace/SpacesStore/Company%20Home/Sites/test/export-1/test-wiki.acp'] = (200, 'application/octet-stream', 'b' * 20000)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def testDownloadAll(self):
+        sc = alfresco.ShareClient(self.url)
+        sc.sitesContainer = 'Sites'
+        getFileName = lambda component: os.path.join(self.dir, '%s.acp' % (component))
+        results = sc.downloadAllSiteContent('test', ['documentLibrary', 'wiki'], getFileName, 'export-1', workers=2, pollInterval=0)
+        self.failUnless(results['documentLibrary']['bytes'] == 10000 and results['wiki']['bytes'] == 20000)
+        self.failUnless(open(getFileName('wiki'), 'rb').read() == 'b' * 20000)
+
+    def testTimeout(self):
+        sc = alfresco.ShareClient(self.url)
+        sc.sitesContainer = 'Sites'
+        getFileName = lambda component: os.path.join(self.dir, '%s.acp' % (component))
+        self.assertRaises(Exception, sc.downloadAllSiteContent, 'test', ['documentLibrary', 'links'], getFileName, 'export-1', pollInterval=0, timeout=0)
+
+class SiteTagInfoTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.responses['/share/proxy/alfresco/api/tagscopes/site/test/tags'] = (200, 'application/json', json.dumps({ 'tags': [ {'name': 'a'}, {'name': 'b'} ] }))
+        doc1 = {'nodeRef': 'workspace://SpacesStore/1', 'type': 'document', 'name': 'one', 'container': 'documentLibrary', 'path': '/', 'tags': ['a', 'b']}
+        doc2 = {'nodeRef': 'workspace://SpacesStore/2', 'type': 'document', 'name': 'two', 'container': 'documentLibrary', 'path': '/', 'tags': ['a']}
+        page = {'nodeRef': 'workspace://SpacesStore/3', 'type': 'wikipage', 'name': 'three', 'container': 'wiki', 'tags': ['a', 'b']}
+        search = '/share/proxy/alfresco/slingshot/search?site=test&term=&tag=%s&maxResults=2&pageSize=2&startIndex=%s&sort=&query=&repo=false'
+        self.server.responses[search % ('a', 0)] = (200, 'application/json', json.dumps({ 'totalRecords': 3, 'startIndex': 0, 'items': [ doc1, doc2 ] }))
+        self.server.responses[search % ('a', 2)] = (200, 'application/json', json.dumps({ 'totalRecords': 3, 'startIndex': 2, 'items': [ page ] }))
+        self.server.responses[search % ('b', 0)] = (200, 'application/json', json.dumps({ 'totalRecords': 2, 'startIndex': 0, 'items': [ doc1, page ] }))
+        self.server.responses['/share/proxy/alfresco/slingshot/doclib/node/workspace/SpacesStore/3'] = (200, 'application/json', json.dumps({ 'item': { 'location': { 'path': '/Main_Page' } } }))
+
+    def testGetAllSiteTagInfo(self):
+        sc = alfresco.ShareClient(self.url)
+        tagInfo = sc.getAllSiteTagInfo('test', pageSize=2)
+        self.failUnless(sorted([item['name'] for item in tagInfo['documentLibrary']]) == ['one', 'two'])
+        self.failUnless(tagInfo['wiki'] == [ {'type': 'wikipage', 'name': 'three', 'container': 'wiki', 'path': 'Main_Page', 'tags': ['a', 'b']} ])
+        # Each tag is searched for once and each missing path looked up once
+        self.failUnless(len([r for r in self.server.requests if '/slingshot/search' in r]) == 3)
+        self.failUnless(len([r for r in self.server.requests if '/doclib/node/' in r]) == 1)
+
+    def testUnpaged(self):
+        search = '/share/proxy/alfresco/slingshot/search?site=test&term=&tag=%s&maxResults=%s&pageSize=2&startIndex=%s&sort=&query=&repo=false'
+        self.server.responses = { search % ('a', 2, 0): (200, 'application/json', json.dumps({ 'items': [ {'n': 1}, {'n': 2} ] })), 
+            search % ('a', 4, 2): (200, 'application/json', json.dumps({ 'items': [ {'n': 1}, {'n': 2}, {'n': 3} ] })) }
+        sc = alfresco.ShareClient(self.url)
+        self.failUnless([item['n'] for item in sc.iterTaggedItems('test', 'a', pageSize=2)] == [1, 2, 3])
+
+class FolderListingCacheTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        items = [ {'node': {'nodeRef': 'workspace://SpacesStore/%s' % (i), 'properties': {'cm:name': 'doc%s.txt' % (i)}}} for i in range(3) ]
+        self.server.responses['/share/proxy/alfresco/slingshot/doclib2/doclist/space/site/test/documentLibrary/Folder'] = (200, 'application/json', json.dumps({ 'items': items }))
+
+    def testFolderListedOnce(self):
+        sc = alfresco.ShareClient(self.url)
+        cache = alfresco.FolderListingCache()
+        for i in range(3):
+            item = sc._getNodeInfoByPath('test', 'documentLibrary', 'Folder/doc%s.txt' % (i), cache)
+            self.failUnless(item['node']['nodeRef'] == 'workspace://SpacesStore/%s' % (i))
+        self.assertRaises(Exception, sc._getNodeInfoByPath, 'test', 'documentLibrary', 'Folder/missing.txt', cache)
+        self.failUnless(len(self.server.requests) == 1)
+        self.failUnless(cache.getStats() == { 'hits': 3, 'misses': 1, 'folders': 1 })
+
+class DocListVariantTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.responses['/share/proxy/alfresco/slingshot/doclib2/doclist/space/site/test/documentLibrary/Missing'] = (404, 'text/plain', 'Not found')
+        self.server.responses['/share/proxy/alfresco/slingshot/doclib/doclist/all/node/alfresco/company/home/Sites/test/documentLibrary/Missing/doc.txt'] = (200, 'application/json', json.dumps({ 'items': [] }))
+
+    def testMissingFolder(self):
+        sc = alfresco.ShareClient(self.url)
+        sc.sitesContainer = 'Sites'
+        self.assertRaises(alfresco.SurfRequestError, sc._getNodeInfoByPath, 'test', 'documentLibrary', 'Missing/doc.txt')
+        self.failUnless(sc.capabilities.get('doclist') == 'doclib2')
+        self.failUnless(len([r for r in self.server.requests if '/doclib/' in r]) == 0)
+
+    def testLegacyServer(self):
+        self.server.responses['/share/proxy/alfresco/slingshot/doclib2/doclist/all/node/alfresco/company/home'] = (404, 'text/plain', 'Not found')
+        sc = alfresco.ShareClient(self.url)
+        sc.sitesContainer = 'Sites'
+        self.failUnless(sc._getNodeInfoByPath('test', 'documentLibrary', 'Missing/doc.txt') == { 'items': [] })
+        self.failUnless(sc.capabilities.get('doclist') == 'doclib')
+
+class ImportSiteTagsTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        picker = '/share/proxy/alfresco/api/forms/picker/category/alfresco/category/root/children?selectableType=cm:category&size=%s&aspect=cm:taggable'
+        tags = [ {'name': 'a', 'nodeRef': 'workspace://SpacesStore/tag-a'}, {'name': 'b', 'nodeRef': 'workspace://SpacesStore/tag-b'} ]
+        self.server.responses[picker % (1)] = (200, 'application/json', json.dumps({ 'data': { 'items': tags[0:1] } }))
+        self.server.responses[picker % (2)] = (200, 'application/json', json.dumps({ 'data': { 'items': tags } }))
+        self.server.responses[picker % (4)] = (200, 'application/json', json.dumps({ 'data': { 'items': tags } }))
+        self.server.responses[picker % (1000)] = (200, 'application/json', json.dumps({ 'data': { 'items': tags } }))
+        self.server.responses['/share/proxy/alfresco/api/tag/workspace/SpacesStore'] = (200, 'application/json', json.dumps({ 'nodeRef': 'workspace://SpacesStore/tag-c' }))
+        items = [ {'node': {'nodeRef': 'workspace://SpacesStore/%s' % (i), 'properties': {'cm:name': 'doc%s.txt' % (i)}}} for i in range(2) ]
+        self.server.responses['/share/proxy/alfresco/slingshot/doclib2/doclist/space/site/test/documentLibrary/Folder'] = (200, 'application/json', json.dumps({ 'items': items }))
+        self.server.responses['/share/proxy/alfresco/api/node/workspace/SpacesStore/0/formprocessor'] = (200, 'application/json', json.dumps({ 'persistedObject': 'workspace://SpacesStore/0' }))
+        self.server.responses['/share/proxy/alfresco/api/node/workspace/SpacesStore/1/formprocessor'] = (500, 'text/plain', 'Error')
+
+    def testGetTagNodeRefs(self):
+        sc = alfresco.ShareClient(self.url)
+        self.failUnless(sc.getTagNodeRefs(pageSize=1) == { 'a': 'workspace://SpacesStore/tag-a', 'b': 'workspace://SpacesStore/tag-b' })
+        self.failUnless(len(self.server.requests) == 3)
+
+    def testImportSiteTags(self):
+        sc = alfresco.ShareClient(self.url)
+        nodes = [ {'container': 'documentLibrary', 'path': 'Folder', 'name': 'doc0.txt', 'tags': ['a', 'c']}, 
+            {'container': 'documentLibrary', 'path': 'Folder', 'name': 'doc1.txt', 'tags': ['b', 'c']}, 
+            {'container': 'documentLibrary', 'path': 'Folder', 'name': 'missing.txt', 'tags': ['a']} ]
+        failures = []
+        persisted = sc.importSiteTags('test', nodes, workers=2, failures=failures, batchSize=2)
+        self.failUnless(persisted == ['workspace://SpacesStore/0'])
+        self.failUnless(len(self.server.posts) == 3)
+        self.failUnless([(f['name'], getattr(f['error'], 'code', None)) for f in failures] == [('doc1.txt', 500), ('missing.txt', None)])
+        self.failUnless(json.loads(self.server.posts[1][1]) in ({'prop_cm_taggable': 'workspace://SpacesStore/tag-a,workspace://SpacesStore/tag-c'}, 
+            {'prop_cm_taggable': 'workspace://SpacesStore/tag-b,workspace://SpacesStore/tag-c'}))
+
+class AddSiteMembersTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sc = alfresco.ShareClient('http://127.0.0.1:1/share')
+        self.existing = set(['user0', 'user2'])
+        self.created = []
+        def addSiteMember(siteName, m):
+            if m['authority']['userName'] not in self.existing:
+                raise alfresco.SurfRequestError('POST', 'test', 404, 'Not found', {}, None)
+            return { 'role': m['role'] }
+        def createUser(u):
+            self.created.append(u['userName'])
+            self.existing.add(u['userName'])
+        self.sc.addSiteMember = addSiteMember
+        self.sc.createUser = createUser
+
+    def testCreateMissingMembers(self):
+        members = [ {'authority': {'userName': 'user%s' % (i), 'authorityType': 'USER'}, 'role': 'SiteConsumer'} for i in range(5) ]
+        people = [ {'userName': 'user%s' % (i)} for i in range(10) if i != 4 ]
+        results = self.sc.addSiteMembers('test', members, createMissingMembers=True, authorityData={ 'people': people }, workers=3)
+        self.failUnless([r['member']['authority']['userName'] for r in results['membersAdded']] == ['user0', 'user2'])
+        self.failUnless([r['person']['userName'] for r in results['membersCreated']] == ['user1', 'user3'])
+        self.failUnless(sorted(self.created) == ['user1', 'user3'])
+
+class CreateUsersBulkTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.responses['/share/proxy/alfresco/api/people?sortBy=userName&skipCount=0&maxResults=100'] = (200, 'application/json', 
+            json.dumps({ 'people': [ {'userName': 'user0'} ], 'paging': { 'totalItems': 1 } }))
+        self.server.responses['/share/proxy/alfresco/api/people'] = (200, 'application/json', 
+            json.dumps({ 'userName': 'new', 'email': 'new@example.com', 'firstName': 'New', 'lastName': 'User', 'quota': -1 }))
+        self.server.responses['/share/proxy/alfresco/api/groups/test/children?authorityType=USER'] = (200, 'application/json', json.dumps({ 'data': [] }))
+
+    def testCreateUsersBulk(self):
+        sc = alfresco.ShareClient(self.url)
+        users = [ {'userName': 'user%s' % (i), 'password': 'pw'} for i in range(4) ]
+        users[1]['groups'] = [ {'itemName': 'GROUP_test'} ]
+        results = sc.createUsersBulk(iter(users), skip_users=['user3'], workers=2)
+        self.failUnless(results == { 'created': ['user1', 'user2'], 'skipped': ['user0'], 'failures': [] })
+        # Two users created and one group membership added, without fetching the new user
+        self.failUnless(len(self.server.posts) == 3)
+        self.failUnless(len([r for r in self.server.requests if r.startswith('/share/proxy/alfresco/api/people/')]) == 0)
+        self.failUnless('/share/proxy/alfresco/api/groups/test/children/user1' in self.server.requests)
+
+    def testExistingUsersAndErrors(self):
+        sc = alfresco.ShareClient(self.url)
+        createUser = sc.createUser
+        def failingCreateUser(u, defaultPassword=None, defaultEmail=None):
+            if u['userName'] == 'user2':
+                raise ValueError('Bad response')
+            return createUser(u, defaultPassword, defaultEmail)
+        sc.createUser = failingCreateUser
+        users = [ {'userName': 'user%s' % (i), 'password': 'pw', 'groups': [ {'itemName': 'GROUP_test'} ]} for i in range(3) ]
+        results = sc.createUsersBulk(users, workers=2)
+        self.failUnless(results['created'] == ['user1'])
+        self.failUnless(results['skipped'] == ['user0'])
+        self.failUnless([(f['userName'], str(f['error'])) for f in results['failures']] == [ ('user2', 'Bad response') ])
+        # The existing user is still added to their groups, but not the user who could not be created
+        self.failUnless('/share/proxy/alfresco/api/groups/test/children/user0' in self.server.requests)
+        self.failUnless('/share/proxy/alfresco/api/groups/test/children/user1' in self.server.requests)
+        self.failIf('/share/proxy/alfresco/api/groups/test/children/user2' in self.server.requests)
+
+class AssignUserGroupsTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.responses['/share/proxy/alfresco/api/groups/a/children?authorityType=USER'] = (200, 'application/json', 
+            json.dumps({ 'data': [ {'shortName': 'user0', 'fullName': 'user0', 'authorityType': 'USER'} ] }))
+        self.server.responses['/share/proxy/alfresco/api/groups/b/children?authorityType=USER'] = (200, 'application/json', json.dumps({ 'data': [] }))
+        self.server.responses['/share/proxy/alfresco/api/groups/missing/children?authorityType=USER'] = (404, 'text/plain', 'Not found')
+
+    def testAssignUserGroups(self):
+        sc = alfresco.ShareClient(self.url)
+        users = [ {'userName': 'user%s' % (i), 'groups': [ {'itemName': 'GROUP_a'}, 'GROUP_b' ]} for i in range(3) ]
+        users.append({'userName': 'user3', 'groups': [ {'fullName': 'GROUP_missing'} ]})
+        users.append({'userName': 'user4'})
+        results = sc.assignUserGroups(users, workers=2)
+        self.failUnless(results['added'] == [ ('GROUP_a', 'user1'), ('GROUP_a', 'user2'), ('GROUP_b', 'user0'), ('GROUP_b', 'user1'), ('GROUP_b', 'user2') ])
+        self.failUnless([(f['group'], f['userName']) for f in results['failures']] == [ ('GROUP_missing', None) ])
+        # One request to list each group plus one for each membership added
+        self.failUnless(len(self.server.requests) == 8)
+
+class GroupTreeTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.responses['/share/proxy/alfresco/api/rootgroups?zone=APP.DEFAULT'] = (200, 'application/json', json.dumps({ 'data': [ 
+            {'shortName': 'a'}, {'shortName': 'b'}, {'shortName': 'site_c'} ] }))
+        children = { 'a': ['shared', 'a1'], 'b': ['shared'], 'a1': ['shared'], 'shared': [] }
+        for (name, groups) in children.items():
+            self.server.responses['/share/proxy/alfresco/api/groups/%s/children?skipCount=0&maxItems=2' % (name)] = (200, 'application/json', 
+                json.dumps({ 'data': [ {'shortName': g, 'authorityType': 'GROUP'} for g in groups ], 'paging': {'totalItems': len(groups) + 1} }))
+            self.server.responses['/share/proxy/alfresco/api/groups/%s/children?skipCount=%s&maxItems=2' % (name, len(groups))] = (200, 'application/json', 
+                json.dumps({ 'data': [ {'shortName': 'user1', 'authorityType': 'USER'} ], 'paging': {'totalItems': len(groups) + 1} }))
+
+    def testGetGroupTree(self):
+        sc = alfresco.ShareClient(self.url)
+        tree = sc.getGroupTree(workers=2, pageSize=2)
+        self.failUnless([g['shortName'] for g in tree['groups']] == [ 'a', 'b' ])
+        self.failUnless([c['shortName'] for c in tree['groups'][0]['children']] == [ 'shared', 'a1', 'user1' ])
+        # Nested groups are listed once each, with their own children
+        self.failUnless([g['shortName'] for g in tree['subgroups']] == [ 'shared', 'a1' ])
+        self.failUnless([c['shortName'] for c in tree['subgroups'][0]['children']] == [ 'user1' ])
+        self.failUnless('children' not in tree['groups'][1]['children'][0])
+        # The list of root groups, plus one page of children for 'shared' and two for each other group
+        self.failUnless(len(self.server.requests) == 8)
+
+    def testExportImport(self):
+        # Three levels of groups, a > b > c, with c also a child of the root group d
+        children = { 'a': ['b'], 'b': ['c'], 'c': [], 'd': ['c'] }
+        self.server.responses['/share/proxy/alfresco/api/rootgroups?zone=APP.DEFAULT'] = (200, 'application/json', json.dumps({ 'data': [ 
+            {'shortName': 'a', 'displayName': 'A'}, {'shortName': 'd', 'displayName': 'D'} ] }))
+        for (name, groups) in children.items():
+            self.server.responses['/share/proxy/alfresco/api/groups/%s/children?skipCount=0&maxItems=1000' % (name)] = (200, 'application/json', 
+                json.dumps({ 'data': [ {'shortName': g, 'displayName': g.upper(), 'authorityType': 'GROUP'} for g in groups ] }))
+        sc = alfresco.ShareClient(self.url)
+        (fd, filename) = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            jsonstream.dumpFile(sc.getAllGroups(recursive=True), filename)
+            # Import into an empty repository
+            for name in children:
+                self.server.responses[('GET', '/share/proxy/alfresco/api/groups/%s' % (name))] = (404, 'text/plain', 'Not found')
+            self.server.requests = []
+            sc.createGroupTree(jsonstream.ItemsFile(filename, 'groups'), jsonstream.ItemsFile(filename, 'subgroups'))
+        finally:
+            os.remove(filename)
+        posts = [r for r in self.server.requests if '/rootgroups/' in r or '/children/' in r]
+        self.failUnless(posts == [ '/share/proxy/alfresco/api/rootgroups/a', '/share/proxy/alfresco/api/groups/a/children/GROUP_b', 
+            '/share/proxy/alfresco/api/groups/b/children/GROUP_c', '/share/proxy/alfresco/api/rootgroups/d', 
+            '/share/proxy/alfresco/api/groups/d/children/GROUP_c' ])
+
+    def testReimport(self):
+        # All the groups exist, but c is not yet a child of d
+        children = { 'a': ['b'], 'b': ['c'], 'c': [], 'd': [] }
+        for (name, groups) in children.items():
+            self.server.responses['/share/proxy/alfresco/api/groups/%s/children?skipCount=0&maxItems=1000' % (name)] = (200, 'application/json', 
+                json.dumps({ 'data': [ {'shortName': g, 'authorityType': 'GROUP'} for g in groups ] }))
+        group = lambda name, groups: {'shortName': name, 'displayName': name.upper(), 'authorityType': 'GROUP', 
+            'children': [ {'shortName': g, 'authorityType': 'GROUP'} for g in groups ]}
+        sc = alfresco.ShareClient(self.url)
+        sc.createGroupTree([ group('a', ['b']), group('d', ['c']) ], [ group('b', ['c']), group('c', []) ])
+        posts = [r for r in self.server.requests if '/rootgroups/' in r or '/children/' in r]
+        self.failUnless(posts == [ '/share/proxy/alfresco/api/groups/d/children/GROUP_c' ])
+
+class UserGroupIndexTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        groups = [ ('GROUP_a', 'Group A'), ('GROUP_b', 'Group B'), ('GROUP_site_test_SiteManager', 'Site Manager') ]
+        for skipCount in (0, 2):
+            self.server.responses['/share/proxy/alfresco/api/groups?shortNameFilter=*&skipCount=%s&maxItems=2' % (skipCount)] = (200, 'application/json', 
+                json.dumps({ 'data': [ {'fullName': g, 'displayName': d} for (g, d) in groups[skipCount:skipCount + 2] ], 'paging': {'totalItems': 3} }))
+        children = { 'a': ['user0', 'GROUP_b', 'GROUP_site_test_SiteManager'], 'b': ['user1'], 'site_test_SiteManager': ['user2'] }
+        for (name, members) in children.items():
+            for skipCount in range(0, len(members), 2):
+                self.server.responses['/share/proxy/alfresco/api/groups/%s/children?skipCount=%s&maxItems=2' % (name, skipCount)] = (200, 'application/json', json.dumps({ 'data': [ 
+                    {'fullName': m, 'authorityType': m.startswith('GROUP_') and 'GROUP' or 'USER'} for m in members[skipCount:skipCount + 2] ], 
+                    'paging': {'totalItems': len(members)} }))
+
+    def testGetUserGroupIndex(self):
+        sc = alfresco.ShareClient(self.url)
+        index = sc.getUserGroupIndex(workers=2, pageSize=2)
+        # Members of nested groups are members of the parent group, but site groups are not included
+        self.failUnless(index == { 'user0': [ {'itemName': 'GROUP_a', 'displayName': 'Group A'} ], 
+            'user1': [ {'itemName': 'GROUP_a', 'displayName': 'Group A'}, {'itemName': 'GROUP_b', 'displayName': 'Group B'} ],
+            'user2': [ {'itemName': 'GROUP_a', 'displayName': 'Group A'} ] })
+        # Two pages of groups, plus the children of each group a page at a time
+        self.failUnless(len(self.server.requests) == 6)
+
+class MultipartUploadTests(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        (fd, self.filename) = tempfile.mkstemp(suffix='.acp')
+        os.write(fd, 'x' * 100000)
+        os.close(fd)
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        os.remove(self.filename)
+
+    def testMultipartBody(self):
+        f = open(self.filename, 'rb')
+        body = alfresco.MultipartBody({ 'siteid': 'test', 'filedata': f }, 4096)
+        data = ''
+        block = body.read()
+        while block:
+            self.failUnless(len(block) <= 4096)
+            data += block
+            block = body.read()
+        self.failUnless(len(data) == len(body))
+        self.failUnless(data.startswith('--%s\r\nContent-Disposition: form-data; name="siteid"\r\n\r\ntest\r\n' % (body.boundary)))
+        self.failUnless(data.endswith('x' * 100000 + '\r\n--%s--\r\n\r\n' % (body.boundary)))
+        body.reset()
+        block = body.read()
+        self.failUnless(block and data.startswith(block))
+        f.close()
+
+    def testUnicodeField(self):
+        body = alfresco.MultipartBody({ 'title': u'Caf\xe9' })
+        data = ''.join(iter(body.read, ''))
+        self.failUnless('\r\n\r\nCaf\xc3\xa9\r\n' in data)
+        self.failUnless(len(data) == len(body))
+
+    def testBlockSizeWithoutPool(self):
+        sent = []
+        class RecordingSocket:
+            def sendall(self, data):
+                sent.append(data)
+        conn = alfresco.StreamingHTTPConnection('127.0.0.1')
+        conn.sock = RecordingSocket()
+        f = open(self.filename, 'rb')
+        body = alfresco.MultipartBody({ 'siteid': 'test', 'filedata': f }, 32768)
+        conn.send(body)
+        f.close()
+        self.failUnless(sum([len(s) for s in sent]) == len(body))
+        self.failUnless(max([len(s) for s in sent]) == 32768)
+
+    def testUpload(self):
+        sc = alfresco.ShareClient(self.url, uploadBlockSize=4096)
+        sc.cj.set_cookie(cookielib.Cookie(0, alfresco.CSRF_TOKEN_NAME, 'abc', None, False, '127.0.0.1', False, False, '/', True, False, None, False, None, None, {}))
+        f = open(self.filename, 'rb')
+        sc.doMultipartUpload('proxy/alfresco/api/upload', { 'siteid': 'test', 'filedata': f }).read()
+        f.close()
+        (headers, data) = self.server.posts[0]
+        self.failUnless(headers.getheader('Content-Type').startswith('multipart/form-data; boundary='))
+        self.failUnless(headers.getheader(alfresco.CSRF_TOKEN_NAME) == 'abc')
+        self.failUnless('filename="%s"' % (os.path.basename(self.filename)) in data)
+        self.failUnless(self.server.requests == ['/share/proxy/alfresco/api/upload?%s=abc' % (alfresco.CSRF_TOKEN_NAME)])
+
+    def testUploadWithoutPool(self):
+        sc = alfresco.ShareClient(self.url, poolSize=0, uploadBlockSize=4096)
+        sc.cj.set_cookie(cookielib.Cookie(0, alfresco.CSRF_TOKEN_NAME, 'abc', None, False, '127.0.0.1', False, False, '/', True, False, None, False, None, None, {}))
+        f = open(self.filename, 'rb')
+        sc.doMultipartUpload('proxy/alfresco/api/upload', { 'siteid': 'test', 'filedata': f }).read()
+        f.close()
+        (headers, data) = self.server.posts[0]
+        self.failUnless(data.endswith('x' * 100000 + '\r\n--%s--\r\n\r\n' % (headers.getheader('Content-Type').split('boundary=')[1])))
+
+class FakeConnection:
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+class FailingConnection(FakeConnection):
+    """Connection whose requests fail once they have been sent. New connections made using the class
+    fail to connect."""
+
+    created = 0
+
+    def __init__(self, host=None, timeout=None):
+        self.host = host
+        if host is not None:
+            FailingConnection.created += 1
+        self.requests = []
+        (self.sock, self.peer) = socket.socketpair()
+
+    def set_debuglevel(self, level):
+        pass
+
+    def putrequest(self, method, url, **kwargs):
+        if self.host is not None:
+            raise socket.error('Connection refused')
+        self.requests.append(method)
+
+    def putheader(self, name, value):
+        pass
+
+    def endheaders(self):
+        pass
+
+    def send(self, data):
+        pass
+
+    def getresponse(self, buffering=False):
+        raise httplib.BadStatusLine('')
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        self.peer.close()
+
 def main():
     unittest.main()
 
@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from shareclient import jsonstream
+
+SAMPLE = {
+    'people': [
+        {'userName': 'bob', 'firstName': u'B\xf6b', 'groups': [{'itemName': 'GROUP_a'}], 'dashboardConfig': {'dashlets': []}, 'enabled': True},
+        {'userName': 'alice', 'jobtitle': None, 'sizeCurrent': 0, 'description': 'Line 1\nLine 2', 'groups': [], 'config': {}}
+    ],
+    'meta': {'count': 2, 'names': ['bob', 'alice']}
+}
+
+class DumpTests(unittest.TestCase):
+
+    def dumps(self, obj):
+        out = StringIO()
+        jsonstream.dump(obj, out)
+        return out.getvalue()
+
+    def testSameAsJsonDumps(self):
+        expected = json.dumps(SAMPLE, sort_keys=True, indent=4)
+        self.failUnless(self.dumps(SAMPLE) == expected)
+
+    def testGenerators(self):
+        expected = json.dumps(SAMPLE, sort_keys=True, indent=4)
+        streamed = {
+            'people': (p for p in SAMPLE['people']),
+            'meta': {'count': 2, 'names': iter(SAMPLE['meta']['names'])}
+        }
+        self.failUnless(self.dumps(streamed) == expected)
+
+    def testEmptyGenerator(self):
+        expected = json.dumps({'people': []}, sort_keys=True, indent=4)
+        self.failUnless(self.dumps({'people': iter([])}) == expected)
+
+class DumpFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'people.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testDumpFile(self):
+        jsonstream.dumpFile({'people': iter(SAMPLE['people'])}, self.filename)
+        self.failUnless(json.load(open(self.filename)) == {'people': SAMPLE['people']})
+        self.failUnless(os.listdir(self.dir) == ['people.json'])
+
+    def testErrorLeavesExistingFile(self):
+        open(self.filename, 'w').write('{}')
+        def people():
+            yield SAMPLE['people'][0]
+            raise IOError('Request failed')
+        self.assertRaises(IOError, jsonstream.dumpFile, {'people': people()}, self.filename)
+        self.failUnless(open(self.filename).read() == '{}')
+        self.failUnless(os.listdir(self.dir) == ['people.json'])
+
+class IterItemsTests(unittest.TestCase):
+
+    def items(self, doc, key, bufsize):
+        return list(jsonstream.iterItems(StringIO(doc), key, bufsize))
+
+    def testItems(self):
+        doc = json.dumps(SAMPLE, sort_keys=True, indent=4)
+        for bufsize in (1, 7, 65536):
+            self.failUnless(self.items(doc, 'people', bufsize) == SAMPLE['people'])
+            self.failUnless(self.items(doc, 'names', bufsize) == [])
+
+    def testNumbers(self):
+        # Numbers must not be decoded before the following character has been read
+        doc = '{"a": {"b": 1}, "items": [12345, 1.5e10, true, null, "x"]}'
+        for bufsize in (1, 2, 3):
+            self.failUnless(self.items(doc, 'items', bufsize) == [12345, 1.5e10, True, None, u'x'])
+
+    def testEmpty(self):
+        self.failUnless(self.items('{}', 'people', 2) == [])
+        self.failUnless(self.items('{"people": []}', 'people', 2) == [])
+
+    def testInvalid(self):
+        self.assertRaises(ValueError, self.items, '{"people": [{"userName": "a"}, ', 'people', 4)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
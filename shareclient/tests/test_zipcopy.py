@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+import zipfile
+from shareclient import zipcopy
+
+class CopyMemberTests(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.src) = tempfile.mkstemp(suffix='.zip')
+        os.close(fd)
+        (fd, self.dst) = tempfile.mkstemp(suffix='.zip')
+        os.close(fd)
+        srcZip = zipfile.ZipFile(self.src, 'w', zipfile.ZIP_DEFLATED)
+        srcZip.writestr('site/doc.txt', 'Some text ' * 1000)
+        srcZip.writestr(zipfile.ZipInfo('site/image.png'), '\x89PNG' + ''.join([chr(i % 256) for i in range(5000)]))
+        srcZip.close()
+
+    def tearDown(self):
+        os.remove(self.src)
+        os.remove(self.dst)
+
+    def testCopyMember(self):
+        srcZip = zipfile.ZipFile(self.src, 'r')
+        dstZip = zipfile.ZipFile(self.dst, 'w', zipfile.ZIP_DEFLATED)
+        dstZip.writestr('site.xml', '<view/>')
+        for name in srcZip.namelist():
+            zipcopy.copyMember(srcZip, name, dstZip)
+        zipcopy.copyMember(srcZip, 'site/doc.txt', dstZip, 'other/doc.txt')
+        dstZip.close()
+        dstZip = zipfile.ZipFile(self.dst, 'r')
+        self.failUnless(dstZip.testzip() is None)
+        self.failUnless(dstZip.namelist() == ['site.xml', 'site/doc.txt', 'site/image.png', 'other/doc.txt'])
+        for name in srcZip.namelist():
+            self.failUnless(dstZip.read(name) == srcZip.read(name))
+            self.failUnless(dstZip.getinfo(name).compress_type == srcZip.getinfo(name).compress_type)
+        self.failUnless(dstZip.read('other/doc.txt') == srcZip.read('site/doc.txt'))
+        srcZip.close()
+        dstZip.close()
+
+class ArchiveWriterTests(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.dst) = tempfile.mkstemp(suffix='.zip')
+        os.close(fd)
+        (fd, self.txt) = tempfile.mkstemp(suffix='.txt')
+        os.write(fd, 'Some text ' * 10000)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.dst)
+        os.remove(self.txt)
+
+    def writeArchive(self, policy):
+        writer = zipcopy.ArchiveWriter(zipfile.ZipFile(self.dst, 'w', zipfile.ZIP_DEFLATED), policy)
+        writer.write(self.txt, 'doc.txt')
+        writer.writestr('image.jpg', '\xff\xd8' + 'x' * 1000)
+        writer.writestr('data.acp', 'PK' + 'x' * 1000)
+        writer.writestr('desc', 'Some description ' * 100, mimetype='text/plain')
+        stats = writer.close()
+        return (zipfile.ZipFile(self.dst, 'r'), stats)
+
+    def testCompressionPolicy(self):
+        (dstZip, stats) = self.writeArchive(zipcopy.CompressionPolicy(level=9))
+        self.failUnless(dstZip.testzip() is None)
+        self.failUnless(dstZip.namelist() == ['doc.txt', 'image.jpg', 'data.acp', 'desc'])
+        self.failUnless(dstZip.read('doc.txt') == 'Some text ' * 10000)
+        self.failUnless(dstZip.getinfo('doc.txt').compress_type == zipfile.ZIP_DEFLATED)
+        self.failUnless(dstZip.getinfo('desc').compress_type == zipfile.ZIP_DEFLATED)
+        self.failUnless(dstZip.getinfo('image.jpg').compress_type == zipfile.ZIP_STORED)
+        self.failUnless(dstZip.getinfo('data.acp').compress_type == zipfile.ZIP_STORED)
+        self.failUnless(stats['stored'] == 2004)
+        self.failUnless(stats['deflated'] == 101700)
+        self.failUnless(stats['deflatedSize'] < 1000)
+        dstZip.close()
+
+    def testThreads(self):
+        (dstZip, stats) = self.writeArchive(zipcopy.CompressionPolicy(level=1, storeTypes=[], threads=4))
+        self.failUnless(dstZip.testzip() is None)
+        self.failUnless(dstZip.namelist() == ['doc.txt', 'image.jpg', 'data.acp', 'desc'])
+        self.failUnless(dstZip.getinfo('image.jpg').compress_type == zipfile.ZIP_DEFLATED)
+        self.failUnless(dstZip.getinfo('data.acp').compress_type == zipfile.ZIP_STORED)
+        self.failUnless(dstZip.read('desc') == 'Some description ' * 100)
+        dstZip.close()
+
+    def testPendingLimit(self):
+        writer = zipcopy.ArchiveWriter(zipfile.ZipFile(self.dst, 'w', zipfile.ZIP_DEFLATED), zipcopy.CompressionPolicy(threads=2))
+        for i in range(50):
+            writer.writestr('desc%s' % (i), 'Some description %s ' % (i) * 100, mimetype='text/plain')
+            self.failUnless(len(writer.pending) < 4)
+        stats = writer.close()
+        dstZip = zipfile.ZipFile(self.dst, 'r')
+        self.failUnless(dstZip.namelist() == ['desc%s' % (i) for i in range(50)])
+        self.failUnless(dstZip.read('desc49') == 'Some description 49 ' * 100)
+        self.failUnless(stats['deflated'] == sum([len('Some description %s ' % (i) * 100) for i in range(50)]))
+        dstZip.close()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
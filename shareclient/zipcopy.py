@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+# zipcopy.py
+
+"""This module copies members from one ZIP archive into another without decompressing and
+recompressing them, by copying the compressed data as it is stored in the source file.
+
+It is used when repackaging large ACP files, where content items can be copied across unchanged
+and only the metadata needs to be regenerated. ArchiveWriter adds new members according to a
+CompressionPolicy, so that files which are already compressed are stored rather than deflated.
+"""
+
+import mimetypes
+import os
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from multiprocessing.pool import ThreadPool
+
+BLOCK_SIZE = 1024 * 64
+
+# Mimetypes of files which are compressed already, so gain little from being deflated
+COMPRESSED_MIMETYPES = [
+    'image/jpeg', 'image/pjpeg', 'image/png', 'image/gif',
+    'application/pdf', 'application/zip', 'application/x-gzip', 'application/java-archive',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.oasis.opendocument.text',
+    'application/vnd.oasis.opendocument.spreadsheet',
+    'application/vnd.oasis.opendocument.presentation',
+    'audio/mpeg', 'video/mp4', 'video/mpeg', 'video/quicktime'
+]
+
+# File extensions of ZIP archives, which mimetypes does not know about
+ARCHIVE_EXTENSIONS = ['.acp', '.jar', '.zip']
+
+def copyMember(srcZip, name, dstZip, arcname=None):
+    """Copy the member name from the ZipFile srcZip, which must be open for reading, to the ZipFile
+    dstZip, which must be open for writing, under the name arcname if given. The data is copied in
+    its compressed form, so the compression type of the member is unchanged. Returns the ZipInfo
+    of the new member."""
+    srcInfo = srcZip.getinfo(name)
+    zinfo = zipfile.ZipInfo(arcname or srcInfo.filename, srcInfo.date_time)
+    zinfo.compress_type = srcInfo.compress_type
+    zinfo.comment = srcInfo.comment
+    zinfo.create_system = srcInfo.create_system
+    zinfo.external_attr = srcInfo.external_attr
+    # The sizes and CRC are written in the local header, so no data descriptor is needed
+    zinfo.flag_bits = srcInfo.flag_bits & ~0x08
+    zinfo.CRC = srcInfo.CRC
+    zinfo.compress_size = srcInfo.compress_size
+    zinfo.file_size = srcInfo.file_size
+    zinfo.extract_version = max(zinfo.extract_version, srcInfo.extract_version)
+
+    # Find the start of the compressed data, after the local header of the source member
+    srcZip.fp.seek(srcInfo.header_offset)
+    fheader = struct.unpack(zipfile.structFileHeader, srcZip.fp.read(zipfile.sizeFileHeader))
+    if fheader[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+        raise zipfile.BadZipfile("Bad magic number for file header")
+    srcZip.fp.seek(fheader[zipfile._FH_FILENAME_LENGTH] + fheader[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+    writeRawMember(dstZip, zinfo, srcZip.fp)
+    return zinfo
+
+def writeRawMember(dstZip, zinfo, fp):
+    """Add a member to dstZip, reading zinfo.compress_size bytes of data which has already been
+    compressed using zinfo.compress_type from the file object fp"""
+    zinfo.header_offset = dstZip.fp.tell()
+    dstZip._writecheck(zinfo)
+    dstZip._didModify = True
+    dstZip.fp.write(zinfo.FileHeader())
+    remaining = zinfo.compress_size
+    while remaining > 0:
+        block = fp.read(min(BLOCK_SIZE, remaining))
+        if not block:
+            raise zipfile.BadZipfile("Truncated data for member %s" % (zinfo.filename))
+        dstZip.fp.write(block)
+        remaining -= len(block)
+    dstZip.filelist.append(zinfo)
+    dstZip.NameToInfo[zinfo.filename] = zinfo
+
+def deflate(zinfo, level, filename=None, data=None):
+    """Compress the file filename, or else the string data, at the given zlib level into a temporary
+    file, setting the sizes and CRC of zinfo. Returns the temporary file, positioned at the start of
+    the compressed data, and the time taken in seconds."""
+    startTime = time.time()
+    infile = open(filename, 'rb') if filename is not None else None
+    outfile = tempfile.TemporaryFile()
+    cmpr = zlib.compressobj(level, zlib.DEFLATED, -15)
+    CRC = 0
+    fileSize = 0
+    compressSize = 0
+    offset = 0
+    while True:
+        if infile is not None:
+            block = infile.read(BLOCK_SIZE)
+        else:
+            block = data[offset:offset + BLOCK_SIZE]
+            offset += len(block)
+        if not block:
+            break
+        fileSize += len(block)
+        CRC = zlib.crc32(block, CRC) & 0xffffffff
+        block = cmpr.compress(block)
+        compressSize += len(block)
+        outfile.write(block)
+    block = cmpr.flush()
+    compressSize += len(block)
+    outfile.write(block)
+    if infile is not None:
+        infile.close()
+    zinfo.CRC = CRC
+    zinfo.file_size = fileSize
+    zinfo.compress_size = compressSize
+    outfile.seek(0)
+    return (outfile, time.time() - startTime)
+
+class CompressionPolicy:
+    """Decides how each member of an archive is compressed. Members with a mimetype in storeTypes,
+    or with an archive file extension, are compressed already and so are stored as they are. All
+    others are deflated at the given zlib level, using up to threads threads."""
+
+    def __init__(self, level=6, storeTypes=None, threads=1):
+        self.level = level
+        self.storeTypes = storeTypes if storeTypes is not None else COMPRESSED_MIMETYPES
+        self.threads = threads
+
+    def compressType(self, arcname, mimetype=None):
+        """Return the zipfile compression type to use for a member"""
+        if os.path.splitext(arcname)[1].lower() in ARCHIVE_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        if mimetype is None:
+            mimetype = mimetypes.guess_type(arcname)[0]
+        if self.level == 0 or mimetype in self.storeTypes:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+class ArchiveWriter:
+    """Adds members to a ZipFile opened for writing, compressing each according to a CompressionPolicy.
+
+    Members which are deflated are compressed in a pool of threads if the policy allows, and are
+    added to the archive in the order they were given. Each member being compressed holds a temporary
+    file open, so at most maxPending members are compressed at once, two per thread by default. Counts
+    of the bytes stored, deflated and copied are kept in the stats dictionary."""
+
+    def __init__(self, zipFile, policy=None, maxPending=None):
+        self.zipFile = zipFile
+        self.policy = policy or CompressionPolicy()
+        self.pool = ThreadPool(self.policy.threads) if self.policy.threads > 1 else None
+        self.pending = []
+        self.maxPending = maxPending or self.policy.threads * 2
+        self.stats = { 'stored': 0, 'deflated': 0, 'deflatedSize': 0, 'deflateTime': 0.0, 'copied': 0 }
+
+    def write(self, filename, arcname=None, mimetype=None):
+        """Add a file to the archive"""
+        arcname = arcname or os.path.basename(filename)
+        if os.path.isdir(filename):
+            self.zipFile.write(filename, arcname)
+            return
+        compressType = self.policy.compressType(arcname, mimetype)
+        if compressType == zipfile.ZIP_STORED:
+            self._flush()
+            self.zipFile.write(filename, arcname, zipfile.ZIP_STORED)
+            self.stats['stored'] += os.path.getsize(filename)
+        else:
+            st = os.stat(filename)
+            zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+            zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+            self._deflate(zinfo, filename=filename)
+
+    def writestr(self, arcname, data, mimetype=None):
+        """Add a member to the archive from a string of data"""
+        zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[0:6])
+        zinfo.external_attr = 0600 << 16
+        if self.policy.compressType(arcname, mimetype) == zipfile.ZIP_STORED:
+            self._flush()
+            zinfo.compress_type = zipfile.ZIP_STORED
+            self.zipFile.writestr(zinfo, data)
+            self.stats['stored'] += len(data)
+        else:
+            self._deflate(zinfo, data=data)
+
+    def copy(self, srcZip, name, arcname=None):
+        """Copy a member from another archive without recompressing it"""
+        self._flush()
+        zinfo = copyMember(srcZip, name, self.zipFile, arcname)
+        self.stats['copied'] += zinfo.compress_size
+
+    def close(self):
+        """Add any members still being compressed and close the archive. Returns the stats."""
+        try:
+            self._flush()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+            self.zipFile.close()
+        return self.stats
+
+    def _deflate(self, zinfo, filename=None, data=None):
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        if self.pool is not None:
+            self.pending.append((zinfo, self.pool.apply_async(deflate, (zinfo, self.policy.level, filename, data))))
+            # Add members which have finished, waiting for the oldest if too many are still pending
+            while len(self.pending) > 0 and (len(self.pending) >= self.maxPending or self.pending[0][1].ready()):
+                (zinfo, result) = self.pending.pop(0)
+                self._add(zinfo, result.get())
+        else:
+            self._add(zinfo, deflate(zinfo, self.policy.level, filename, data))
+
+    def _add(self, zinfo, result):
+        (fp, seconds) = result
+        try:
+            writeRawMember(self.zipFile, zinfo, fp)
+        finally:
+            fp.close()
+        self.stats['deflated'] += zinfo.file_size
+        self.stats['deflatedSize'] += zinfo.compress_size
+        self.stats['deflateTime'] += seconds
+
+    def _flush(self):
+        """Add members compressed in the thread pool to the archive, in order"""
+        while len(self.pending) > 0:
+            (zinfo, result) = self.pending.pop(0)
+            self._add(zinfo, result.get())